@@ -0,0 +1,6 @@
+import os
+
+# Benchmarks never reach GCP, but backend modules read these at import time
+os.environ.setdefault("GCLOUD_PROJECT", "benchmarks")
+os.environ.setdefault("TARGET_TOPIC", "trade-events")
+os.environ.setdefault("INSUFFICIENT_FUNDS_TOPIC", "insufficient-funds")
@@ -0,0 +1,1015 @@
+"""In-memory stand-ins for the external services the backend talks to.
+
+Each fake counts its round trips in a shared `RoundTrips` and sleeps for an injectable
+per-call latency, so hot paths can be measured without GCP or the exchange.
+"""
+
+import copy
+import itertools
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, NamedTuple, Optional
+
+from coinbasepro import PublicClient
+from coinbasepro.exceptions import (
+    BadRequest,
+    CoinbaseAPIError,
+    InvalidAPIKey as InvalidCoinbaseProAPIKey,
+)
+from google.api_core.exceptions import (
+    Aborted,
+    AlreadyExists,
+    FailedPrecondition,
+    NotFound,
+)
+from google.cloud import firestore, secretmanager
+from google.cloud.firestore_v1 import _helpers as firestore_helpers
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from backend.core.cbpro_client_helper import CbProAuthenticatedClient
+
+
+class Latency(NamedTuple):
+    """Seconds slept on every round trip to each service."""
+
+    firestore: float = 0.0
+    pubsub: float = 0.0
+    secrets: float = 0.0
+    exchange: float = 0.0
+
+
+class RoundTrips:
+    """Thread-safe count of calls made to each (service, operation)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def record(self, service: str, op: str) -> None:
+        with self._lock:
+            self._counts[(service, op)] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+    def total(self, service: Optional[str] = None) -> int:
+        with self._lock:
+            return sum(
+                count
+                for (svc, _), count in self._counts.items()
+                if service is None or svc == service
+            )
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            by_service = {}
+            for (service, op), count in sorted(self._counts.items()):
+                by_service.setdefault(service, {})[op] = count
+            return by_service
+
+
+class _FakeService:
+    _SERVICE = None
+
+    def __init__(self, latency: float, round_trips: RoundTrips):
+        self._latency = latency
+        self._round_trips = round_trips
+
+    def _round_trip(self, op: str) -> None:
+        self._round_trips.record(self._SERVICE, op)
+        if self._latency:
+            time.sleep(self._latency)
+
+
+# --------------------------------------------------------------------------------------
+# Firestore
+# --------------------------------------------------------------------------------------
+
+
+def _get_field(data: dict, field_path: str):
+    value = data
+    for part in FieldPath.from_string(field_path).parts:
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+
+def _resolve_transform(current, value, commit_time: datetime):
+    if value is firestore.SERVER_TIMESTAMP:
+        return commit_time
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        current = list(current) if isinstance(current, list) else []
+        return current + [v for v in value.values if v not in current]
+    if isinstance(value, transforms.ArrayRemove):
+        current = list(current) if isinstance(current, list) else []
+        return [v for v in current if v not in value.values]
+    return copy.deepcopy(value)
+
+
+def _set_field(data: dict, parts: tuple, value, commit_time: datetime) -> None:
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    if value is firestore.DELETE_FIELD:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = _resolve_transform(data.get(parts[-1]), value, commit_time)
+
+
+def _merge_fields(data: dict, values: dict, commit_time: datetime) -> None:
+    for key, value in values.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            _merge_fields(data[key], value, commit_time)
+        else:
+            _set_field(data, (key,), value, commit_time)
+
+
+class _StoredDocument:
+    def __init__(self, data: dict, create_time: datetime, update_time: datetime):
+        self.data = data
+        self.create_time = create_time
+        self.update_time = update_time
+
+
+class FakeDocumentSnapshot:
+    def __init__(
+        self,
+        reference: "FakeDocumentReference",
+        data: Optional[dict],
+        create_time: Optional[datetime] = None,
+        update_time: Optional[datetime] = None,
+    ):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = datetime.now(timezone.utc)
+
+    @property
+    def id(self) -> str:
+        return self.reference.id
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def get(self, field_path: str):
+        if self._data is None:
+            return None
+        return copy.deepcopy(_get_field(self._data, field_path))
+
+    def to_dict(self) -> Optional[dict]:
+        return copy.deepcopy(self._data)
+
+
+class FakeDocumentReference:
+    def __init__(self, client: "FakeFirestore", path: str):
+        self._client = client
+        self.path = path
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    @property
+    def id(self) -> str:
+        return self.path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, collection_id: str) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None) -> FakeDocumentSnapshot:
+        self._client._round_trip("get")
+        return self._client._read(self, transaction)
+
+    def create(self, document_data: dict):
+        return self._client._commit([("create", self, document_data, None)])
+
+    def set(self, document_data: dict, merge: bool = False):
+        op = "merge" if merge else "set"
+        return self._client._commit([(op, self, document_data, None)])
+
+    def update(self, field_updates: dict, option=None):
+        return self._client._commit([("update", self, field_updates, option)])
+
+    def delete(self, option=None):
+        return self._client._commit([("delete", self, None, option)])
+
+
+class FakeQuery:
+    def __init__(
+        self,
+        client: "FakeFirestore",
+        parent_path: Optional[str] = None,
+        group_id: Optional[str] = None,
+        filters: tuple = (),
+        orders: tuple = (),
+        limit: Optional[int] = None,
+        start_after: Optional[tuple] = None,
+        name_range: tuple = (None, None),
+        name_after: Optional[str] = None,
+    ):
+        self._client = client
+        self._parent_path = parent_path
+        self._group_id = group_id
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit
+        self._start_after = start_after
+        # [start, end) document paths, set on the queries of partitions
+        self._name_range = name_range
+        self._name_after = name_after
+
+    def _copy(self, **overrides) -> "FakeQuery":
+        params = dict(
+            parent_path=self._parent_path,
+            group_id=self._group_id,
+            filters=self._filters,
+            orders=self._orders,
+            limit=self._limit,
+            start_after=self._start_after,
+            name_range=self._name_range,
+            name_after=self._name_after,
+        )
+        params.update(overrides)
+        return FakeQuery(self._client, **params)
+
+    def where(self, field_path: str, op_string: str, value) -> "FakeQuery":
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "FakeQuery":
+        if field_path == "__name__":
+            # Results are already in name order, only ascending is supported
+            assert direction == "ASCENDING"
+            return self
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._copy(limit=count)
+
+    def start_at(self, document_fields: dict) -> "FakeQuery":
+        # Only name cursors, as used on partitions
+        return self._copy(
+            name_range=(document_fields["__name__"].path, self._name_range[1])
+        )
+
+    def end_before(self, document_fields: dict) -> "FakeQuery":
+        return self._copy(
+            name_range=(self._name_range[0], document_fields["__name__"].path)
+        )
+
+    def start_after(self, document_fields) -> "FakeQuery":
+        if isinstance(document_fields, dict) and "__name__" in document_fields:
+            return self._copy(name_after=document_fields["__name__"].path)
+        if isinstance(document_fields, FakeDocumentSnapshot):
+            cursor = tuple(document_fields.get(field) for field, _ in self._orders) + (
+                document_fields.reference.path,
+            )
+        else:
+            cursor = tuple(document_fields[field] for field, _ in self._orders)
+        return self._copy(start_after=cursor)
+
+    def get_partitions(self, partition_count: int):
+        """Split points over every document of the group, as a partition query does."""
+        self._client._round_trip("partition_query")
+        with self._client._lock:
+            paths = sorted(
+                self._client._candidate_paths(self._parent_path, self._group_id),
+                key=_name_order,
+            )
+        step = -(-len(paths) // partition_count) if paths else 1
+        split_points = [
+            FakeDocumentReference(self._client, path) for path in paths[step::step]
+        ]
+        start_at = None
+        for end_at in split_points:
+            yield FakeQueryPartition(self, start_at, end_at)
+            start_at = end_at
+        yield FakeQueryPartition(self, start_at, None)
+
+    def _in_name_range(self, path: str) -> bool:
+        start, end = self._name_range
+        if start is not None and _name_order(path) < _name_order(start):
+            return False
+        if self._name_after is not None and _name_order(path) <= _name_order(
+            self._name_after
+        ):
+            return False
+        return end is None or _name_order(path) < _name_order(end)
+
+    def _matches(self, path: str, data: dict) -> bool:
+        if not self._in_name_range(path):
+            return False
+        collection_path = path.rsplit("/", 1)[0]
+        if self._group_id is not None:
+            if collection_path.rsplit("/", 1)[-1] != self._group_id:
+                return False
+        elif collection_path != self._parent_path:
+            return False
+
+        for field_path, op, value in self._filters:
+            try:
+                field_value = _get_field(data, field_path)
+            except KeyError:
+                return False
+            if not _compare(field_value, op, value):
+                return False
+        return True
+
+    def _sort_key(self, item):
+        path, data = item
+        # Documents missing an ordered field are left out by Firestore, see `_visible`
+        return tuple(_get_field(data, field) for field, _ in self._orders) + (path,)
+
+    def _visible(self, items):
+        ordered_fields = [field for field, _ in self._orders]
+        for path, data in items:
+            try:
+                for field in ordered_fields:
+                    _get_field(data, field)
+            except KeyError:
+                continue
+            yield path, data
+
+    def _run(self, transaction=None) -> List[FakeDocumentSnapshot]:
+        self._client._round_trip("run_query")
+        with self._client._lock:
+            items = [
+                (path, self._client._docs[path].data)
+                for path in self._client._candidate_paths(
+                    self._parent_path, self._group_id
+                )
+                if self._matches(path, self._client._docs[path].data)
+            ]
+            items = list(self._visible(items))
+            items.sort(key=lambda item: _name_order(item[0]))
+            for field, direction in reversed(self._orders):
+                items.sort(
+                    key=lambda item, f=field: _get_field(item[1], f),
+                    reverse=direction == firestore.Query.DESCENDING,
+                )
+            if self._start_after is not None:
+                cursor_len = len(self._start_after)
+                items = [
+                    item
+                    for item in items
+                    if _after_cursor(
+                        self._sort_key(item)[:cursor_len],
+                        self._start_after,
+                        self._orders,
+                    )
+                ]
+            if self._limit is not None:
+                items = items[: self._limit]
+            return [
+                self._client._read(
+                    FakeDocumentReference(self._client, path), transaction
+                )
+                for path, _ in items
+            ]
+
+    def stream(self, transaction=None):
+        return iter(self._run(transaction))
+
+    def get(self, transaction=None) -> List[FakeDocumentSnapshot]:
+        return self._run(transaction)
+
+
+class FakeQueryPartition:
+    def __init__(self, query: FakeQuery, start_at, end_at):
+        self._query = query
+        self.start_at = start_at
+        self.end_at = end_at
+
+    def query(self) -> FakeQuery:
+        # Like the real one, keeps only the group and the cursors of the partitioned query
+        return FakeQuery(
+            self._query._client,
+            parent_path=self._query._parent_path,
+            group_id=self._query._group_id,
+            name_range=(
+                self.start_at.path if self.start_at else None,
+                self.end_at.path if self.end_at else None,
+            ),
+        )
+
+
+def _name_order(path: str) -> tuple:
+    # Firestore orders document names segment by segment
+    return tuple(path.split("/"))
+
+
+def _compare(field_value, op: str, value) -> bool:
+    if op == "==":
+        return field_value == value
+    if op == "!=":
+        return field_value != value
+    if op == "<":
+        return field_value < value
+    if op == "<=":
+        return field_value <= value
+    if op == ">":
+        return field_value > value
+    if op == ">=":
+        return field_value >= value
+    if op == "in":
+        return field_value in value
+    if op == "not-in":
+        return field_value not in value
+    if op == "array_contains":
+        return isinstance(field_value, list) and value in field_value
+    if op == "array_contains_any":
+        return isinstance(field_value, list) and any(v in field_value for v in value)
+    raise ValueError(f"Unsupported operator '{op}'")
+
+
+def _after_cursor(key: tuple, cursor: tuple, orders: tuple) -> bool:
+    for i, (k, c) in enumerate(zip(key, cursor)):
+        if k == c:
+            continue
+        descending = i < len(orders) and orders[i][1] == firestore.Query.DESCENDING
+        return k < c if descending else k > c
+    return False
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: "FakeFirestore", path: str):
+        super(FakeCollectionReference, self).__init__(client, parent_path=path)
+        self.path = path
+
+    @property
+    def id(self) -> str:
+        return self.path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self) -> Optional[FakeDocumentReference]:
+        if "/" not in self.path:
+            return None
+        return FakeDocumentReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocumentReference:
+        document_id = document_id or self._client._auto_id()
+        return FakeDocumentReference(self._client, f"{self.path}/{document_id}")
+
+    def add(self, document_data: dict, document_id: Optional[str] = None):
+        doc_ref = self.document(document_id)
+        write_result = doc_ref.create(document_data)
+        return write_result.update_time, doc_ref
+
+    def list_documents(self) -> List[FakeDocumentReference]:
+        self._client._round_trip("list_documents")
+        with self._client._lock:
+            return [
+                FakeDocumentReference(self._client, path)
+                for path in sorted(self._client._paths_by_collection.get(self.path, ()))
+            ]
+
+
+class FakeWriteBatch:
+    def __init__(self, client: "FakeFirestore"):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data: dict) -> None:
+        self._writes.append(("create", reference, document_data, None))
+
+    def set(self, reference, document_data: dict, merge: bool = False) -> None:
+        self._writes.append(
+            ("merge" if merge else "set", reference, document_data, None)
+        )
+
+    def update(self, reference, field_updates: dict, option=None) -> None:
+        self._writes.append(("update", reference, field_updates, option))
+
+    def delete(self, reference, option=None) -> None:
+        self._writes.append(("delete", reference, None, option))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Optimistic transaction: commit aborts if a document read in it has changed since.
+
+    Implements the private hooks `firestore.transactional` drives, so decorated
+    functions run (and retry) against it unmodified.
+    """
+
+    def __init__(
+        self, client: "FakeFirestore", max_attempts: int = 5, read_only: bool = False
+    ):
+        super(FakeTransaction, self).__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._read_versions = {}
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    @property
+    def id(self):
+        return self._id
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    def _begin(self, retry_id=None) -> None:
+        self._client._round_trip("begin_transaction")
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self) -> None:
+        self._client._round_trip("rollback")
+        self._clean_up()
+
+    def _commit(self):
+        writes = self._writes
+        read_versions = self._read_versions
+        self._clean_up()
+        return self._client._commit(writes, read_versions)
+
+    def _record_read(self, path: str, version: int) -> None:
+        self._read_versions.setdefault(path, version)
+
+
+class FakeFirestore(_FakeService):
+    _SERVICE = "firestore"
+
+    def __init__(self, latency: float = 0.0, round_trips: Optional[RoundTrips] = None):
+        super(FakeFirestore, self).__init__(latency, round_trips or RoundTrips())
+        self._lock = threading.RLock()
+        self._docs: Dict[str, _StoredDocument] = {}
+        self._paths_by_collection: Dict[str, set] = defaultdict(set)
+        # Bumped on every write to a path, deletes included, for transaction conflicts
+        self._versions = Counter()
+        self._ids = itertools.count()
+
+    field_path = staticmethod(firestore.Client.field_path)
+    write_option = staticmethod(firestore.Client.write_option)
+
+    def _auto_id(self) -> str:
+        # Sequential rather than random so seeded runs produce the same IDs
+        return f"auto{next(self._ids):016x}"
+
+    def collection(self, *collection_path: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, "/".join(collection_path))
+
+    def document(self, *document_path: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self, "/".join(document_path))
+
+    def collection_group(self, collection_id: str) -> FakeQuery:
+        return FakeQuery(self, group_id=collection_id)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False):
+        return FakeTransaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        self._round_trip("batch_get")
+        unique_refs = {ref.path: ref for ref in references}
+        return iter([self._read(ref, transaction) for ref in unique_refs.values()])
+
+    def _candidate_paths(self, parent_path: Optional[str], group_id: Optional[str]):
+        if group_id is None:
+            return list(self._paths_by_collection.get(parent_path, ()))
+        return [
+            path
+            for collection_path, paths in self._paths_by_collection.items()
+            if collection_path.rsplit("/", 1)[-1] == group_id
+            for path in paths
+        ]
+
+    def _read(self, reference: FakeDocumentReference, transaction=None):
+        with self._lock:
+            doc = self._docs.get(reference.path)
+            if transaction is not None:
+                transaction._record_read(reference.path, self._versions[reference.path])
+            if doc is None:
+                return FakeDocumentSnapshot(reference, None)
+            return FakeDocumentSnapshot(
+                reference, copy.deepcopy(doc.data), doc.create_time, doc.update_time
+            )
+
+    def _check_precondition(self, path: str, option) -> None:
+        if option is None:
+            return
+        doc = self._docs.get(path)
+        if isinstance(option, firestore_helpers.ExistsOption):
+            if option._exists != (doc is not None):
+                raise FailedPrecondition(f"Precondition failed on '{path}'")
+        elif isinstance(option, firestore_helpers.LastUpdateOption):
+            if doc is None or doc.update_time != option._last_update_time:
+                raise FailedPrecondition(f"Document '{path}' was updated since read")
+
+    def _commit(self, writes: list, read_versions: Optional[dict] = None):
+        self._round_trip("commit")
+        with self._lock:
+            for path, version in (read_versions or {}).items():
+                if self._versions[path] != version:
+                    raise Aborted(f"Transaction lost a race on '{path}'")
+
+            # Validate every write before applying any, commits are all-or-nothing
+            exists_after = {}
+            for op, ref, _, option in writes:
+                self._check_precondition(ref.path, option)
+                exists = exists_after.get(ref.path, ref.path in self._docs)
+                if op == "create" and exists:
+                    raise AlreadyExists(f"Document already exists: {ref.path}")
+                if op == "update" and not exists:
+                    raise NotFound(f"No document to update: {ref.path}")
+                exists_after[ref.path] = op != "delete"
+
+            commit_time = datetime.now(timezone.utc)
+            for op, ref, values, _ in writes:
+                self._apply(op, ref.path, values, commit_time)
+                self._versions[ref.path] += 1
+            return SimpleNamespace(update_time=commit_time)
+
+    def _apply(self, op: str, path: str, values: dict, commit_time: datetime) -> None:
+        collection_path = path.rsplit("/", 1)[0]
+        if op == "delete":
+            self._docs.pop(path, None)
+            self._paths_by_collection[collection_path].discard(path)
+            return
+
+        doc = self._docs.get(path)
+        if doc is None:
+            doc = _StoredDocument({}, commit_time, commit_time)
+            self._docs[path] = doc
+            self._paths_by_collection[collection_path].add(path)
+        if op in ("create", "set"):
+            doc.data = {}
+            _merge_fields(doc.data, values, commit_time)
+        elif op == "merge":
+            _merge_fields(doc.data, values, commit_time)
+        elif op == "update":
+            for field_path, value in values.items():
+                _set_field(
+                    doc.data,
+                    FieldPath.from_string(field_path).parts,
+                    value,
+                    commit_time,
+                )
+        doc.update_time = commit_time
+
+    def document_count(self) -> int:
+        with self._lock:
+            return len(self._docs)
+
+
+# --------------------------------------------------------------------------------------
+# Pub/Sub
+# --------------------------------------------------------------------------------------
+
+
+class FakePublisherClient(_FakeService):
+    """Batches published messages like the real client, one round trip per batch."""
+
+    _SERVICE = "pubsub"
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        round_trips: Optional[RoundTrips] = None,
+        max_batch_messages: int = 100,
+        max_batch_latency: float = 0.01,
+        max_concurrent_batches: int = 8,
+    ):
+        super(FakePublisherClient, self).__init__(latency, round_trips or RoundTrips())
+        self._max_batch_messages = max_batch_messages
+        self._max_batch_latency = max_batch_latency
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.messages = []
+        self._batch_executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_batches, thread_name_prefix="fake-pubsub"
+        )
+        threading.Thread(target=self._batch_messages, daemon=True).start()
+
+    @staticmethod
+    def topic_path(project: str, topic: str) -> str:
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic: str, data: bytes, **attrs) -> Future:
+        future = Future()
+        self._queue.put((topic, data, attrs, future))
+        return future
+
+    def _batch_messages(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._max_batch_latency
+            while len(batch) < self._max_batch_messages:
+                try:
+                    batch.append(
+                        self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    )
+                except queue.Empty:
+                    break
+            self._batch_executor.submit(self._commit_batch, batch)
+
+    def _commit_batch(self, batch: list) -> None:
+        self._round_trip("publish")
+        with self._lock:
+            for topic, data, attrs, _ in batch:
+                self.messages.append((topic, data, attrs))
+        for _, _, _, future in batch:
+            future.set_result(uuid.uuid4().hex)
+
+    def decoded_messages(self, topic: Optional[str] = None) -> List[dict]:
+        from backend.core.pubsub_helper import decode_message_data
+
+        with self._lock:
+            return [
+                decode_message_data(data)
+                for t, data, _ in self.messages
+                if topic is None or t.endswith(f"/topics/{topic}")
+            ]
+
+
+# --------------------------------------------------------------------------------------
+# Secret Manager
+# --------------------------------------------------------------------------------------
+
+
+class FakeSecretManagerClient(_FakeService):
+    _SERVICE = "secrets"
+
+    _ENABLED = secretmanager.SecretVersion.State.ENABLED
+    _DESTROYED = secretmanager.SecretVersion.State.DESTROYED
+
+    def __init__(self, latency: float = 0.0, round_trips: Optional[RoundTrips] = None):
+        super(FakeSecretManagerClient, self).__init__(
+            latency, round_trips or RoundTrips()
+        )
+        self._lock = threading.Lock()
+        # Qualified secret name -> list of versions, oldest first
+        self._secrets: Dict[str, List[SimpleNamespace]] = {}
+
+    @staticmethod
+    def _request_field(request, kwargs: dict, field: str):
+        if request is not None:
+            return request[field]
+        return kwargs[field]
+
+    def _versions(self, secret_name: str) -> List[SimpleNamespace]:
+        if secret_name not in self._secrets:
+            raise NotFound(f"Secret [{secret_name}] not found")
+        return self._secrets[secret_name]
+
+    def access_secret_version(self, request=None, **kwargs):
+        self._round_trip("access_secret_version")
+        name = self._request_field(request, kwargs, "name")
+        secret_name, version = name.rsplit("/versions/", 1)
+        with self._lock:
+            enabled = [
+                v for v in self._versions(secret_name) if v.state == self._ENABLED
+            ]
+            if version != "latest":
+                enabled = [v for v in enabled if v.name == name]
+            if not enabled:
+                raise NotFound(f"Secret version [{name}] not found")
+            return SimpleNamespace(
+                name=enabled[-1].name, payload=SimpleNamespace(data=enabled[-1].data)
+            )
+
+    def get_secret(self, request=None, **kwargs):
+        self._round_trip("get_secret")
+        name = self._request_field(request, kwargs, "name")
+        with self._lock:
+            self._versions(name)
+        return SimpleNamespace(name=name)
+
+    def create_secret(self, request=None, **kwargs):
+        self._round_trip("create_secret")
+        parent = self._request_field(request, kwargs, "parent")
+        secret_id = self._request_field(request, kwargs, "secret_id")
+        name = f"{parent}/secrets/{secret_id}"
+        with self._lock:
+            if name in self._secrets:
+                raise AlreadyExists(f"Secret [{name}] already exists")
+            self._secrets[name] = []
+        return SimpleNamespace(name=name)
+
+    def add_secret_version(self, request=None, **kwargs):
+        self._round_trip("add_secret_version")
+        parent = self._request_field(request, kwargs, "parent")
+        payload = self._request_field(request, kwargs, "payload")
+        with self._lock:
+            versions = self._versions(parent)
+            version = SimpleNamespace(
+                name=f"{parent}/versions/{len(versions) + 1}",
+                data=payload["data"],
+                state=self._ENABLED,
+            )
+            versions.append(version)
+        return SimpleNamespace(name=version.name, state=version.state)
+
+    def list_secret_versions(self, request=None, **kwargs):
+        self._round_trip("list_secret_versions")
+        parent = self._request_field(request, kwargs, "parent")
+        with self._lock:
+            return [
+                SimpleNamespace(name=v.name, state=v.state)
+                for v in reversed(self._versions(parent))
+            ]
+
+    def destroy_secret_version(self, request=None, **kwargs):
+        self._round_trip("destroy_secret_version")
+        name = self._request_field(request, kwargs, "name")
+        secret_name = name.rsplit("/versions/", 1)[0]
+        with self._lock:
+            for version in self._versions(secret_name):
+                if version.name == name:
+                    version.state = self._DESTROYED
+                    version.data = None
+                    return SimpleNamespace(name=name, state=version.state)
+        raise NotFound(f"Secret version [{name}] not found")
+
+    def delete_secret(self, request=None, **kwargs):
+        self._round_trip("delete_secret")
+        name = self._request_field(request, kwargs, "name")
+        with self._lock:
+            self._versions(name)
+            del self._secrets[name]
+
+
+# --------------------------------------------------------------------------------------
+# Exchange
+# --------------------------------------------------------------------------------------
+
+
+class _Portfolio:
+    def __init__(self, profile_id: str, name: str, usd_available: float):
+        self.profile_id = profile_id
+        self.name = name
+        self.usd_available = usd_available
+
+
+class FakeExchange(_FakeService):
+    """Coinbase Pro endpoints used by the backend, answered from memory."""
+
+    _SERVICE = "exchange"
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        round_trips: Optional[RoundTrips] = None,
+        products: Optional[List[dict]] = None,
+    ):
+        super(FakeExchange, self).__init__(latency, round_trips or RoundTrips())
+        self._lock = threading.Lock()
+        self._portfolio_by_api_key: Dict[str, _Portfolio] = {}
+        self.products = products or []
+        self.orders = []
+
+    def add_portfolio(
+        self,
+        api_key: str,
+        profile_id: Optional[str] = None,
+        name: str = "default portfolio",
+        usd_available: float = 1000.0,
+    ) -> str:
+        profile_id = profile_id or str(uuid.uuid4())
+        with self._lock:
+            self._portfolio_by_api_key[api_key] = _Portfolio(
+                profile_id, name, usd_available
+            )
+        return profile_id
+
+    def _portfolio(self, api_key: str) -> _Portfolio:
+        if api_key not in self._portfolio_by_api_key:
+            raise InvalidCoinbaseProAPIKey("Invalid API Key")
+        return self._portfolio_by_api_key[api_key]
+
+    def handle(self, api_key: str, method: str, endpoint: str, data: Optional[str]):
+        self._round_trip(f"{method.upper()} {endpoint.split('/')[1]}")
+        with self._lock:
+            if endpoint == "/products":
+                return copy.deepcopy(self.products)
+
+            portfolio = self._portfolio(api_key)
+            if method == "get" and endpoint == "/accounts/":
+                return [
+                    {
+                        "id": f"{portfolio.profile_id}-usd",
+                        "currency": "USD",
+                        "balance": f"{portfolio.usd_available:.2f}",
+                        "available": f"{portfolio.usd_available:.2f}",
+                        "hold": "0.00",
+                        "profile_id": portfolio.profile_id,
+                        "trading_enabled": True,
+                    },
+                    {
+                        "id": f"{portfolio.profile_id}-btc",
+                        "currency": "BTC",
+                        "balance": "0.0",
+                        "available": "0.0",
+                        "hold": "0.0",
+                        "profile_id": portfolio.profile_id,
+                        "trading_enabled": True,
+                    },
+                ]
+            if method == "get" and endpoint.startswith("/profiles/"):
+                if endpoint != f"/profiles/{portfolio.profile_id}":
+                    raise CoinbaseAPIError("NotFound")
+                return {
+                    "id": portfolio.profile_id,
+                    "name": portfolio.name,
+                    "active": True,
+                    "is_default": True,
+                }
+            if method == "get" and endpoint.startswith("/orders/client:"):
+                client_oid = endpoint[len("/orders/client:") :]
+                for order in self.orders:
+                    if (
+                        order["api_key"] == api_key
+                        and order["client_oid"] == client_oid
+                    ):
+                        return {
+                            key: value
+                            for key, value in order.items()
+                            if key != "api_key"
+                        }
+                raise CoinbaseAPIError("NotFound")
+            if method == "post" and endpoint == "/orders":
+                order = json.loads(data)
+                funds = float(order["funds"])
+                if funds > portfolio.usd_available:
+                    raise BadRequest("Insufficient funds")
+                portfolio.usd_available -= funds
+                order_id = str(uuid.uuid4())
+                self.orders.append(dict(order, id=order_id, api_key=api_key))
+                return {
+                    "id": order_id,
+                    "product_id": order["product_id"],
+                    "side": order["side"],
+                    "type": order["type"],
+                    "funds": order["funds"],
+                    "status": "pending",
+                }
+        raise CoinbaseAPIError(f"Unsupported endpoint {method.upper()} {endpoint}")
+
+    def client_class(self) -> type:
+        """`CbProAuthenticatedClient` subclass whose requests this exchange answers."""
+        exchange = self
+
+        class FakeCbProAuthenticatedClient(CbProAuthenticatedClient):
+            def _send_message(
+                self, method, endpoint, params=None, data=None, rate_limiter=None
+            ):
+                # The client-side rate limiting is part of the real cost, keep it
+                if rate_limiter:
+                    rate_limiter.rate_limit()
+                return exchange.handle(self.auth.api_key, method, endpoint, data)
+
+        return FakeCbProAuthenticatedClient
+
+    def public_client(self, api_url: str) -> PublicClient:
+        exchange = self
+
+        class FakePublicClient(PublicClient):
+            def _send_message(
+                self, method, endpoint, params=None, data=None, rate_limiter=None
+            ):
+                if rate_limiter:
+                    rate_limiter.rate_limit()
+                return exchange.handle(None, method, endpoint, data)
+
+        return FakePublicClient(api_url=api_url)
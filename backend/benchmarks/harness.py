@@ -0,0 +1,103 @@
+from contextlib import contextmanager
+
+from backend.benchmarks.fakes import (
+    FakeExchange,
+    FakeFirestore,
+    FakePublisherClient,
+    FakeSecretManagerClient,
+    Latency,
+    RoundTrips,
+)
+from backend.core import (
+    cbpro_client_helper,
+    firestore_helper,
+    product_catalog,
+    profile,
+    pubsub_helper,
+    schedule_catalog,
+    user,
+)
+from backend.core.secrets import profile_secrets, secrets_helper
+
+
+class FakeBackend:
+    """Swaps the fakes in for the real clients for the duration of a `with` block."""
+
+    def __init__(self, latency: Latency = Latency()):
+        self.round_trips = RoundTrips()
+        self.firestore = FakeFirestore(latency.firestore, self.round_trips)
+        self.pubsub = FakePublisherClient(
+            latency.pubsub,
+            self.round_trips,
+            max_batch_messages=pubsub_helper._BATCH_SETTINGS.max_messages,
+            max_batch_latency=pubsub_helper._BATCH_SETTINGS.max_latency,
+        )
+        self.secrets = FakeSecretManagerClient(latency.secrets, self.round_trips)
+        self.exchange = FakeExchange(latency.exchange, self.round_trips)
+
+        self._saved = None
+
+    def reset_caches(self) -> None:
+        """Drop every in-process cache, so the next request runs cold."""
+        profile._GUID_CACHE.clear()
+        user._GUID_CACHE.clear()
+        profile_secrets._CREDENTIALS_CACHE.clear()
+        cbpro_client_helper._AUTHENTICATED_CLIENTS.clear()
+        cbpro_client_helper._ACCOUNTS_SNAPSHOTS.clear()
+        schedule_catalog._CATALOG._loaded_at = None
+        with product_catalog._CATALOGS_LOCK:
+            product_catalog._CATALOG_BY_NAMESPACE.clear()
+
+    @contextmanager
+    def seeding(self):
+        """Write fixtures without latency and without counting their round trips."""
+        services = (self.firestore, self.pubsub, self.secrets, self.exchange)
+        latencies = [service._latency for service in services]
+        for service in services:
+            service._latency = 0.0
+        try:
+            yield
+        finally:
+            for service, latency in zip(services, latencies):
+                service._latency = latency
+            self.round_trips.reset()
+
+    def install(self) -> None:
+        self._saved = (
+            firestore_helper._CLIENT,
+            pubsub_helper._CLIENT,
+            secrets_helper._CLIENT,
+            cbpro_client_helper.CbProAuthenticatedClient,
+            dict(cbpro_client_helper._CLIENT_BY_NAMESPACE),
+        )
+        firestore_helper._CLIENT = self.firestore
+        pubsub_helper._CLIENT = self.pubsub
+        secrets_helper._CLIENT = self.secrets
+        cbpro_client_helper.CbProAuthenticatedClient = self.exchange.client_class()
+        for (
+            namespace,
+            api_url,
+        ) in cbpro_client_helper.PROFILE_NAMESPACE_TO_API_URL.items():
+            cbpro_client_helper._CLIENT_BY_NAMESPACE[namespace] = (
+                self.exchange.public_client(api_url)
+            )
+        self.reset_caches()
+
+    def uninstall(self) -> None:
+        (
+            firestore_helper._CLIENT,
+            pubsub_helper._CLIENT,
+            secrets_helper._CLIENT,
+            cbpro_client_helper.CbProAuthenticatedClient,
+            client_by_namespace,
+        ) = self._saved
+        cbpro_client_helper._CLIENT_BY_NAMESPACE.clear()
+        cbpro_client_helper._CLIENT_BY_NAMESPACE.update(client_by_namespace)
+        self.reset_caches()
+
+    def __enter__(self) -> "FakeBackend":
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
@@ -0,0 +1,243 @@
+"""Offline benchmarks for the backend hot paths, run against the in-memory fakes.
+
+python -m backend.benchmarks.run fanout --deposits 1000 10000 100000
+python -m backend.benchmarks.run tradebot --events 2000 --concurrency 8
+python -m backend.benchmarks.run api --requests 500 --concurrency 8
+"""
+
+import argparse
+import base64
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List
+
+from backend.benchmarks.fakes import Latency
+from backend.benchmarks.harness import FakeBackend
+from backend.benchmarks.seed import seed_profiles, seed_schedules
+from backend.core.profile import SANDBOX_NS
+from backend.core.trade_spec import TRADE_EVENT_VERSION
+
+_SCHEDULE_ID = "every-hour"
+_DAILY_FREQUENCY = 24
+
+
+def build_argparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--firestore-latency-ms", default=5.0, type=float)
+    parser.add_argument("--pubsub-latency-ms", default=10.0, type=float)
+    parser.add_argument("--secrets-latency-ms", default=15.0, type=float)
+    parser.add_argument("--exchange-latency-ms", default=40.0, type=float)
+    parser.add_argument(
+        "--verbose", action="store_true", help="Keep the services' own log output"
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    fanout = subparsers.add_parser("fanout")
+    fanout.add_argument(
+        "--deposits", default=[1000, 10000, 100000], type=int, nargs="+"
+    )
+    fanout.add_argument("--repeat", default=3, type=int)
+
+    tradebot = subparsers.add_parser("tradebot")
+    tradebot.add_argument("--events", default=1000, type=int)
+    tradebot.add_argument("--concurrency", default=8, type=int)
+
+    api = subparsers.add_parser("api")
+    api.add_argument("--profiles", default=100, type=int)
+    api.add_argument("--requests", default=500, type=int)
+    api.add_argument("--concurrency", default=8, type=int)
+    return parser
+
+
+def _percentile(sorted_samples: List[float], pct: float) -> float:
+    index = min(
+        len(sorted_samples) - 1, int(round(pct / 100 * (len(sorted_samples) - 1)))
+    )
+    return sorted_samples[index]
+
+
+def _print_report(
+    name: str, samples: List[float], backend: FakeBackend, iterations: int
+) -> None:
+    samples = sorted(samples)
+    print(
+        f"{name}: {len(samples)} samples | "
+        f"p50 {1000 * _percentile(samples, 50):.1f}ms "
+        f"p95 {1000 * _percentile(samples, 95):.1f}ms "
+        f"p99 {1000 * _percentile(samples, 99):.1f}ms "
+        f"max {1000 * samples[-1]:.1f}ms"
+    )
+    print(f"  round trips per iteration ({iterations} iterations):")
+    for service, ops in backend.round_trips.to_dict().items():
+        per_op = ", ".join(
+            f"{op}={count / iterations:.2f}" for op, count in ops.items()
+        )
+        print(f"    {service}: {per_op}")
+
+
+@contextmanager
+def _service_logs_silenced(quiet: bool):
+    if not quiet:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        yield
+
+
+def _timed(fn: Callable, *args) -> float:
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def _run_concurrently(fn: Callable, items: list, concurrency: int) -> List[float]:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda item: _timed(fn, item), items))
+
+
+def bench_fanout(latency: Latency, deposits: int, repeat: int, seed: int, quiet: bool):
+    from backend.services import schedule_fanout
+
+    with FakeBackend(latency) as backend:
+        with backend.seeding():
+            seed_schedules(backend)
+            seed_profiles(backend, deposits, _SCHEDULE_ID, seed=seed)
+
+        def run_fanout(tick: int):
+            # A new schedule tick each time, a repeated one is a finished run
+            envelope = {
+                "message": {
+                    "data": base64.standard_b64encode(_SCHEDULE_ID.encode()).decode(),
+                    "publishTime": (
+                        datetime(2021, 6, 1, 12) + timedelta(minutes=tick)
+                    ).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                }
+            }
+            response = schedule_fanout.app.test_client().post("/", json=envelope)
+            assert response.status_code == 204, response.data
+
+        with _service_logs_silenced(quiet):
+            samples = [_timed(run_fanout, tick) for tick in range(repeat)]
+
+        published = len(backend.pubsub.decoded_messages())
+        assert published == deposits * repeat, f"Published {published} events"
+        _print_report(f"fanout[{deposits} deposits]", samples, backend, repeat)
+
+
+def bench_tradebot(
+    latency: Latency, events: int, concurrency: int, seed: int, quiet: bool
+):
+    from backend.services.tradebot import process_event_data
+
+    with FakeBackend(latency) as backend:
+        with backend.seeding():
+            seed_schedules(backend)
+            profiles = seed_profiles(backend, events, _SCHEDULE_ID, seed=seed)
+
+        # Same shape as the events published by the fanout, one per target deposit
+        scheduled_time = datetime(2021, 6, 1, 12, tzinfo=timezone.utc)
+        event_data = [
+            {
+                "version": TRADE_EVENT_VERSION,
+                "profile": {
+                    "namespace": SANDBOX_NS,
+                    "identifier": profile.identifier,
+                    "guid": profile.guid,
+                },
+                "product": product_id,
+                "deposit": {
+                    "amount": 100.0,
+                    "schedule": _SCHEDULE_ID,
+                    "daily_frequency": _DAILY_FREQUENCY,
+                },
+                "scheduled_time": (
+                    scheduled_time + timedelta(hours=i % _DAILY_FREQUENCY)
+                ).timestamp(),
+            }
+            for i, profile in enumerate(profiles)
+            for product_id in profile.products
+        ]
+        backend.round_trips.reset()
+
+        def run_event(data):
+            body, status = process_event_data(data)
+            assert status < 400, body
+
+        with _service_logs_silenced(quiet):
+            samples = _run_concurrently(run_event, event_data, concurrency)
+
+        assert len(backend.exchange.orders) == len(event_data)
+        _print_report(
+            f"tradebot[{len(event_data)} events, {concurrency} threads]",
+            samples,
+            backend,
+            len(event_data),
+        )
+
+
+def bench_api(
+    latency: Latency,
+    profiles: int,
+    requests: int,
+    concurrency: int,
+    seed: int,
+    quiet: bool,
+):
+    from backend.services.api import app
+
+    with FakeBackend(latency) as backend:
+        with backend.seeding():
+            seed_schedules(backend)
+            seeded = seed_profiles(backend, 4 * profiles, _SCHEDULE_ID, seed=seed)
+
+        rng = random.Random(seed)
+        picks = [rng.choice(seeded) for _ in range(requests)]
+        for name, path_for in (
+            ("portfolio", lambda p: f"/user/{p.user_guid}/portfolio/{p.guid}/v1"),
+            ("portfolios", lambda p: f"/user/{p.user_guid}/portfolios/v1"),
+        ):
+            backend.reset_caches()
+            backend.round_trips.reset()
+
+            def get(profile):
+                response = app.test_client().get(path_for(profile))
+                assert response.status_code == 200, response.data
+
+            with _service_logs_silenced(quiet):
+                samples = _run_concurrently(get, picks, concurrency)
+            _print_report(
+                f"api {name}[{requests} requests, {concurrency} threads]",
+                samples,
+                backend,
+                requests,
+            )
+
+
+if __name__ == "__main__":
+    argument_parser = build_argparser()
+    args = argument_parser.parse_args()
+
+    latency = Latency(
+        firestore=args.firestore_latency_ms / 1000,
+        pubsub=args.pubsub_latency_ms / 1000,
+        secrets=args.secrets_latency_ms / 1000,
+        exchange=args.exchange_latency_ms / 1000,
+    )
+    print(f"Latency per round trip: {latency}")
+    quiet = not args.verbose
+
+    if args.benchmark == "fanout":
+        for deposits in args.deposits:
+            bench_fanout(latency, deposits, args.repeat, args.seed, quiet)
+    elif args.benchmark == "tradebot":
+        bench_tradebot(latency, args.events, args.concurrency, args.seed, quiet)
+    else:
+        bench_api(
+            latency, args.profiles, args.requests, args.concurrency, args.seed, quiet
+        )
+    print("Done!")
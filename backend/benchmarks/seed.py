@@ -0,0 +1,122 @@
+import base64
+import random
+from typing import Dict, List, NamedTuple
+
+from backend.benchmarks.harness import FakeBackend
+from backend.core.profile import SANDBOX_NS, ProfileId
+from backend.core.schedule_membership import add_member
+from backend.core.secrets.secrets_helper import create_secret
+
+# Firestore caps a single batched write at 500 operations
+_MAX_BATCH_SIZE = 500
+
+SCHEDULES = {"every-hour": 24, "every-4-hours": 6, "daily": 1}
+
+PRODUCTS = [
+    {
+        "id": f"{base}-USD",
+        "min_market_funds": "1",
+        "quote_currency": "USD",
+        "trading_disabled": False,
+        "auction_mode": False,
+        "post_only": False,
+        "limit_only": False,
+        "cancel_only": False,
+    }
+    for base in ("BTC", "ETH", "LTC", "SOL", "ADA", "DOT", "XLM", "LINK")
+]
+
+
+class SeededProfile(NamedTuple):
+    guid: str
+    identifier: str
+    user_guid: str
+    products: List[str]
+
+
+def _hex_id(rng: random.Random, length: int = 20) -> str:
+    return "".join(rng.choice("0123456789abcdef") for _ in range(length))
+
+
+class _BatchWriter:
+    def __init__(self, backend: FakeBackend):
+        self._db = backend.firestore
+        self._batch = self._db.batch()
+
+    def set(self, ref, data: dict, merge: bool = False) -> None:
+        self._batch.set(ref, data, merge=merge)
+        if len(self._batch) == _MAX_BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self._batch):
+            self._batch.commit()
+            self._batch = self._db.batch()
+
+
+def seed_schedules(backend: FakeBackend, schedules: Dict[str, int] = SCHEDULES):
+    writer = _BatchWriter(backend)
+    for schedule_id, daily_frequency in schedules.items():
+        writer.set(
+            backend.firestore.collection("schedules").document(schedule_id),
+            {"daily_frequency": daily_frequency},
+        )
+    writer.flush()
+
+
+def seed_profiles(
+    backend: FakeBackend,
+    deposits: int,
+    schedule_id: str,
+    deposits_per_profile: int = 4,
+    seed: int = 0,
+) -> List[SeededProfile]:
+    """Profiles with credentials, exchange portfolios and `deposits` target deposits in total.
+
+    Target deposits are also added to the schedule membership index.
+    """
+    rng = random.Random(seed)
+    db = backend.firestore
+    writer = _BatchWriter(backend)
+    backend.exchange.products = PRODUCTS
+
+    profiles = []
+    remaining = deposits
+    while remaining > 0:
+        user_guid = _hex_id(rng)
+        writer.set(
+            db.collection("users").document(user_guid),
+            {"provider": "coinbase", "identifier": _hex_id(rng), "email": "-"},
+        )
+
+        guid = _hex_id(rng)
+        api_key = _hex_id(rng, 32)
+        identifier = backend.exchange.add_portfolio(
+            api_key, _hex_id(rng, 32), name=f"Portfolio {len(profiles)}"
+        )
+        writer.set(
+            db.collection("profiles").document(guid),
+            {"namespace": SANDBOX_NS, "identifier": identifier, "user": user_guid},
+        )
+        create_secret(f"API_KEY_{guid}", api_key)
+        create_secret(
+            f"API_SECRET_{guid}", base64.b64encode(_hex_id(rng, 32).encode()).decode()
+        )
+        create_secret(f"API_PASSPHRASE_{guid}", _hex_id(rng, 16))
+
+        products = rng.sample(
+            [p["id"] for p in PRODUCTS], min(deposits_per_profile, remaining)
+        )
+        profile_id = ProfileId(SANDBOX_NS, identifier, guid=guid)
+        for product_id in products:
+            amount = float(rng.randint(10, 100))
+            writer.set(
+                db.collection("profiles", guid, "target_deposits").document(product_id),
+                {"deposit_amount": amount, "schedule": schedule_id},
+            )
+            add_member(writer, schedule_id, profile_id, product_id, amount)
+        remaining -= len(products)
+        profiles.append(SeededProfile(guid, identifier, user_guid, products))
+
+    writer.flush()
+    return profiles
@@ -0,0 +1,126 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Dict, Optional, Union
+from urllib.parse import urlencode
+
+import httpx
+from coinbasepro.exceptions import (
+    BadRequest,
+    CoinbaseAPIError,
+    InvalidAPIKey as InvalidCoinbaseProAPIKey,
+    InvalidAuthorization,
+    RateLimitError,
+)
+
+from backend.core.aio.profile_secrets import get_api_credentials
+from backend.core.cbpro_client_helper import PROFILE_NAMESPACE_TO_API_URL
+from backend.core.profile import LOCAL_NS, ProfileId
+
+_HTTP_POOL_SIZE = int(os.environ.get("CBPRO_HTTP_POOL_SIZE", 16))
+_REQUEST_TIMEOUT_SECONDS = float(os.environ.get("CBPRO_REQUEST_TIMEOUT_SECONDS", 30))
+
+_HTTP_CLIENT_BY_API_URL: Dict[str, httpx.AsyncClient] = {}
+
+
+def _get_http_client(api_url: str) -> httpx.AsyncClient:
+    """Keep-alive HTTP client shared by every profile talking to `api_url`."""
+    if api_url not in _HTTP_CLIENT_BY_API_URL:
+        _HTTP_CLIENT_BY_API_URL[api_url] = httpx.AsyncClient(
+            base_url=api_url.rstrip("/"),
+            limits=httpx.Limits(
+                max_connections=_HTTP_POOL_SIZE,
+                max_keepalive_connections=_HTTP_POOL_SIZE,
+            ),
+            timeout=_REQUEST_TIMEOUT_SECONDS,
+        )
+    return _HTTP_CLIENT_BY_API_URL[api_url]
+
+
+def _raise_for_error(response: httpx.Response) -> None:
+    # Same mapping as `coinbasepro.PublicClient._check_errors_and_raise`
+    if 400 <= response.status_code < 600:
+        message = response.json()["message"]
+        if response.status_code == 400:
+            raise BadRequest(message)
+        elif response.status_code == 401:
+            raise InvalidCoinbaseProAPIKey(message)
+        elif response.status_code == 403:
+            raise InvalidAuthorization(message)
+        elif response.status_code == 429:
+            raise RateLimitError(message)
+        else:
+            raise CoinbaseAPIError(message)
+
+
+class AsyncCbProClient:
+    """The subset of `CbProAuthenticatedClient` the API service needs, on asyncio."""
+
+    def __init__(self, api_key: str, b64secret: str, passphrase: str, api_url: str):
+        self.url = api_url
+        self._api_key = api_key
+        self._b64secret = b64secret
+        self._passphrase = passphrase
+        self._http = _get_http_client(api_url)
+
+    def _auth_headers(self, method: str, path_url: str, body: str) -> dict:
+        # Signed the same way as `coinbasepro.auth.CoinbaseProAuth`
+        timestamp = str(time.time())
+        message = (timestamp + method + path_url + body).encode("ascii")
+        signature = hmac.new(base64.b64decode(self._b64secret), message, hashlib.sha256)
+        return {
+            "CB-ACCESS-SIGN": base64.b64encode(signature.digest()).decode(),
+            "CB-ACCESS-TIMESTAMP": timestamp,
+            "CB-ACCESS-KEY": self._api_key,
+            "CB-ACCESS-PASSPHRASE": self._passphrase,
+            "Content-Type": "application/json",
+        }
+
+    async def _send_message(
+        self, method: str, endpoint: str, params: Optional[Dict] = None, data=None
+    ) -> Union[list, dict]:
+        method = method.upper()
+        path_url = endpoint + (f"?{urlencode(params)}" if params else "")
+        body = json.dumps(data) if data is not None else ""
+        response = await self._http.request(
+            method,
+            path_url,
+            content=body or None,
+            headers=self._auth_headers(method, path_url, body),
+        )
+        _raise_for_error(response)
+        return response.json()
+
+    async def get_accounts(self) -> list:
+        return await self._send_message("get", "/accounts/")
+
+    async def get_profile(self, profile_id: str) -> dict:
+        return await self._send_message("get", "/profiles/" + profile_id)
+
+
+def get_client_for_credentials(
+    api_key: str, b64secret: str, passphrase: str, api_url: str
+) -> AsyncCbProClient:
+    # Cheap to build, all the connection state lives in the shared HTTP client
+    return AsyncCbProClient(api_key, b64secret, passphrase, api_url)
+
+
+async def get_client(profile: ProfileId) -> AsyncCbProClient:
+    if profile.namespace == LOCAL_NS:
+        return get_client_for_credentials(
+            os.environ["API_KEY"],
+            os.environ["API_KEY_SECRET"],
+            os.environ["API_KEY_PW"],
+            os.environ["API_URL"],
+        )
+
+    api_key, b64secret, passphrase = await get_api_credentials(profile)
+    return get_client_for_credentials(
+        api_key,
+        b64secret,
+        passphrase,
+        PROFILE_NAMESPACE_TO_API_URL[profile.namespace],
+    )
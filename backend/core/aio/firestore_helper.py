@@ -0,0 +1,13 @@
+from google.cloud import firestore
+
+_CLIENT: firestore.AsyncClient = None
+
+SERVER_TIMESTAMP = firestore.SERVER_TIMESTAMP
+
+
+def get_db() -> firestore.AsyncClient:
+    # Created lazily so the client binds to the event loop serving requests
+    global _CLIENT
+    if not _CLIENT:
+        _CLIENT = firestore.AsyncClient()
+    return _CLIENT
@@ -0,0 +1,55 @@
+from typing import List, Optional
+
+from backend.core.aio.firestore_helper import SERVER_TIMESTAMP, get_db
+from backend.core.profile import (
+    PROFILES_COLLECTION,
+    ProfileId,
+    ProfileNotFoundError,
+    ProfileSummary,
+    ProfileUserMismatchError,
+    forget_profile_guid,
+    profile_id_from_document,
+)
+from backend.core.user import UserId
+
+
+async def set_profile_display_name(profile_id: ProfileId, display_name: str):
+    await get_db().collection(PROFILES_COLLECTION).document(
+        profile_id.get_guid()
+    ).update(
+        {"display_name": display_name, "display_name_updated_at": SERVER_TIMESTAMP}
+    )
+
+
+async def delete_profile(profile_id: ProfileId) -> None:
+    await get_db().collection(PROFILES_COLLECTION).document(
+        profile_id.get_guid()
+    ).delete()
+    forget_profile_guid(profile_id)
+
+
+async def list_user_profile_summaries(user: UserId) -> List[ProfileSummary]:
+    query = (
+        get_db().collection(PROFILES_COLLECTION).where("user", "==", user.get_guid())
+    )
+    return [
+        ProfileSummary(
+            profile_id_from_document(profile),
+            profile.to_dict().get("display_name"),
+            profile.to_dict().get("display_name_updated_at"),
+        )
+        async for profile in query.stream()
+    ]
+
+
+async def get_by_guid(profile_guid: str, user: Optional[UserId] = None) -> ProfileId:
+    profile = (
+        await get_db().collection(PROFILES_COLLECTION).document(profile_guid).get()
+    )
+    if not profile.exists:
+        raise ProfileNotFoundError(f"Did not find ProfileId@{profile_guid}")
+    if user and profile.get("user") != user.get_guid():
+        raise ProfileUserMismatchError(
+            f"ProfileId@{profile_guid} does not belong to UserId@{user.get_guid()}"
+        )
+    return profile_id_from_document(profile)
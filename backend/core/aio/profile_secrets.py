@@ -0,0 +1,37 @@
+import asyncio
+
+from backend.core.aio.secrets_helper import delete_secret, get_secret
+from backend.core.profile import ProfileId
+from backend.core.secrets.profile_secrets import (
+    ProfileCredentials,
+    cache_api_credentials,
+    get_cached_api_credentials,
+    invalidate_api_credentials,
+)
+
+
+async def get_api_credentials(profile_id: ProfileId) -> ProfileCredentials:
+    """Async counterpart of `profile_secrets.get_api_credentials`, sharing its cache."""
+    credentials = get_cached_api_credentials(profile_id)
+    if credentials is None:
+        guid = profile_id.get_guid()
+        credentials = ProfileCredentials(
+            *await asyncio.gather(
+                get_secret(f"API_KEY_{guid}"),
+                get_secret(f"API_SECRET_{guid}"),
+                get_secret(f"API_PASSPHRASE_{guid}"),
+            )
+        )
+        cache_api_credentials(profile_id, credentials)
+    return credentials
+
+
+async def delete_api_credentials(profile_id: ProfileId) -> None:
+    guid = profile_id.get_guid()
+    invalidate_api_credentials(profile_id)
+    await asyncio.gather(
+        delete_secret(f"API_KEY_{guid}"),
+        delete_secret(f"API_SECRET_{guid}"),
+        delete_secret(f"API_PASSPHRASE_{guid}"),
+    )
+    invalidate_api_credentials(profile_id)
@@ -0,0 +1,27 @@
+from google.cloud import secretmanager
+
+from backend.core.secrets.secrets_helper import (
+    get_qualified_secret_name,
+    get_qualified_secret_version_name,
+)
+
+_CLIENT: secretmanager.SecretManagerServiceAsyncClient = None
+
+
+def _get_client() -> secretmanager.SecretManagerServiceAsyncClient:
+    global _CLIENT
+    if not _CLIENT:
+        _CLIENT = secretmanager.SecretManagerServiceAsyncClient()
+
+    return _CLIENT
+
+
+async def get_secret(secret_name: str) -> str:
+    res = await _get_client().access_secret_version(
+        name=get_qualified_secret_version_name(secret_name)
+    )
+    return res.payload.data.decode("utf-8")
+
+
+async def delete_secret(secret_name: str) -> None:
+    await _get_client().delete_secret(name=get_qualified_secret_name(secret_name))
@@ -0,0 +1,42 @@
+import asyncio
+from typing import Dict, List
+
+from backend.core.aio.firestore_helper import get_db
+from backend.core.profile import PROFILES_COLLECTION, ProfileId
+from backend.core.schedule_catalog import (
+    ScheduleId,
+    get_daily_frequency,
+    get_loaded_daily_frequency,
+)
+from backend.core.trade_spec import TradeSpec, trade_spec_from_document
+
+
+async def _get_daily_frequencies(schedule_ids) -> Dict[ScheduleId, int]:
+    frequencies = {
+        schedule_id: get_loaded_daily_frequency(schedule_id)
+        for schedule_id in schedule_ids
+    }
+    for schedule_id, frequency in frequencies.items():
+        if frequency is None:
+            # The catalog needs a (blocking) reload, run it off the event loop
+            frequencies[schedule_id] = await asyncio.get_event_loop().run_in_executor(
+                None, get_daily_frequency, schedule_id
+            )
+    return frequencies
+
+
+async def get_all_trade_specs(profile: ProfileId) -> List[TradeSpec]:
+    target_deposits_collection = (
+        get_db()
+        .collection(PROFILES_COLLECTION)
+        .document(profile.get_guid())
+        .collection("target_deposits")
+    )
+    spec_docs = [spec_doc async for spec_doc in target_deposits_collection.stream()]
+    frequencies = await _get_daily_frequencies(
+        {spec_doc.get("schedule") for spec_doc in spec_docs}
+    )
+    return [
+        trade_spec_from_document(spec_doc, frequencies[spec_doc.get("schedule")])
+        for spec_doc in spec_docs
+    ]
@@ -0,0 +1,14 @@
+from backend.core.aio.firestore_helper import get_db
+from backend.core.user import (
+    USERS_COLLECTION,
+    UserId,
+    UserNotFoundError,
+    user_id_from_document,
+)
+
+
+async def get_by_guid(user_guid: str) -> UserId:
+    user = await get_db().collection(USERS_COLLECTION).document(user_guid).get()
+    if not user.exists:
+        raise UserNotFoundError(f"Did not find UserId@{user_guid}")
+    return user_id_from_document(user)
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after `ttl` seconds.
+
+    With `sliding` set, every hit pushes the expiry out again, so `ttl` acts as an idle timeout.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, sliding: bool = False):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sliding = sliding
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        # Bumped on every invalidation so in-flight loads never resurrect stale values
+        self._generation = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return default
+
+            if self.sliding:
+                self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            return value
+
+    def _put_locked(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._put_locked(key, value)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        # The loader runs outside of the lock so a slow load never blocks other keys
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            generation = self._generation
+            value = loader()
+            with self._lock:
+                if generation == self._generation:
+                    self._put_locked(key, value)
+        return value
+
+    def invalidate(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            self._generation += 1
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
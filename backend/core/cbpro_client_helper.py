@@ -1,16 +1,18 @@
+import hashlib
 import os
+import threading
 
+import requests
+from requests.adapters import HTTPAdapter
 from coinbasepro import AuthenticatedClient, PublicClient
 from coinbasepro.exceptions import (  # noqa # pylint: disable=unused-import
     InvalidAPIKey as InvalidCoinbaseProAPIKey,
 )
 
 from .profile import CBPRO_BETA_NS, LOCAL_NS, SANDBOX_NS, ProfileId
-from backend.core.secrets.profile_secrets import (
-    get_api_b64_secret,
-    get_api_key,
-    get_api_passphrase,
-)
+from backend.core.cache_helper import TTLCache
+from backend.core.secrets.profile_secrets import get_api_credentials
+from backend.core.tracing import span
 
 PROFILE_NAMESPACE_TO_API_URL = {
     SANDBOX_NS: "https://api-public.sandbox.pro.coinbase.com",
@@ -19,6 +21,23 @@ PROFILE_NAMESPACE_TO_API_URL = {
 
 _CLIENT_BY_NAMESPACE = {}
 
+# Authenticated clients keyed by (api_url, credentials fingerprint), evicted once idle
+_AUTHENTICATED_CLIENTS = TTLCache(
+    maxsize=int(os.environ.get("CBPRO_CLIENT_REGISTRY_SIZE", 512)),
+    ttl=float(os.environ.get("CBPRO_CLIENT_IDLE_SECONDS", 600)),
+    sliding=True,
+)
+_HTTP_POOL_SIZE = int(os.environ.get("CBPRO_HTTP_POOL_SIZE", 16))
+
+_SESSIONS_LOCK = threading.Lock()
+_SESSION_BY_API_URL = {}
+
+# Recent `get_accounts` results keyed by (api_url, api_key), an API key maps to one portfolio
+_ACCOUNTS_SNAPSHOTS = TTLCache(
+    maxsize=int(os.environ.get("ACCOUNTS_SNAPSHOT_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("ACCOUNTS_SNAPSHOT_TTL_SECONDS", 5)),
+)
+
 
 class CbProAuthenticatedClient(AuthenticatedClient):
     def get_profile(self, profile_id: str):
@@ -44,6 +63,40 @@ def _get_api_url_for_user_namespace(namespace: str) -> str:
     return PROFILE_NAMESPACE_TO_API_URL[namespace]
 
 
+def _get_shared_session(api_url: str) -> requests.Session:
+    """Keep-alive HTTP session shared by every client talking to `api_url`."""
+    with _SESSIONS_LOCK:
+        if api_url not in _SESSION_BY_API_URL:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=_HTTP_POOL_SIZE, pool_maxsize=_HTTP_POOL_SIZE
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSION_BY_API_URL[api_url] = session
+        return _SESSION_BY_API_URL[api_url]
+
+
+def _credentials_fingerprint(api_key: str, b64secret: str, passphrase: str) -> str:
+    return hashlib.sha256(f"{api_key}:{b64secret}:{passphrase}".encode()).hexdigest()
+
+
+def get_client_for_credentials(
+    api_key: str, b64secret: str, passphrase: str, api_url: str
+) -> CbProAuthenticatedClient:
+    """Registry-backed client, reused for as long as the credentials stay the same."""
+
+    def build_client() -> CbProAuthenticatedClient:
+        client = CbProAuthenticatedClient(
+            api_key, b64secret, passphrase, api_url=api_url
+        )
+        client.session = _get_shared_session(api_url)
+        return client
+
+    registry_key = (api_url, _credentials_fingerprint(api_key, b64secret, passphrase))
+    return _AUTHENTICATED_CLIENTS.get_or_load(registry_key, build_client)
+
+
 def _build_client_from_env() -> CbProAuthenticatedClient:
     api_key = os.environ["API_KEY"]
     b64secret = os.environ["API_KEY_SECRET"]
@@ -51,19 +104,18 @@ def _build_client_from_env() -> CbProAuthenticatedClient:
 
     api_url = os.environ["API_URL"]
 
-    return CbProAuthenticatedClient(api_key, b64secret, passphrase, api_url=api_url)
+    return get_client_for_credentials(api_key, b64secret, passphrase, api_url)
 
 
 def _build_client_for_profile(profile: ProfileId) -> CbProAuthenticatedClient:
-    api_key = get_api_key(profile)
-    b64secret = get_api_b64_secret(profile)
-    passphrase = get_api_passphrase(profile)
+    api_key, b64secret, passphrase = get_api_credentials(profile)
 
     api_url = _get_api_url_for_user_namespace(profile.namespace)
 
-    return CbProAuthenticatedClient(api_key, b64secret, passphrase, api_url=api_url)
+    return get_client_for_credentials(api_key, b64secret, passphrase, api_url)
 
 
+@span("exchange.get_client")
 def get_client(profile: ProfileId) -> CbProAuthenticatedClient:
     if profile.namespace == LOCAL_NS:
         return _build_client_from_env()
@@ -77,3 +129,19 @@ def get_public_client(namespace: str) -> PublicClient:
             api_url=PROFILE_NAMESPACE_TO_API_URL[namespace]
         )
     return _CLIENT_BY_NAMESPACE[namespace]
+
+
+def _accounts_snapshot_key(client: AuthenticatedClient) -> tuple:
+    return (client.url, client.auth.api_key)
+
+
+def get_accounts_snapshot(client: AuthenticatedClient) -> list:
+    """`client.get_accounts()`, reusing a result fetched within the last few seconds."""
+    return _ACCOUNTS_SNAPSHOTS.get_or_load(
+        _accounts_snapshot_key(client),
+        span("exchange.get_accounts")(client.get_accounts),
+    )
+
+
+def invalidate_accounts_snapshot(client: AuthenticatedClient) -> None:
+    _ACCOUNTS_SNAPSHOTS.invalidate(_accounts_snapshot_key(client))
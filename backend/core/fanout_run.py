@@ -0,0 +1,231 @@
+"""Bookkeeping for resumable schedule fanouts.
+
+Every schedule tick gets one run document holding the partition boundaries the deposits
+were split into and, per partition, the last deposit whose trade event was acknowledged.
+A redelivered tick resumes each partition after its checkpoint, and a finished run turns
+redeliveries into no-ops.
+"""
+
+import base64
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+from .firestore_helper import SERVER_TIMESTAMP, field_path, get_db, transactional
+from .trade_spec import ScheduleId
+
+_FANOUT_RUNS_COLLECTION = "fanout_runs"
+
+_RUNNING = "RUNNING"
+_DONE = "DONE"
+
+# A delivery holds a run for this long past its last checkpoint, others wait it out
+_LEASE = timedelta(seconds=float(os.environ.get("FANOUT_RUN_LEASE_SECONDS", 60)))
+# Every partition checkpoints into the same run document, allow for them colliding
+_RUN_UPDATE_TRANSACTION_ATTEMPTS = 10
+
+
+class FanoutRunInProgress(Exception):
+    def __init__(self, run_id: str):
+        super(FanoutRunInProgress, self).__init__(
+            f"Fanout run '{run_id}' is held by another delivery"
+        )
+        self.run_id = run_id
+
+
+class FanoutRunLeaseLost(FanoutRunInProgress):
+    """The lease ran out and another delivery took the run over."""
+
+
+class PartitionBounds(NamedTuple):
+    """[start, end) document paths of a partition, `None` for an open end."""
+
+    start: Optional[str]
+    end: Optional[str]
+
+
+class PartitionCheckpoint(NamedTuple):
+    after: Optional[str] = None
+    events: int = 0
+    done: bool = False
+
+
+def fanout_run_id(schedule_id: ScheduleId, scheduled_time: datetime) -> str:
+    key = f"{schedule_id}:{scheduled_time.astimezone(timezone.utc).isoformat()}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def _lease_until() -> datetime:
+    return datetime.now(timezone.utc) + _LEASE
+
+
+@transactional(max_attempts=_RUN_UPDATE_TRANSACTION_ATTEMPTS)
+def _update_held_run(transaction, run_ref, owner: str, fields: dict) -> bool:
+    """Apply `fields` only while `owner` still holds the run's lease."""
+    run_snapshot = run_ref.get(transaction=transaction)
+    if run_snapshot.get("lease_owner") != owner:
+        return False
+    transaction.update(run_ref, fields)
+    return True
+
+
+class FanoutRun:
+    def __init__(
+        self,
+        run_ref,
+        partitions: List[PartitionBounds],
+        checkpoints: Dict[int, PartitionCheckpoint],
+        done: bool,
+        source: str,
+        owner: Optional[str] = None,
+    ):
+        self._run_ref = run_ref
+        self._owner = owner
+        self.source = source
+        self.partitions = partitions
+        self._checkpoints = checkpoints
+        self.done = done
+        # Set once a write finds another delivery holding the run, partitions stop then
+        self.lease_lost = False
+
+    @property
+    def run_id(self) -> str:
+        return self._run_ref.id
+
+    def get_checkpoint(self, partition: int) -> PartitionCheckpoint:
+        return self._checkpoints.get(partition, PartitionCheckpoint())
+
+    def _update(self, fields: dict) -> bool:
+        if self.lease_lost:
+            return False
+        transaction = get_db().transaction()
+        if not _update_held_run(transaction, self._run_ref, self._owner, fields):
+            self.lease_lost = True
+        return not self.lease_lost
+
+    def checkpoint(self, partition: int, checkpoint: PartitionCheckpoint) -> None:
+        """Record progress on a partition; only call once its events are acknowledged.
+
+        Raises `FanoutRunLeaseLost` if another delivery took the run over.
+        """
+        held = self._update(
+            {
+                field_path("checkpoints", str(partition)): checkpoint._asdict(),
+                "lease_until": _lease_until(),
+                "updated": SERVER_TIMESTAMP,
+            }
+        )
+        if not held:
+            raise FanoutRunLeaseLost(self.run_id)
+        self._checkpoints[partition] = checkpoint
+
+    def release(self) -> None:
+        """Let a redelivery pick the run up right away instead of waiting out the lease."""
+        # Nothing to release once another delivery holds the run
+        self._update(
+            {"lease_until": datetime.now(timezone.utc), "updated": SERVER_TIMESTAMP}
+        )
+
+    def mark_done(self, events_by_partition: List[int]) -> None:
+        held = self._update(
+            {
+                "status": _DONE,
+                "events": sum(events_by_partition),
+                "events_by_partition": events_by_partition,
+                "updated": SERVER_TIMESTAMP,
+            }
+        )
+        if not held:
+            raise FanoutRunLeaseLost(self.run_id)
+        self.done = True
+
+
+def _run_from_snapshot(run_snapshot, owner: Optional[str] = None) -> FanoutRun:
+    checkpoints = run_snapshot.get("checkpoints") or {}
+    return FanoutRun(
+        run_snapshot.reference,
+        [PartitionBounds(p["start"], p["end"]) for p in run_snapshot.get("partitions")],
+        {
+            int(partition): PartitionCheckpoint(**checkpoint)
+            for partition, checkpoint in checkpoints.items()
+        },
+        run_snapshot.get("status") == _DONE,
+        run_snapshot.get("source"),
+        owner,
+    )
+
+
+@transactional
+def _claim_fanout_run(
+    transaction,
+    run_ref,
+    schedule_id: ScheduleId,
+    scheduled_time: datetime,
+    source: str,
+    partitions: List[PartitionBounds],
+    owner: str,
+) -> FanoutRun:
+    run_snapshot = run_ref.get(transaction=transaction)
+    if not run_snapshot.exists:
+        transaction.create(
+            run_ref,
+            {
+                "schedule": schedule_id,
+                "scheduled_time": scheduled_time,
+                "status": _RUNNING,
+                "source": source,
+                "partitions": [p._asdict() for p in partitions],
+                "checkpoints": {},
+                "lease_owner": owner,
+                "lease_until": _lease_until(),
+                "created": SERVER_TIMESTAMP,
+                "updated": SERVER_TIMESTAMP,
+            },
+        )
+        return FanoutRun(
+            run_ref, partitions, {}, done=False, source=source, owner=owner
+        )
+
+    run = _run_from_snapshot(run_snapshot, owner)
+    if run.done:
+        return run
+    if run_snapshot.get("lease_until") > datetime.now(timezone.utc):
+        raise FanoutRunInProgress(run_ref.id)
+    transaction.update(run_ref, {"lease_owner": owner, "lease_until": _lease_until()})
+    return run
+
+
+def get_fanout_run_ref(run_id: str):
+    return get_db().collection(_FANOUT_RUNS_COLLECTION).document(run_id)
+
+
+def start_fanout_run(
+    schedule_id: ScheduleId, scheduled_time: datetime, source: str, compute_partitions
+) -> FanoutRun:
+    """Open the run for a schedule tick, or pick an existing one back up.
+
+    `compute_partitions()` is only called for a new run; resumed runs keep the
+    source and boundaries they started with so checkpoints stay meaningful.
+    Raises `FanoutRunInProgress` while another delivery holds the run.
+    """
+    run_ref = get_fanout_run_ref(fanout_run_id(schedule_id, scheduled_time))
+    run_snapshot = run_ref.get()
+    if run_snapshot.exists:
+        run = _run_from_snapshot(run_snapshot)
+        if run.done:
+            return run
+        partitions = run.partitions
+    else:
+        partitions = compute_partitions()
+
+    transaction = get_db().transaction()
+    return _claim_fanout_run(
+        transaction,
+        run_ref,
+        schedule_id,
+        scheduled_time,
+        source,
+        partitions,
+        uuid.uuid4().hex,
+    )
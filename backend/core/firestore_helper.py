@@ -1,14 +1,33 @@
+import functools
+import os
+import random
+import time
 from contextlib import contextmanager
+from typing import Callable, Optional
 
 from google.cloud import firestore
+from google.cloud.firestore_v1.transaction import _Transactional
+
+from .tracing import add_stage, incr
 
 _CLIENT = None
 
+# Defaults for `transactional`, call sites under heavier contention override them
+_TRANSACTION_MAX_ATTEMPTS = int(os.environ.get("TRANSACTION_MAX_ATTEMPTS", 5))
+_TRANSACTION_BACKOFF_INITIAL_SECONDS = float(
+    os.environ.get("TRANSACTION_BACKOFF_INITIAL_SECONDS", 0.02)
+)
+_TRANSACTION_BACKOFF_MAX_SECONDS = float(
+    os.environ.get("TRANSACTION_BACKOFF_MAX_SECONDS", 1.0)
+)
+
 SERVER_TIMESTAMP = firestore.SERVER_TIMESTAMP
-transactional = firestore.transactional
+Increment = firestore.Increment
+DELETE_FIELD = firestore.DELETE_FIELD
 Transaction = firestore.Transaction
 OrderDescending = firestore.Query.DESCENDING
 DocumentSnapshot = firestore.DocumentSnapshot
+field_path = firestore.Client.field_path
 
 
 def get_db():
@@ -18,8 +37,101 @@ def get_db():
     return _CLIENT
 
 
-_LOCKS = u"locks"
-_LOCK_VAL = u"value"
+class _RetryingTransactional:
+    """`firestore.transactional` with attempt/abort counters and jittered backoff.
+
+    Each attempt runs through the library's own begin/commit steps, so a retried
+    transaction still keeps its spot in line on the server.
+    """
+
+    def __init__(
+        self,
+        to_wrap: Callable,
+        name: str,
+        max_attempts: int,
+        backoff_initial: float,
+        backoff_max: float,
+    ):
+        functools.update_wrapper(self, to_wrap)
+        self._to_wrap = to_wrap
+        self._name = name
+        self._max_attempts = max_attempts
+        self._backoff_initial = backoff_initial
+        self._backoff_max = backoff_max
+
+    def _backoff(self, retry: int) -> float:
+        # "Full jitter": spreads out callers that aborted on the same document
+        return random.uniform(
+            0, min(self._backoff_max, self._backoff_initial * 2**retry)
+        )
+
+    def __call__(self, transaction: firestore.Transaction, *args, **kwargs):
+        # The library keeps transaction ids on the decorator, concurrent callers of the
+        # same function each need their own
+        attempt_runner = _Transactional(self._to_wrap)
+        first_abort = None
+        try:
+            for attempt in range(self._max_attempts):
+                if attempt:
+                    time.sleep(self._backoff(attempt - 1))
+                incr(f"transaction.{self._name}.attempts")
+                result = attempt_runner._pre_commit(transaction, *args, **kwargs)
+                if attempt_runner._maybe_commit(transaction):
+                    return result
+                incr(f"transaction.{self._name}.aborts")
+                if first_abort is None:
+                    first_abort = time.perf_counter()
+
+            transaction._rollback()
+            print(
+                f"Transaction '{self._name}' failed after {self._max_attempts} attempts"
+            )
+            raise ValueError(
+                f"Failed to commit transaction in {self._max_attempts} attempts."
+            )
+        finally:
+            if first_abort is not None:
+                add_stage(
+                    f"transaction.{self._name}.retrying",
+                    time.perf_counter() - first_abort,
+                )
+
+
+def transactional(
+    to_wrap: Optional[Callable] = None,
+    *,
+    name: Optional[str] = None,
+    max_attempts: Optional[int] = None,
+    backoff_initial: Optional[float] = None,
+    backoff_max: Optional[float] = None,
+):
+    """Run the decorated function in a transaction, retried when the commit aborts.
+
+    Usable bare (`@transactional`) or with per call site settings, e.g.
+    `@transactional(max_attempts=10)`. Attempts and aborts are counted, and time spent
+    retrying is timed, on the current request trace under `transaction.<name>`.
+    """
+
+    def decorator(fn: Callable) -> _RetryingTransactional:
+        return _RetryingTransactional(
+            fn,
+            name or fn.__name__.lstrip("_"),
+            max_attempts or _TRANSACTION_MAX_ATTEMPTS,
+            (
+                _TRANSACTION_BACKOFF_INITIAL_SECONDS
+                if backoff_initial is None
+                else backoff_initial
+            ),
+            _TRANSACTION_BACKOFF_MAX_SECONDS if backoff_max is None else backoff_max,
+        )
+
+    if to_wrap is not None:
+        return decorator(to_wrap)
+    return decorator
+
+
+_LOCKS = "locks"
+_LOCK_VAL = "value"
 
 
 class _Lock:
@@ -1,24 +1,55 @@
 import base64
 import os
 import uuid
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
 
 from coinbasepro import AuthenticatedClient
-from coinbasepro.exceptions import BadRequest
+from coinbasepro.exceptions import BadRequest, CoinbaseAPIError
+from google.api_core.exceptions import Conflict
 
+from .cbpro_client_helper import invalidate_accounts_snapshot
 from .firestore_helper import (
     SERVER_TIMESTAMP,
-    OrderDescending,
+    Increment,
     Transaction,
     get_db,
     lock_on_key,
     transactional,
 )
 from .profile import ProfileId
-from .pubsub_helper import publisher
+from .pubsub_helper import publish_event_async
+from .tracing import span
 from .trade_spec import ProductId, TradeSpec
 
 _ORDER_RECORDS_COLLECTION = "order_records"
+# Running total and count of orders per (profile, product, UTC day)
+_ORDER_DAILY_TOTALS_COLLECTION = "order_daily_totals"
+
+_LOCKED_MODE = "locked"
+_SLOT_MODE = "slot"
+# "locked" serializes order creation through a lock document per (profile, product),
+# "slot" creates one deterministically keyed record per schedule slot instead
+_ORDER_RECORD_MODE = os.environ.get("ORDER_RECORD_MODE", _LOCKED_MODE)
+assert _ORDER_RECORD_MODE in (_LOCKED_MODE, _SLOT_MODE)
+# Fanout bursts hit the same (profile, product) lock document, so allow more retries
+_ORDER_RECORD_TRANSACTION_ATTEMPTS = int(
+    os.environ.get("ORDER_RECORD_TRANSACTION_ATTEMPTS", 8)
+)
+# A slot record claimed for longer than this without being placed is assumed abandoned,
+# it must comfortably exceed the time taken to place an order
+_ORDER_CLAIM_TIMEOUT = timedelta(
+    seconds=int(os.environ.get("ORDER_CLAIM_TIMEOUT_SECONDS", 120))
+)
+
+# Responses are held back until the insufficient funds event is delivered, since the
+# CPU may be throttled (and the publisher never flushed) once they are sent
+_NOTIFICATION_PUBLISH_TIMEOUT_SECONDS = float(
+    os.environ.get("NOTIFICATION_PUBLISH_TIMEOUT_SECONDS", 10)
+)
+
+_STAGED = "STAGED"
+_PLACING = "PLACING"
 
 
 class UnhandledMarketOrderException(Exception):
@@ -36,31 +67,38 @@ class DailyTargetDepositReached(Exception):
         self.product_id = product_id
 
 
+class DuplicateOrderSlot(Exception):
+    def __init__(self, product_id: ProductId, slot: str):
+        super(DuplicateOrderSlot, self).__init__(
+            f"Order for product '{product_id}' already recorded for slot '{slot}'"
+        )
+        self.product_id = product_id
+        self.slot = slot
+
+
 def _order_lock_key(profile: ProfileId, product: ProductId) -> str:
     key = f"{profile.get_guid()}:{product}"
     return base64.urlsafe_b64encode(key.encode()).decode()
 
 
-def _build_latest_orders_query(profile: ProfileId, product: ProductId, limit: int):
+def _utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def daily_total_key(profile_guid: str, product: ProductId, day: date) -> str:
+    key = f"{profile_guid}:{product}:{day.isoformat()}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def get_daily_total_ref(profile_guid: str, product: ProductId, day: date):
     return (
         get_db()
-        .collection(_ORDER_RECORDS_COLLECTION)
-        .where("profile", "==", profile.get_guid())
-        .where("product", "==", product)
-        .order_by("timestamp", direction=OrderDescending)
-        .limit(limit)
+        .collection(_ORDER_DAILY_TOTALS_COLLECTION)
+        .document(daily_total_key(profile_guid, product, day))
     )
 
 
-def _sum_total_order_amounts_today(recent_orders) -> float:
-    today = date.today()
-    todays_orders = [
-        order for order in recent_orders if order.get("timestamp").date() == today
-    ]
-    return sum(order.get("quote_currency_amount") for order in todays_orders)
-
-
-@transactional
+@transactional(max_attempts=_ORDER_RECORD_TRANSACTION_ATTEMPTS)
 def _create_order_record(
     transaction: Transaction,
     profile: ProfileId,
@@ -69,13 +107,11 @@ def _create_order_record(
     product_id = spec.get_product_id()
     with lock_on_key(_order_lock_key(profile, product_id), transaction):
 
-        recent_orders_query = _build_latest_orders_query(
-            profile, product_id, 2 * spec.get_daily_frequency()
-        )
-        recent_orders = [
-            order for order in recent_orders_query.stream(transaction=transaction)
-        ]
-        todays_sum = _sum_total_order_amounts_today(recent_orders)
+        today = _utc_today()
+        daily_total_ref = get_daily_total_ref(profile.get_guid(), product_id, today)
+        daily_total = daily_total_ref.get(transaction=transaction)
+        todays_sum = daily_total.get("total") if daily_total.exists else 0.0
+        todays_count = daily_total.get("count") if daily_total.exists else 0
         if todays_sum >= spec.get_daily_limit():
             raise DailyTargetDepositReached(product_id)
 
@@ -89,47 +125,252 @@ def _create_order_record(
                 "quote_currency_amount": spec.get_quote_amount(),
                 "client_oid": client_oid,
                 "timestamp": SERVER_TIMESTAMP,
-                "status": "STAGED",
+                "status": _STAGED,
+            },
+        )
+        transaction.set(
+            daily_total_ref,
+            {
+                "profile": profile.get_guid(),
+                "product": product_id,
+                "day": today.isoformat(),
+                "total": todays_sum + spec.get_quote_amount(),
+                "count": todays_count + 1,
             },
         )
         return order_ref, client_oid
 
 
-def _try_create_order_record(profile: ProfileId, spec: TradeSpec):
+def _schedule_slot(slot_time: datetime) -> str:
+    """Identify the schedule tick by its scheduled time, e.g. '2021-06-01T07:00:00+00:00'."""
+    return slot_time.astimezone(timezone.utc).replace(microsecond=0).isoformat()
+
+
+def _slot_order_record_id(profile: ProfileId, product: ProductId, slot: str) -> str:
+    key = f"{profile.get_guid()}:{product}:{slot}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def _is_claimable(order_record) -> bool:
+    """Whether nobody is placing the record's order, i.e. it was released or abandoned."""
+    status = order_record.get("status")
+    if status == _STAGED:
+        return True
+    if status != _PLACING:
+        return False
+    claimed_at = order_record.get("claimed_at")
+    return claimed_at + _ORDER_CLAIM_TIMEOUT < datetime.now(timezone.utc)
+
+
+@transactional
+def _claim_slot_order_record(transaction: Transaction, order_ref, owner: str) -> bool:
+    order_record = order_ref.get(transaction=transaction)
+    if not _is_claimable(order_record):
+        return False
+    transaction.update(
+        order_ref,
+        {"status": _PLACING, "owner": owner, "claimed_at": SERVER_TIMESTAMP},
+    )
+    return True
+
+
+@transactional
+def _release_slot_order_record(transaction: Transaction, order_ref, owner: str):
+    order_record = order_ref.get(transaction=transaction)
+    # A delivery that took over an expired claim owns the record now
+    if order_record.get("status") == _PLACING and order_record.get("owner") == owner:
+        transaction.update(order_ref, {"status": _STAGED})
+
+
+def _find_order(client: AuthenticatedClient, client_oid: str) -> Optional[dict]:
+    try:
+        with span("exchange.get_order"):
+            return client.get_order(f"client:{client_oid}")
+    except CoinbaseAPIError as err:
+        if "NotFound" in str(err):
+            return None
+        raise
+
+
+def _take_over_slot_order_record(
+    client: AuthenticatedClient,
+    order_record,
+    owner: str,
+    product_id: ProductId,
+    slot: str,
+):
+    """Claim a record whose order was never placed, so a redelivery can place it."""
+    if not _is_claimable(order_record):
+        raise DuplicateOrderSlot(product_id, slot)
+
+    # The previous owner may have placed the order and died before recording it
+    client_oid = order_record.get("client_oid")
+    order = _find_order(client, client_oid)
+    if order is not None:
+        _update_order_record(order_record.reference, order["id"])
+        raise DuplicateOrderSlot(product_id, slot)
+
     transaction = get_db().transaction()
-    return _create_order_record(transaction, profile, spec)
+    if not _claim_slot_order_record(transaction, order_record.reference, owner):
+        # A concurrent redelivery took it over first
+        raise DuplicateOrderSlot(product_id, slot)
+    # The daily total already counts the record
+    return order_record.reference, client_oid, owner
+
+
+def _create_slot_order_record(
+    client: AuthenticatedClient,
+    profile: ProfileId,
+    spec: TradeSpec,
+    slot_time: datetime,
+):
+    product_id = spec.get_product_id()
+    slot = _schedule_slot(slot_time)
+    today = slot_time.astimezone(timezone.utc).date()
+    owner = uuid.uuid4().hex
+
+    daily_total_ref = get_daily_total_ref(profile.get_guid(), product_id, today)
+    order_ref = (
+        get_db()
+        .collection(_ORDER_RECORDS_COLLECTION)
+        .document(_slot_order_record_id(profile, product_id, slot))
+    )
+    snapshots = {
+        snapshot.reference.path: snapshot
+        for snapshot in get_db().get_all([daily_total_ref, order_ref])
+    }
+    order_record = snapshots[order_ref.path]
+    if order_record.exists:
+        return _take_over_slot_order_record(
+            client, order_record, owner, product_id, slot
+        )
+
+    # One slot per scheduled tick caps orders at daily_frequency a day, this point read
+    # guards against a daily target that was lowered during the day
+    daily_total = snapshots[daily_total_ref.path]
+    if daily_total.exists and daily_total.get("total") >= spec.get_daily_limit():
+        raise DailyTargetDepositReached(product_id)
+
+    client_oid = uuid.uuid4().hex
+
+    # The create() precondition makes the record exactly-once per slot, so no lock or
+    # transaction is needed. Creating it already claimed makes the create the claim,
+    # and the daily total is bumped atomically alongside it
+    batch = get_db().batch()
+    batch.create(
+        order_ref,
+        {
+            "profile": profile.get_guid(),
+            "product": product_id,
+            "quote_currency_amount": spec.get_quote_amount(),
+            "client_oid": client_oid,
+            "timestamp": SERVER_TIMESTAMP,
+            "status": _PLACING,
+            "owner": owner,
+            "claimed_at": SERVER_TIMESTAMP,
+            "slot": slot,
+        },
+    )
+    batch.set(
+        daily_total_ref,
+        {
+            "profile": profile.get_guid(),
+            "product": product_id,
+            "day": today.isoformat(),
+            "total": Increment(spec.get_quote_amount()),
+            "count": Increment(1),
+        },
+        merge=True,
+    )
+    try:
+        batch.commit()
+    except Conflict:
+        # A concurrent delivery of the same slot created, and so claimed, it first
+        raise DuplicateOrderSlot(product_id, slot) from None
+
+    return order_ref, client_oid, owner
 
 
+@span("orders.create_record")
+def _try_create_order_record(
+    client: AuthenticatedClient,
+    profile: ProfileId,
+    spec: TradeSpec,
+    slot_time: Optional[datetime] = None,
+):
+    """Returns the record, its client_oid and, for slot records, the claim's owner."""
+    # Without a scheduled time there is no slot to deduplicate redeliveries on
+    if _ORDER_RECORD_MODE == _SLOT_MODE and slot_time is not None:
+        return _create_slot_order_record(client, profile, spec, slot_time)
+
+    transaction = get_db().transaction()
+    order_ref, client_oid = _create_order_record(transaction, profile, spec)
+    return order_ref, client_oid, None
+
+
+@span("orders.update_record")
 def _update_order_record(order_ref, server_oid: str) -> None:
     order_ref.update({"server_oid": server_oid, "status": "ACCEPTED"})
 
 
+@span("orders.update_record")
 def _mark_order_rejected(order_ref, response_obj):
     order_ref.update({"status": "REJECTED", "server_response": str(response_obj)})
 
 
-def place_market_buy(client: AuthenticatedClient, profile: ProfileId, spec: TradeSpec):
+@span("orders.update_record")
+def _release_order_record(order_ref, owner: Optional[str]) -> None:
+    """Let a redelivery retry an order that failed, after it checks the exchange."""
+    if owner is not None:
+        transaction = get_db().transaction()
+        _release_slot_order_record(transaction, order_ref, owner)
+
+
+def _notify_insufficient_funds(profile: ProfileId) -> None:
+    future = publish_event_async(
+        os.environ["INSUFFICIENT_FUNDS_TOPIC"], {"profileId": profile.get_guid()}
+    )
+    try:
+        with span("pubsub.wait"):
+            future.result(timeout=_NOTIFICATION_PUBLISH_TIMEOUT_SECONDS)
+    except Exception as err:
+        # The order is already recorded as rejected, losing the notification is not fatal
+        print(
+            f"Failed to publish insufficient funds event for ProfileId@{profile.get_guid()}: {err}"
+        )
+
+
+def place_market_buy(
+    client: AuthenticatedClient,
+    profile: ProfileId,
+    spec: TradeSpec,
+    slot_time: Optional[datetime] = None,
+):
     # Create a record of the order we want to place
-    order_ref, client_oid = _try_create_order_record(profile, spec)
+    order_ref, client_oid, owner = _try_create_order_record(
+        client, profile, spec, slot_time
+    )
 
     # Place the order
     try:
-        response = client.place_market_order(
-            spec.get_product_id(),
-            "buy",
-            funds=str(spec.get_quote_amount()),
-            client_oid=client_oid,
-        )
+        with span("exchange.place_market_order"):
+            response = client.place_market_order(
+                spec.get_product_id(),
+                "buy",
+                funds=str(spec.get_quote_amount()),
+                client_oid=client_oid,
+            )
     except BadRequest as err:
         if "Insufficient funds" in str(err):
-            with publisher(os.environ["INSUFFICIENT_FUNDS_TOPIC"]) as pub:
-                pub.publish_event({"profileId": profile.get_guid()})
             _mark_order_rejected(order_ref, "Insufficient funds")
+            _notify_insufficient_funds(profile)
         else:
+            _release_order_record(order_ref, owner)
             raise UnhandledMarketOrderException(
                 profile, spec.get_product_id(), err
             ) from err
     except Exception as err:
+        _release_order_record(order_ref, owner)
         raise UnhandledMarketOrderException(
             profile, spec.get_product_id(), err
         ) from err
@@ -140,3 +381,6 @@ def place_market_buy(client: AuthenticatedClient, profile: ProfileId, spec: Trad
             _update_order_record(order_ref, server_oid)
         else:
             _mark_order_rejected(order_ref, response)
+    finally:
+        # Balances may have moved, stop serving the previous accounts snapshot
+        invalidate_accounts_snapshot(client)
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from typing import AnyStr, Dict, Optional
+
+from .cbpro_client_helper import get_public_client
+
+ProductId = AnyStr
+
+_TTL_SECONDS = float(os.environ.get("PRODUCT_CATALOG_TTL_SECONDS", 300))
+# How long past the TTL a stale catalog may still be served while it is refreshed
+_MAX_STALE_SECONDS = float(os.environ.get("PRODUCT_CATALOG_MAX_STALE_SECONDS", 3600))
+
+# Subset of the exchange's product details that allocation validation relies on
+_RETAINED_FIELDS = (
+    "min_market_funds",
+    "quote_currency",
+    "trading_disabled",
+    "auction_mode",
+    "post_only",
+    "limit_only",
+    "cancel_only",
+)
+
+
+def _index_products(all_products: list) -> Dict[ProductId, dict]:
+    products_by_id = {}
+    duplicate_ids = set()
+    for product in all_products:
+        product_id = product.get("id")
+        if product_id in products_by_id:
+            duplicate_ids.add(product_id)
+        products_by_id[product_id] = {
+            field: product.get(field) for field in _RETAINED_FIELDS
+        }
+
+    # Ambiguous details are left out, so only allocations to those products fail
+    for product_id in duplicate_ids:
+        print(f"Found multiple products with ID '{product_id}', leaving it out")
+        del products_by_id[product_id]
+    return products_by_id
+
+
+class _ProductCatalog:
+    """Exchange products for one namespace, indexed by product ID.
+
+    Served stale-while-revalidate: once the TTL lapses readers keep getting the previous
+    catalog while a background thread downloads a new one.
+    """
+
+    def __init__(self, namespace: str):
+        self._namespace = namespace
+
+        self._lock = threading.Lock()
+        self._products_by_id: Dict[ProductId, dict] = {}
+        self._loaded_at = None
+        self._refreshing = False
+
+    def _load(self) -> None:
+        all_products = get_public_client(self._namespace).get_products()
+        products_by_id = _index_products(all_products)
+        with self._lock:
+            self._products_by_id = products_by_id
+            self._loaded_at = time.monotonic()
+
+    def _background_refresh(self) -> None:
+        try:
+            self._load()
+        except Exception as err:
+            print(f"Failed to refresh '{self._namespace}' product catalog: {err}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _ensure_fresh(self) -> None:
+        with self._lock:
+            age = (
+                time.monotonic() - self._loaded_at
+                if self._loaded_at is not None
+                else None
+            )
+            if age is not None and age < _TTL_SECONDS:
+                return
+            serve_stale = age is not None and age < _TTL_SECONDS + _MAX_STALE_SECONDS
+            if serve_stale:
+                if self._refreshing:
+                    return
+                self._refreshing = True
+
+        if serve_stale:
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+        else:
+            self._load()
+
+    def get_product(self, product_id: ProductId) -> Optional[dict]:
+        self._ensure_fresh()
+        return self._products_by_id.get(product_id)
+
+
+_CATALOGS_LOCK = threading.Lock()
+_CATALOG_BY_NAMESPACE: Dict[str, _ProductCatalog] = {}
+
+
+def _get_catalog(namespace: str) -> _ProductCatalog:
+    with _CATALOGS_LOCK:
+        if namespace not in _CATALOG_BY_NAMESPACE:
+            _CATALOG_BY_NAMESPACE[namespace] = _ProductCatalog(namespace)
+        return _CATALOG_BY_NAMESPACE[namespace]
+
+
+def get_product_details(namespace: str, product_id: ProductId) -> Optional[dict]:
+    """Cached exchange details for `product_id`, or None if the exchange does not list it."""
+    return _get_catalog(namespace).get_product(product_id)
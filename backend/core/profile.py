@@ -1,8 +1,18 @@
 import base64
 import os
-from typing import List, Optional
-
-from backend.core.firestore_helper import get_db, lock_on_key, transactional
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from google.api_core.exceptions import NotFound
+
+from backend.core.cache_helper import TTLCache
+from backend.core.firestore_helper import (
+    SERVER_TIMESTAMP,
+    get_db,
+    lock_on_key,
+    transactional,
+)
+from backend.core.tracing import span
 from backend.core.user import UserId
 
 LOCAL_NS = "LOCAL"
@@ -13,7 +23,14 @@ _VALID_NAMESPACES = (LOCAL_NS, SANDBOX_NS, CBPRO_BETA_NS)
 DEFAULT_NS = os.environ.get("DEFAULT_PROFILE_NAMESPACE", CBPRO_BETA_NS)
 assert DEFAULT_NS in _VALID_NAMESPACES
 
-_PROFILES_COLLECTION = "profiles"
+PROFILES_COLLECTION = "profiles"
+
+# Qualified ID ("namespace:identifier") -> profile document ID. Deleting a profile only
+# forgets its guid in the deleting process, the TTL bounds how long others keep it
+_GUID_CACHE = TTLCache(
+    maxsize=int(os.environ.get("PROFILE_GUID_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("PROFILE_GUID_CACHE_TTL_SECONDS", 300)),
+)
 
 
 class ProfileNotFoundError(Exception):
@@ -25,12 +42,12 @@ class ProfileUserMismatchError(Exception):
 
 
 class ProfileId:
-    def __init__(self, namespace: str, identifier: str):
+    def __init__(self, namespace: str, identifier: str, guid: Optional[str] = None):
         assert namespace in _VALID_NAMESPACES
         self.namespace = namespace
         self.identifier = identifier
 
-        self._guid = None
+        self._guid = guid
 
     def _get_qualified_id(self) -> str:
         return f"{self.namespace}:{self.identifier}"
@@ -46,56 +63,123 @@ class ProfileId:
             .replace("=", "_")
         )
 
+    @span("profile.query_guid")
+    def _query_document(self):
+        profile_query = (
+            get_db()
+            .collection(PROFILES_COLLECTION)
+            .where("namespace", "==", self.namespace)
+            .where("identifier", "==", self.identifier)
+        )
+        [profile] = profile_query.stream()
+        return profile
+
+    def _query_guid(self) -> str:
+        return self._query_document().id
+
+    def _has_known_guid(self) -> bool:
+        return bool(
+            self._guid
+            or self.namespace == LOCAL_NS
+            or _GUID_CACHE.get(self._get_qualified_id())
+        )
+
     def get_guid(self) -> str:
         if not self._guid:
             if self.namespace == LOCAL_NS:
                 self._guid = self._get_b32_qualified_id()
             else:
-                profile_query = (
-                    get_db()
-                    .collection(_PROFILES_COLLECTION)
-                    .where("namespace", "==", self.namespace)
-                    .where("identifier", "==", self.identifier)
+                self._guid = _GUID_CACHE.get_or_load(
+                    self._get_qualified_id(), self._query_guid
                 )
-                [profile_ref] = profile_query.stream()
-
-                self._guid = profile_ref.id
 
         return self._guid
 
 
-def get_profile_field(profile_id: ProfileId, field: str):
-    profile_ref = (
-        get_db().collection(_PROFILES_COLLECTION).document(profile_id.get_guid())
+def _intern(profile_id: ProfileId) -> ProfileId:
+    """Record a ProfileId whose guid is already known, so later lookups skip the query."""
+    if profile_id._guid:
+        _GUID_CACHE.put(profile_id._get_qualified_id(), profile_id._guid)
+    return profile_id
+
+
+def profile_id_from_document(profile) -> ProfileId:
+    return _intern(
+        ProfileId(profile.get("namespace"), profile.get("identifier"), guid=profile.id)
     )
-    profile = profile_ref.get()
-    if not profile.exists:
-        raise Exception(f"Could not locate profile '{profile_id.get_guid()}'")
 
-    profile_data = profile.to_dict()
-    if field not in profile_data:
-        raise Exception(f"Profile does not contain field '{field}'")
-    return profile_data[field]
 
+class ProfileSnapshot:
+    """A profile document read once, its fields are then served from memory."""
+
+    def __init__(self, profile_id: ProfileId, profile):
+        self.profile_id = profile_id
+        self._data = profile.to_dict()
+
+    def get(self, field: str):
+        if field not in self._data:
+            raise Exception(f"Profile does not contain field '{field}'")
+        return self._data[field]
+
+
+@span("profile.load")
+def load_profile_snapshot(profile_id: ProfileId) -> ProfileSnapshot:
+    profile = None
+    if profile_id._has_known_guid():
+        profile = (
+            get_db()
+            .collection(PROFILES_COLLECTION)
+            .document(profile_id.get_guid())
+            .get()
+        )
+        if not profile.exists:
+            if profile_id.namespace == LOCAL_NS:
+                raise Exception(f"Could not locate profile '{profile_id.get_guid()}'")
+            # Another process may have deleted the profile and created it again under
+            # a new guid, look it up afresh rather than keep resolving the stale one
+            forget_profile_guid(profile_id)
+            profile_id._guid = None
+            profile = None
+
+    if profile is None:
+        # The guid lookup returns the whole document, no need to read it again
+        profile = profile_id._query_document()
+        profile_id._guid = profile.id
+        _intern(profile_id)
+    return ProfileSnapshot(profile_id, profile)
+
+
+def get_profile_field(profile_id: ProfileId, field: str):
+    """Read a single field; load a `ProfileSnapshot` to read several."""
+    return load_profile_snapshot(profile_id).get(field)
 
+
+@span("profile.set_field")
 def _set_profile_field(profile_id: ProfileId, field: str, value):
     profile_ref = (
-        get_db().collection(_PROFILES_COLLECTION).document(profile_id.get_guid())
+        get_db().collection(PROFILES_COLLECTION).document(profile_id.get_guid())
     )
-    profile = profile_ref.get()
-    if not profile.exists:
-        raise Exception(f"Could not locate profile '{profile_id.get_guid()}'")
-
-    profile_ref.update({field: value})
+    try:
+        # Updates already require the document to exist
+        profile_ref.update({field: value})
+    except NotFound as err:
+        raise Exception(f"Could not locate profile '{profile_id.get_guid()}'") from err
 
 
 def set_profile_nickname(profile_id: ProfileId, nickname: str):
     _set_profile_field(profile_id, "nickname", nickname)
 
 
+@span("profile.set_display_name")
+def set_profile_display_name(profile_id: ProfileId, display_name: str):
+    get_db().collection(PROFILES_COLLECTION).document(profile_id.get_guid()).update(
+        {"display_name": display_name, "display_name_updated_at": SERVER_TIMESTAMP}
+    )
+
+
 def get_profile_subcollection(profile_id: ProfileId, subcollection_id: str):
     profile_ref = (
-        get_db().collection(_PROFILES_COLLECTION).document(profile_id.get_guid())
+        get_db().collection(PROFILES_COLLECTION).document(profile_id.get_guid())
     )
     return profile_ref.collection(subcollection_id)
 
@@ -104,7 +188,7 @@ def get_profile_subcollection(profile_id: ProfileId, subcollection_id: str):
 def _create_profile(transaction, namespace, identifier):
     matching_profile_query = (
         get_db()
-        .collection(_PROFILES_COLLECTION)
+        .collection(PROFILES_COLLECTION)
         .where("namespace", "==", namespace)
         .where("identifier", "==", identifier)
     )
@@ -113,17 +197,17 @@ def _create_profile(transaction, namespace, identifier):
         raise Exception(
             f"Profile <'namespace':'{namespace}', 'identifier':'{identifier}'> already exists!"
         )
-    profile_ref = get_db().collection(_PROFILES_COLLECTION).document()
+    profile_ref = get_db().collection(PROFILES_COLLECTION).document()
     transaction.create(profile_ref, {"namespace": namespace, "identifier": identifier})
 
-    return ProfileId(namespace, identifier)
+    return ProfileId(namespace, identifier, guid=profile_ref.id)
 
 
 @transactional
 def _get_or_create_profile(transaction, namespace, identifier, user: UserId = None):
     matching_profile_query = (
         get_db()
-        .collection(_PROFILES_COLLECTION)
+        .collection(PROFILES_COLLECTION)
         .where("namespace", "==", namespace)
         .where("identifier", "==", identifier)
     )
@@ -139,53 +223,81 @@ def _get_or_create_profile(transaction, namespace, identifier, user: UserId = No
             elif not current_user:
                 transaction.update(profile.reference, {"user": user.get_guid()})
 
-        return ProfileId(namespace, identifier)
+        return ProfileId(namespace, identifier, guid=profile.id)
     elif matches:
         raise Exception(
             f"Multiple profiles exist with <'namespace':'{namespace}', 'identifier':'{identifier}'>!"
         )
-    profile_ref = get_db().collection(_PROFILES_COLLECTION).document()
+    profile_ref = get_db().collection(PROFILES_COLLECTION).document()
     profile_data = {"namespace": namespace, "identifier": identifier}
     if user:
         profile_data["user"] = user.get_guid()
     transaction.create(profile_ref, profile_data)
 
-    return ProfileId(namespace, identifier)
+    return ProfileId(namespace, identifier, guid=profile_ref.id)
 
 
 def create_profile(namespace: str, identifier: str) -> ProfileId:
     transaction = get_db().transaction()
-    return _create_profile(transaction, namespace, identifier)
+    return _intern(_create_profile(transaction, namespace, identifier))
 
 
+@span("profile.get_or_create")
 def get_or_create_profile(
     namespace: str, identifier: str, user: UserId = None
 ) -> ProfileId:
     transaction = get_db().transaction()
-    return _get_or_create_profile(transaction, namespace, identifier, user)
+    return _intern(_get_or_create_profile(transaction, namespace, identifier, user))
 
 
+def forget_profile_guid(profile_id: ProfileId) -> None:
+    """Drop the interned guid of a deleted profile."""
+    _GUID_CACHE.invalidate(profile_id._get_qualified_id())
+
+
+@span("profile.delete")
 def delete_profile(profile_id: ProfileId) -> None:
-    get_db().collection(_PROFILES_COLLECTION).document(profile_id.get_guid()).delete()
+    get_db().collection(PROFILES_COLLECTION).document(profile_id.get_guid()).delete()
+    forget_profile_guid(profile_id)
 
 
 def list_user_profiles(user: UserId) -> List[ProfileId]:
     query = (
-        get_db().collection(_PROFILES_COLLECTION).where("user", "==", user.get_guid())
+        get_db().collection(PROFILES_COLLECTION).where("user", "==", user.get_guid())
     )
     matches = list(query.stream())
+    return [profile_id_from_document(profile) for profile in matches]
+
+
+class ProfileSummary(NamedTuple):
+    profile_id: ProfileId
+    display_name: Optional[str]
+    display_name_updated_at: Optional[datetime]
+
+
+@span("profile.list_summaries")
+def list_user_profile_summaries(user: UserId) -> List[ProfileSummary]:
+    """Like `list_user_profiles`, along with the display names stored on each profile."""
+    query = (
+        get_db().collection(PROFILES_COLLECTION).where("user", "==", user.get_guid())
+    )
     return [
-        ProfileId(profile.get("namespace"), profile.get("identifier"))
-        for profile in matches
+        ProfileSummary(
+            profile_id_from_document(profile),
+            profile.to_dict().get("display_name"),
+            profile.to_dict().get("display_name_updated_at"),
+        )
+        for profile in query.stream()
     ]
 
 
+@span("profile.get")
 def get_by_guid(profile_guid: str, user: Optional[UserId] = None) -> ProfileId:
-    profile = get_db().collection(_PROFILES_COLLECTION).document(profile_guid).get()
+    profile = get_db().collection(PROFILES_COLLECTION).document(profile_guid).get()
     if not profile.exists:
         raise ProfileNotFoundError(f"Did not find ProfileId@{profile_guid}")
     if user and profile.get("user") != user.get_guid():
         raise ProfileUserMismatchError(
             f"ProfileId@{profile_guid} does not belong to UserId@{user.get_guid()}"
         )
-    return ProfileId(profile.get("namespace"), profile.get("identifier"))
+    return profile_id_from_document(profile)
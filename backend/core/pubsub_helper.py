@@ -1,31 +1,195 @@
+import atexit
 import base64
 import json
 import os
+import threading
+import time
+from concurrent import futures as concurrent_futures
 from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
 
+from google.api_core.datetime_helpers import from_rfc3339
 from google.cloud import pubsub_v1
 
-
-_CLIENT = pubsub_v1.PublisherClient()
+from .tracing import span
+
+_BATCH_SETTINGS = pubsub_v1.types.BatchSettings(
+    max_messages=int(os.environ.get("PUBSUB_BATCH_MAX_MESSAGES", 100)),
+    max_bytes=int(os.environ.get("PUBSUB_BATCH_MAX_BYTES", 1024 * 1024)),
+    max_latency=float(os.environ.get("PUBSUB_BATCH_MAX_LATENCY_SECONDS", 0.01)),
+)
+_FLOW_CONTROL = pubsub_v1.types.PublishFlowControl(
+    message_limit=int(os.environ.get("PUBSUB_FLOW_CONTROL_MAX_MESSAGES", 10000)),
+    byte_limit=int(os.environ.get("PUBSUB_FLOW_CONTROL_MAX_BYTES", 10 * 1024 * 1024)),
+    limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK,
+)
+# Upper bound on publishes that have been handed off but not yet acknowledged
+_MAX_IN_FLIGHT = int(os.environ.get("PUBSUB_MAX_IN_FLIGHT", 1000))
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def _get_client() -> pubsub_v1.PublisherClient:
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if not _CLIENT:
+            _CLIENT = pubsub_v1.PublisherClient(
+                batch_settings=_BATCH_SETTINGS,
+                publisher_options=pubsub_v1.types.PublisherOptions(
+                    flow_control=_FLOW_CONTROL
+                ),
+            )
+    return _CLIENT
+
+
+class PublishStats:
+    """Publishes recorded into it, and their rate since the first one was handed off.
+
+    Process-wide totals are kept in any case, pass an instance to `publisher()` to also
+    measure a single run of publishes on its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.published = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started_at = None
+
+    def mark_started(self) -> None:
+        if self.started_at is None:
+            with self._lock:
+                if self.started_at is None:
+                    self.started_at = time.monotonic()
+
+    def record(self, size: int, succeeded: bool) -> None:
+        with self._lock:
+            if succeeded:
+                self.published += 1
+                self.bytes += size
+            else:
+                self.failed += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            elapsed = (
+                time.monotonic() - self.started_at if self.started_at is not None else 0
+            )
+            return {
+                "published": self.published,
+                "failed": self.failed,
+                "bytes": self.bytes,
+                "messages_per_second": (
+                    round(self.published / elapsed, 1) if elapsed else 0.0
+                ),
+            }
+
+
+_STATS = PublishStats()
+_IN_FLIGHT_SLOTS = threading.BoundedSemaphore(_MAX_IN_FLIGHT)
+_PENDING_LOCK = threading.Lock()
+_PENDING_FUTURES = set()
+
+
+def _encode_event(data: dict) -> bytes:
+    json_data = json.dumps(data)
+    return base64.standard_b64encode(json_data.encode())
+
+
+def _on_publish_done(future, size: int, stats: Optional[PublishStats]) -> None:
+    succeeded = future.exception() is None
+    _STATS.record(size, succeeded)
+    if stats is not None:
+        stats.record(size, succeeded)
+    with _PENDING_LOCK:
+        _PENDING_FUTURES.discard(future)
+    _IN_FLIGHT_SLOTS.release()
+
+
+def publish_event_async(topic: str, data: dict, stats: Optional[PublishStats] = None):
+    """Hand an event off to the shared, batching publisher without waiting for it.
+
+    Only blocks when the in-flight window is full. Returns the publish future.
+    """
+    client = _get_client()
+    b64data = _encode_event(data)
+    _STATS.mark_started()
+    if stats is not None:
+        stats.mark_started()
+
+    _IN_FLIGHT_SLOTS.acquire()
+    try:
+        future = client.publish(
+            client.topic_path(os.environ["GCLOUD_PROJECT"], topic), b64data
+        )
+    except Exception:
+        _IN_FLIGHT_SLOTS.release()
+        raise
+    with _PENDING_LOCK:
+        _PENDING_FUTURES.add(future)
+    future.add_done_callback(lambda f: _on_publish_done(f, len(b64data), stats))
+    return future
+
+
+def flush(timeout: Optional[float] = None) -> None:
+    """Wait for every event handed to `publish_event_async` so far to be acknowledged."""
+    with _PENDING_LOCK:
+        pending = list(_PENDING_FUTURES)
+    concurrent_futures.wait(pending, timeout=timeout)
+
+
+def get_publish_stats() -> dict:
+    return _STATS.to_dict()
+
+
+# Deliver whatever is still buffered before the process goes away
+atexit.register(flush)
 
 
 class _ContextualPublisher:
-    def __init__(self, topic: str, futures: list):
-        self._topic_path = _CLIENT.topic_path(os.environ["GCLOUD_PROJECT"], topic)
-        self._futures = futures
+    """Publishes through the shared client, tracking only its own outstanding events."""
+
+    def __init__(self, topic: str, stats: Optional[PublishStats] = None):
+        self._topic = topic
+        self._stats = stats
+        self._done = threading.Condition()
+        self._pending = 0
+        self._error = None
+
+    def _on_done(self, future) -> None:
+        err = future.exception()
+        with self._done:
+            self._pending -= 1
+            self._error = self._error or err
+            self._done.notify_all()
 
     def publish_event(self, data: dict) -> None:
-        json_data = json.dumps(data)
-        b64data = base64.standard_b64encode(json_data.encode())
-        future = _CLIENT.publish(self._topic_path, b64data)
-        self._futures.append(future)
+        with self._done:
+            self._pending += 1
+        try:
+            future = publish_event_async(self._topic, data, self._stats)
+        except Exception:
+            with self._done:
+                self._pending -= 1
+            raise
+        future.add_done_callback(self._on_done)
+
+    def wait(self) -> None:
+        with self._done:
+            self._done.wait_for(lambda: self._pending == 0)
+        if self._error:
+            raise self._error
 
 
 @contextmanager
-def publisher(topic: str):
-    futures = []
-    yield _ContextualPublisher(topic, futures)
-    [f.result() for f in futures]
+def publisher(topic: str, wait: bool = True, stats: Optional[PublishStats] = None):
+    pub = _ContextualPublisher(topic, stats)
+    yield pub
+    if wait:
+        with span("pubsub.wait"):
+            pub.wait()
 
 
 def get_event_field(envelope) -> str:
@@ -44,10 +208,20 @@ def get_event_field(envelope) -> str:
     return base64.standard_b64decode(b64data).decode()
 
 
+def get_event_publish_time(envelope) -> Optional[datetime]:
+    """Publish time of a pushed message; stays the same across redeliveries."""
+    publish_time = envelope.get("message", {}).get("publishTime")
+    return from_rfc3339(publish_time) if publish_time else None
+
+
 def _deserialize_data_dict(ser_data: str) -> dict:
     deser_1 = base64.standard_b64decode(ser_data)
-    deser_2 = base64.standard_b64decode(deser_1).decode()
-    return json.loads(deser_2)
+    return decode_message_data(deser_1)
+
+
+def decode_message_data(data: bytes) -> dict:
+    """Decode the payload of a pulled message, as published by `publish_event`."""
+    return json.loads(base64.standard_b64decode(data).decode())
 
 
 def get_event_data_dict(envelope) -> dict:
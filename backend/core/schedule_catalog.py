@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from typing import AnyStr, Dict, List, Optional, Tuple
+
+from .firestore_helper import get_db
+
+ScheduleId = AnyStr
+
+_SCHEDULES_COLLECTION = "schedules"
+
+_TTL_SECONDS = float(os.environ.get("SCHEDULE_CATALOG_TTL_SECONDS", 600))
+_USE_SNAPSHOT_LISTENER = os.environ.get("SCHEDULE_CATALOG_LISTENER", "") == "1"
+# A lookup of an unknown schedule reloads the catalog at most this often
+_MISS_RELOAD_INTERVAL_SECONDS = float(
+    os.environ.get("SCHEDULE_CATALOG_MISS_RELOAD_SECONDS", 30)
+)
+
+
+class UnknownScheduleError(Exception):
+    def __init__(self, schedule_id: ScheduleId):
+        super(UnknownScheduleError, self).__init__(f"Unknown schedule '{schedule_id}'")
+        self.schedule_id = schedule_id
+
+
+class _ScheduleCatalog:
+    """In-memory copy of the `schedules` collection.
+
+    Refreshed when older than the TTL or, when enabled, kept current by a snapshot listener.
+    """
+
+    def __init__(self, ttl: float, use_listener: bool, miss_reload_interval: float):
+        self._ttl = ttl
+        self._use_listener = use_listener
+        self._miss_reload_interval = miss_reload_interval
+
+        self._load_lock = threading.Lock()
+        self._frequency_by_id: Dict[ScheduleId, int] = {}
+        self._by_frequency: List[Tuple[int, ScheduleId]] = []
+        self._loaded_at = None
+        self._watch = None
+
+    def _replace(self, schedule_docs) -> None:
+        frequency_by_id = {
+            doc.id: int(doc.get("daily_frequency")) for doc in schedule_docs
+        }
+        # Swap whole structures so readers never see a partially built catalog
+        self._by_frequency = sorted(
+            [(freq, schedule_id) for schedule_id, freq in frequency_by_id.items()],
+            reverse=True,
+        )
+        self._frequency_by_id = frequency_by_id
+        self._loaded_at = time.monotonic()
+
+    def _on_snapshot(self, docs, changes, read_time) -> None:
+        self._replace(docs)
+
+    def _is_stale(self) -> bool:
+        if self._loaded_at is None:
+            return True
+        if self._watch is not None:
+            return False
+        return time.monotonic() - self._loaded_at >= self._ttl
+
+    def _load(self) -> None:
+        """Must be called with the load lock held."""
+        self._replace(get_db().collection(_SCHEDULES_COLLECTION).stream())
+        if self._use_listener and self._watch is None:
+            self._watch = (
+                get_db()
+                .collection(_SCHEDULES_COLLECTION)
+                .on_snapshot(self._on_snapshot)
+            )
+
+    def refresh(self) -> None:
+        with self._load_lock:
+            self._load()
+
+    def _ensure_fresh(self) -> None:
+        if self._is_stale():
+            with self._load_lock:
+                # Threads queued on the lock find the catalog already reloaded
+                if self._is_stale():
+                    self._load()
+
+    def _can_reload_for_miss(self) -> bool:
+        if self._watch is not None:
+            # The listener already delivers new schedules
+            return False
+        return time.monotonic() - self._loaded_at >= self._miss_reload_interval
+
+    def _reload_for_miss(self, schedule_id: ScheduleId) -> None:
+        """The schedule may have been added since the last load, unless that was recent."""
+        if not self._can_reload_for_miss():
+            return
+        with self._load_lock:
+            if schedule_id not in self._frequency_by_id and self._can_reload_for_miss():
+                self._load()
+
+    def get_daily_frequency(self, schedule_id: ScheduleId) -> int:
+        self._ensure_fresh()
+        if schedule_id not in self._frequency_by_id:
+            self._reload_for_miss(schedule_id)
+        if schedule_id not in self._frequency_by_id:
+            raise UnknownScheduleError(schedule_id)
+        return self._frequency_by_id[schedule_id]
+
+    def get_loaded_daily_frequency(self, schedule_id: ScheduleId) -> Optional[int]:
+        if self._is_stale():
+            return None
+        return self._frequency_by_id.get(schedule_id)
+
+    def list_by_daily_frequency(self) -> List[Tuple[int, ScheduleId]]:
+        self._ensure_fresh()
+        return self._by_frequency
+
+
+_CATALOG = _ScheduleCatalog(
+    _TTL_SECONDS, _USE_SNAPSHOT_LISTENER, _MISS_RELOAD_INTERVAL_SECONDS
+)
+
+
+def get_daily_frequency(schedule_id: ScheduleId) -> int:
+    return _CATALOG.get_daily_frequency(schedule_id)
+
+
+def get_loaded_daily_frequency(schedule_id: ScheduleId) -> Optional[int]:
+    """Frequency from the catalog as loaded, never blocking on a load.
+
+    `None` when the catalog is stale or doesn't know the schedule, in which case
+    `get_daily_frequency` has to be called (off the event loop for async callers).
+    """
+    return _CATALOG.get_loaded_daily_frequency(schedule_id)
+
+
+def list_schedules_by_daily_frequency() -> List[Tuple[int, ScheduleId]]:
+    """(daily_frequency, schedule ID) pairs, most frequent first."""
+    return _CATALOG.list_by_daily_frequency()
+
+
+def refresh_schedule_catalog() -> None:
+    _CATALOG.refresh()
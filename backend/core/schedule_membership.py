@@ -0,0 +1,114 @@
+"""Denormalized index of the target deposits on each schedule.
+
+Members live in `schedules/{id}/membership/{chunk}` documents, one `entries` map per
+chunk keyed by "{profile guid}:{product}", so the fanout reads a few dozen documents
+instead of a collection group query plus a parent profile per deposit. A profile's
+entries always hash to the same chunk.
+
+Writers keep the index in sync in the same batch or transaction as the target deposit;
+`backend/scripts/rebuild_schedule_membership.py` verifies and repairs it.
+"""
+
+import hashlib
+import os
+from typing import Dict, List, NamedTuple
+
+from .firestore_helper import DELETE_FIELD, get_db
+from .profile import ProfileId
+from .schedule_catalog import ScheduleId
+
+_SCHEDULES_COLLECTION = "schedules"
+_MEMBERSHIP_COLLECTION = "membership"
+
+# Changing the chunk count requires rebuilding the index
+MEMBERSHIP_CHUNKS = int(os.environ.get("SCHEDULE_MEMBERSHIP_CHUNKS", 64))
+
+
+class ScheduleMember(NamedTuple):
+    profile_id: ProfileId
+    product_id: str
+    amount: float
+
+
+def membership_key(profile_guid: str, product_id: str) -> str:
+    return f"{profile_guid}:{product_id}"
+
+
+def membership_chunk_id(profile_guid: str) -> str:
+    digest = hashlib.sha1(profile_guid.encode()).hexdigest()
+    # Zero-padded so chunks sort, and partition, in numeric order
+    return f"{int(digest, 16) % MEMBERSHIP_CHUNKS:04d}"
+
+
+def membership_chunk_ids() -> List[str]:
+    return [f"{chunk:04d}" for chunk in range(MEMBERSHIP_CHUNKS)]
+
+
+def get_membership_collection(schedule_id: ScheduleId):
+    return (
+        get_db()
+        .collection(_SCHEDULES_COLLECTION)
+        .document(schedule_id)
+        .collection(_MEMBERSHIP_COLLECTION)
+    )
+
+
+def get_membership_chunk_ref(schedule_id: ScheduleId, chunk_id: str):
+    return get_membership_collection(schedule_id).document(chunk_id)
+
+
+def membership_entry(profile_id: ProfileId, product_id: str, amount: float) -> dict:
+    return {
+        "profile": profile_id.get_guid(),
+        "namespace": profile_id.namespace,
+        "identifier": profile_id.identifier,
+        "product": product_id,
+        "amount": float(amount),
+    }
+
+
+def add_member(
+    batch,
+    schedule_id: ScheduleId,
+    profile_id: ProfileId,
+    product_id: str,
+    amount: float,
+) -> None:
+    """Stage adding (or updating) a member on `batch`, a write batch or transaction."""
+    profile_guid = profile_id.get_guid()
+    batch.set(
+        get_membership_chunk_ref(schedule_id, membership_chunk_id(profile_guid)),
+        {
+            "entries": {
+                membership_key(profile_guid, product_id): membership_entry(
+                    profile_id, product_id, amount
+                )
+            }
+        },
+        merge=True,
+    )
+
+
+def remove_member(
+    batch, schedule_id: ScheduleId, profile_id: ProfileId, product_id: str
+) -> None:
+    """Stage removing a member on `batch`, a no-op for members that aren't indexed."""
+    profile_guid = profile_id.get_guid()
+    batch.set(
+        get_membership_chunk_ref(schedule_id, membership_chunk_id(profile_guid)),
+        {"entries": {membership_key(profile_guid, product_id): DELETE_FIELD}},
+        merge=True,
+    )
+
+
+def members_from_chunk(chunk) -> List[ScheduleMember]:
+    entries: Dict[str, dict] = (chunk.to_dict() or {}).get("entries", {})
+    return [
+        ScheduleMember(
+            ProfileId(entry["namespace"], entry["identifier"], guid=entry["profile"]),
+            entry["product"],
+            float(entry["amount"]),
+        )
+        # Sorted so a chunk always publishes in the same order
+        for _, entry in sorted(entries.items())
+    ]
@@ -1,5 +1,32 @@
+import os
+from typing import NamedTuple, Optional
+
+from backend.core.cache_helper import TTLCache
 from backend.core.profile import ProfileId
-from backend.core.secrets.secrets_helper import get_secret, set_secret, delete_secret
+from backend.core.secrets.secrets_helper import (
+    delete_secret,
+    ensure_secret,
+    get_secret,
+    set_secret,
+)
+
+
+class ProfileCredentials(NamedTuple):
+    api_key: str
+    b64secret: str
+    passphrase: str
+
+
+class SecretsWritten(NamedTuple):
+    written: int
+    unchanged: int
+
+
+# Credentials are keyed by ProfileId guid
+_CREDENTIALS_CACHE = TTLCache(
+    maxsize=int(os.environ.get("PROFILE_CREDENTIALS_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("PROFILE_CREDENTIALS_CACHE_TTL_SECONDS", 300)),
+)
 
 
 def get_api_key(profile_id: ProfileId) -> str:
@@ -8,10 +35,12 @@ def get_api_key(profile_id: ProfileId) -> str:
 
 def set_api_key(profile_id: ProfileId, api_key: str) -> None:
     set_secret(f"API_KEY_{profile_id.get_guid()}", api_key)
+    invalidate_api_credentials(profile_id)
 
 
 def delete_api_key(profile_id: ProfileId) -> None:
     delete_secret(f"API_KEY_{profile_id.get_guid()}")
+    invalidate_api_credentials(profile_id)
 
 
 def get_api_b64_secret(profile_id: ProfileId) -> str:
@@ -20,10 +49,12 @@ def get_api_b64_secret(profile_id: ProfileId) -> str:
 
 def set_api_b64_secret(profile_id: ProfileId, api_b64_secret: str) -> None:
     set_secret(f"API_SECRET_{profile_id.get_guid()}", api_b64_secret)
+    invalidate_api_credentials(profile_id)
 
 
 def delete_api_b64_secret(profile_id: ProfileId) -> None:
     delete_secret(f"API_SECRET_{profile_id.get_guid()}")
+    invalidate_api_credentials(profile_id)
 
 
 def get_api_passphrase(profile_id: ProfileId) -> str:
@@ -32,7 +63,53 @@ def get_api_passphrase(profile_id: ProfileId) -> str:
 
 def set_api_passphrase(profile_id: ProfileId, api_passphrase: str) -> None:
     set_secret(f"API_PASSPHRASE_{profile_id.get_guid()}", api_passphrase)
+    invalidate_api_credentials(profile_id)
 
 
 def delete_api_passphrase(profile_id: ProfileId) -> None:
     delete_secret(f"API_PASSPHRASE_{profile_id.get_guid()}")
+    invalidate_api_credentials(profile_id)
+
+
+def get_api_credentials(profile_id: ProfileId) -> ProfileCredentials:
+    """API key, b64 secret and passphrase for the profile, served from an in-process cache when warm."""
+    return _CREDENTIALS_CACHE.get_or_load(
+        profile_id.get_guid(),
+        lambda: ProfileCredentials(
+            get_api_key(profile_id),
+            get_api_b64_secret(profile_id),
+            get_api_passphrase(profile_id),
+        ),
+    )
+
+
+def ensure_api_credentials(
+    profile_id: ProfileId, credentials: ProfileCredentials
+) -> SecretsWritten:
+    """Store the credentials, skipping secrets that already hold the same value."""
+    guid = profile_id.get_guid()
+    secrets = (
+        (f"API_KEY_{guid}", credentials.api_key),
+        (f"API_SECRET_{guid}", credentials.b64secret),
+        (f"API_PASSPHRASE_{guid}", credentials.passphrase),
+    )
+    written = sum(
+        ensure_secret(secret_name, payload) for secret_name, payload in secrets
+    )
+    if written:
+        invalidate_api_credentials(profile_id)
+    return SecretsWritten(written, len(secrets) - written)
+
+
+def get_cached_api_credentials(profile_id: ProfileId) -> Optional[ProfileCredentials]:
+    return _CREDENTIALS_CACHE.get(profile_id.get_guid())
+
+
+def cache_api_credentials(
+    profile_id: ProfileId, credentials: ProfileCredentials
+) -> None:
+    _CREDENTIALS_CACHE.put(profile_id.get_guid(), credentials)
+
+
+def invalidate_api_credentials(profile_id: ProfileId) -> None:
+    _CREDENTIALS_CACHE.invalidate(profile_id.get_guid())
@@ -3,6 +3,8 @@ import os
 from google.api_core.exceptions import NotFound
 from google.cloud import secretmanager
 
+from backend.core.tracing import span
+
 _PROJECT_ID = os.environ["GCLOUD_PROJECT"]
 
 _CLIENT: secretmanager.SecretManagerServiceClient = None
@@ -20,21 +22,23 @@ def _get_secret_parent_name() -> str:
     return f"projects/{_PROJECT_ID}"
 
 
-def _get_qualified_secret_name(secret_name: str) -> str:
+def get_qualified_secret_name(secret_name: str) -> str:
     return f"projects/{_PROJECT_ID}/secrets/{secret_name}"
 
 
-def _get_qualified_secret_version_name(secret_name: str) -> str:
+def get_qualified_secret_version_name(secret_name: str) -> str:
     return f"projects/{_PROJECT_ID}/secrets/{secret_name}/versions/latest"
 
 
+@span("secrets.get")
 def get_secret(secret_name: str) -> str:
     res = _get_client().access_secret_version(
-        name=_get_qualified_secret_version_name(secret_name)
+        name=get_qualified_secret_version_name(secret_name)
     )
     return res.payload.data.decode("utf-8")
 
 
+@span("secrets.create")
 def create_secret(secret_name: str, secret_payload: str) -> None:
     secret = _get_client().create_secret(
         {
@@ -48,13 +52,15 @@ def create_secret(secret_name: str, secret_payload: str) -> None:
     )
 
 
+@span("secrets.delete")
 def delete_secret(secret_name: str) -> None:
-    _get_client().delete_secret(name=_get_qualified_secret_name(secret_name))
+    _get_client().delete_secret(name=get_qualified_secret_name(secret_name))
 
 
+@span("secrets.set")
 def set_secret(secret_name: str, secret_payload: str) -> None:
     try:
-        secret = _get_client().get_secret(name=_get_qualified_secret_name(secret_name))
+        secret = _get_client().get_secret(name=get_qualified_secret_name(secret_name))
     except NotFound:
         create_secret(secret_name, secret_payload)
     else:
@@ -67,3 +73,19 @@ def set_secret(secret_name: str, secret_payload: str) -> None:
         for stale_v in stale_versions:
             if stale_v.state != secretmanager.SecretVersion.State.DESTROYED:
                 _get_client().destroy_secret_version(name=stale_v.name)
+
+
+@span("secrets.ensure")
+def ensure_secret(secret_name: str, secret_payload: str) -> bool:
+    """Like `set_secret`, but only writes when the latest version differs.
+
+    Returns whether a new version was written.
+    """
+    try:
+        if get_secret(secret_name) == secret_payload:
+            return False
+    except NotFound:
+        # Either the secret or any enabled version is missing, `set_secret` handles both
+        pass
+    set_secret(secret_name, secret_payload)
+    return True
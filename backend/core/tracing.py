@@ -0,0 +1,207 @@
+"""Per-request stage timings.
+
+A request opens a trace with `request_trace` (or `start_trace`/`finish_trace` from
+framework hooks); code below it times stages with `span` and bumps `incr` counters. When
+the request ends one JSON log line summarises it, e.g.
+
+    {"severity": "INFO", "message": "tradebot", "duration_ms": 131.2,
+     "stages": {"secrets.get": {"count": 3, "ms": 46.1}, ...},
+     "counters": {"transaction.attempts": 1}, "product": "BTC-USD"}
+
+Set REQUEST_TRACING=0 to turn it off, spans then cost a function call and no timing.
+With REQUEST_TRACING_OTEL=1 spans are also exported through OpenTelemetry, when installed.
+"""
+
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+_ENABLED = os.environ.get("REQUEST_TRACING", "1") == "1"
+
+_OTEL_TRACER = None
+if _ENABLED and os.environ.get("REQUEST_TRACING_OTEL", "") == "1":
+    try:
+        from opentelemetry import context as otel_context
+        from opentelemetry import trace as otel_trace
+    except ImportError:
+        print("REQUEST_TRACING_OTEL is set but opentelemetry is not installed")
+    else:
+        _OTEL_TRACER = otel_trace.get_tracer(__name__)
+
+_CURRENT_TRACE = contextvars.ContextVar("request_trace", default=None)
+
+
+class _Trace:
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = Counter()
+        self._started = time.perf_counter()
+        self._token = None
+        self._otel_span = None
+        self._otel_token = None
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            count, total = self._stages.get(name, (0, 0.0))
+            self._stages[name] = (count + 1, total + seconds)
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {"count": count, "ms": round(1000 * total, 1)}
+                for name, (count, total) in self._stages.items()
+            }
+            counters = dict(self._counters)
+        return dict(
+            self.attributes,
+            severity="INFO",
+            message=self.name,
+            duration_ms=round(1000 * (time.perf_counter() - self._started), 1),
+            stages=stages,
+            counters=counters,
+        )
+
+
+def start_trace(name: str, **attributes) -> Optional[_Trace]:
+    """Make a new trace current; pair with `finish_trace`."""
+    if not _ENABLED:
+        return None
+    trace = _Trace(name, attributes)
+    trace._token = _CURRENT_TRACE.set(trace)
+    if _OTEL_TRACER is not None:
+        trace._otel_span = _OTEL_TRACER.start_span(name, attributes=attributes)
+        trace._otel_token = otel_context.attach(
+            otel_trace.set_span_in_context(trace._otel_span)
+        )
+    return trace
+
+
+def finish_trace(trace: Optional[_Trace]) -> None:
+    """Log the trace summary and restore the previously current trace."""
+    if trace is None:
+        return
+    if trace._otel_span is not None:
+        otel_context.detach(trace._otel_token)
+        trace._otel_span.end()
+    try:
+        _CURRENT_TRACE.reset(trace._token)
+    except ValueError:
+        # Finished from a different context than it was started in
+        _CURRENT_TRACE.set(None)
+    print(json.dumps(trace.to_dict(), default=str))
+    # Flush the stdout to avoid log buffering.
+    sys.stdout.flush()
+
+
+@contextmanager
+def request_trace(name: str, **attributes):
+    trace = start_trace(name, **attributes)
+    try:
+        yield trace
+    finally:
+        finish_trace(trace)
+
+
+def set_attribute(key: str, value) -> None:
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.attributes[key] = value
+
+
+def incr(name: str, value: int = 1) -> None:
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.incr(name, value)
+
+
+def add_stage(name: str, seconds: float) -> None:
+    """Record a stage timed by the caller, for durations a `span` cannot wrap."""
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.add_stage(name, seconds)
+
+
+class _Span:
+    __slots__ = ("_name", "_trace", "_started", "_otel_span")
+
+    def __init__(self, name: str):
+        self._name = name
+        self._trace = None
+        self._otel_span = None
+
+    def __enter__(self):
+        self._trace = _CURRENT_TRACE.get()
+        if self._trace is not None:
+            if _OTEL_TRACER is not None:
+                self._otel_span = _OTEL_TRACER.start_as_current_span(self._name)
+                self._otel_span.__enter__()
+            self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._trace is not None:
+            self._trace.add_stage(self._name, time.perf_counter() - self._started)
+            if self._otel_span is not None:
+                self._otel_span.__exit__(exc_type, exc_value, traceback)
+
+    def __call__(self, fn: Callable) -> Callable:
+        name = self._name
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def __call__(self, fn: Callable) -> Callable:
+        return fn
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str):
+    """Time a stage of the current request, as a context manager or a decorator."""
+    if not _ENABLED:
+        return _NOOP_SPAN
+    return _Span(name)
+
+
+def wrap(fn: Callable) -> Callable:
+    """Bind `fn` to the current trace, for running it on another thread."""
+    if not _ENABLED:
+        return fn
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return wrapper
@@ -1,20 +1,52 @@
-from typing import AnyStr, Dict, List
-
-from .cbpro_client_helper import get_public_client, PublicClient
-from .firestore_helper import get_db, DocumentSnapshot
-from .profile import ProfileId, get_profile_field, get_profile_subcollection
+from typing import AnyStr, Dict, List, NamedTuple, Optional, Tuple
+
+from .firestore_helper import DocumentSnapshot, get_db, transactional
+from .product_catalog import get_product_details
+from .profile import (
+    ProfileId,
+    ProfileSnapshot,
+    get_profile_subcollection,
+    load_profile_snapshot,
+)
+from .schedule_membership import add_member, remove_member
+from .tracing import span
+from .schedule_catalog import (
+    ScheduleId,
+    get_daily_frequency,
+    list_schedules_by_daily_frequency,
+)
 
 ProductId = AnyStr
-ScheduleId = AnyStr
+
+# Version of the trade event payload published by the schedule fanout
+TRADE_EVENT_VERSION = 2
+
+# Each change takes up to 3 writes and a transaction holds at most 500
+MAX_ALLOCATION_CHANGES = 100
+
+
+class InvalidAllocationError(Exception):
+    pass
+
+
+class AllocationChange(NamedTuple):
+    product_id: ProductId
+    # `None` removes the allocation
+    daily_target_amount: Optional[float]
 
 
 class TradeSpec:
     def __init__(
-        self, product: ProductId, daily_frequency: int, daily_target_amount: float
+        self,
+        product: ProductId,
+        daily_frequency: int,
+        daily_target_amount: float,
+        schedule_id: Optional[ScheduleId] = None,
     ):
         self.product = product
         self.daily_frequency = daily_frequency
         self.daily_target_amount = daily_target_amount
+        self.schedule_id = schedule_id
 
     def get_product_id(self) -> ProductId:
         return self.product
@@ -35,28 +67,45 @@ class TradeSpec:
             "dailyTargetAmount": self.daily_target_amount,
         }
 
+    def to_event_dict(self) -> dict:
+        return {
+            "amount": self.daily_target_amount,
+            "schedule": self.schedule_id,
+            "daily_frequency": self.daily_frequency,
+        }
+
 
-def _get_target_daily_deposits(profile: ProfileId) -> Dict[ProductId, float]:
-    target_deposit_list = get_profile_field(profile, "target_daily_deposits")
+def trade_spec_from_event_dict(product_id: ProductId, deposit: dict) -> TradeSpec:
+    return TradeSpec(
+        product_id,
+        int(deposit["daily_frequency"]),
+        float(deposit["amount"]),
+        deposit.get("schedule"),
+    )
+
+
+def get_schedule_daily_frequency(schedule_id: ScheduleId) -> int:
+    return get_daily_frequency(schedule_id)
+
+
+def _get_target_daily_deposits(profile: ProfileSnapshot) -> Dict[ProductId, float]:
+    target_deposit_list = profile.get("target_daily_deposits")
     assert isinstance(target_deposit_list, list)
     return {td["product_id"]: float(td["deposit_amount"]) for td in target_deposit_list}
 
 
-def _get_daily_deposit_frequency(profile: ProfileId) -> int:
-    schedule_id = get_profile_field(profile, "schedule")
+def _get_daily_deposit_frequency(profile: ProfileSnapshot) -> int:
+    schedule_id = profile.get("schedule")
     assert schedule_id and isinstance(schedule_id, str)
 
-    schedule_ref = get_db().collection("schedules").document(schedule_id)
-    schedule = schedule_ref.get()
-    if not schedule.exists:
-        raise Exception(f"Unknown schedule '{schedule_id}'")
-
-    return int(schedule.to_dict()["daily_frequency"])
+    return get_schedule_daily_frequency(schedule_id)
 
 
+@span("trade_spec.legacy_get")
 def legacy_get_trade_specs(profile: ProfileId) -> List[TradeSpec]:
-    daily_deposit_amounts = _get_target_daily_deposits(profile)
-    daily_frequency = _get_daily_deposit_frequency(profile)
+    profile_snapshot = load_profile_snapshot(profile)
+    daily_deposit_amounts = _get_target_daily_deposits(profile_snapshot)
+    daily_frequency = _get_daily_deposit_frequency(profile_snapshot)
 
     return [
         TradeSpec(product_id, daily_frequency, daily_amount)
@@ -64,44 +113,46 @@ def legacy_get_trade_specs(profile: ProfileId) -> List[TradeSpec]:
     ]
 
 
-def _trade_spec_from_document(trade_spec_doc: DocumentSnapshot) -> TradeSpec:
+def trade_spec_from_document(
+    trade_spec_doc: DocumentSnapshot, daily_frequency: Optional[int] = None
+) -> TradeSpec:
+    """Trade spec of a target deposit, looking the schedule frequency up if not given."""
     daily_target_amount = float(trade_spec_doc.get("deposit_amount"))
 
     schedule_id = trade_spec_doc.get("schedule")
     assert schedule_id and isinstance(schedule_id, str)
 
-    schedule_ref = get_db().collection("schedules").document(schedule_id)
-    schedule = schedule_ref.get()
-    if not schedule.exists:
-        raise Exception(f"Unknown schedule '{schedule_id}'")
-
-    daily_frequency = int(schedule.get("daily_frequency"))
+    if daily_frequency is None:
+        daily_frequency = get_schedule_daily_frequency(schedule_id)
 
-    return TradeSpec(trade_spec_doc.id, daily_frequency, daily_target_amount)
+    return TradeSpec(
+        trade_spec_doc.id, daily_frequency, daily_target_amount, schedule_id
+    )
 
 
 def _find_optimal_schedule(
-    product_id: ProductId, daily_target_amount: float, client: PublicClient
+    product_id: ProductId,
+    daily_target_amount: float,
+    namespace: str,
+    schedules: List[Tuple[int, ScheduleId]],
 ) -> ScheduleId:
-    buy_minimum = _get_validated_product_buy_minimum(product_id, client)
+    buy_minimum = _get_validated_product_buy_minimum(product_id, namespace)
     if daily_target_amount < buy_minimum:
-        raise f"Target daily amount ${daily_target_amount} is below the minimum buy (${buy_minimum}) for '{product_id}'"
-
-    schedules_by_daily_frequency = sorted(
-        [
-            (int(schedule_doc.to_dict()["daily_frequency"]), schedule_doc.id)
-            for schedule_doc in get_db().collection("schedules").stream()
-        ],
-        reverse=True,
-    )
-    for daily_frequency, schedule_id in schedules_by_daily_frequency:
+        raise InvalidAllocationError(
+            f"Target daily amount ${daily_target_amount} is below the minimum buy (${buy_minimum}) for '{product_id}'"
+        )
+
+    for daily_frequency, schedule_id in schedules:
         # Ensure that the per-order amount meets the exchange's minimum, but also ensure it's at least $2 since some exchanges charge a minimum fee of $0.01
         if daily_target_amount // daily_frequency >= max(buy_minimum + 1, 2):
             return schedule_id
 
-    assert f"Unable to find valid schedule for product '{product_id}' with target daily amount of ${daily_target_amount} and minimum market buy of ${buy_minimum}"
+    raise InvalidAllocationError(
+        f"Unable to find valid schedule for product '{product_id}' with target daily amount of ${daily_target_amount} and minimum market buy of ${buy_minimum}"
+    )
 
 
+@span("trade_spec.get")
 def get_trade_spec(profile: ProfileId, product_id: ProductId) -> TradeSpec:
     target_deposits_collection = get_profile_subcollection(profile, "target_deposits")
     deposit_spec = target_deposits_collection.document(product_id).get()
@@ -109,13 +160,14 @@ def get_trade_spec(profile: ProfileId, product_id: ProductId) -> TradeSpec:
         raise Exception(
             f"Could not find target deposit spec for profile '{profile.get_guid()}' and product '{product_id}'"
         )
-    return _trade_spec_from_document(deposit_spec)
+    return trade_spec_from_document(deposit_spec)
 
 
+@span("trade_spec.get_all")
 def get_all_trade_specs(profile: ProfileId) -> List[TradeSpec]:
     target_deposits_collection = get_profile_subcollection(profile, "target_deposits")
     return [
-        _trade_spec_from_document(spec_doc)
+        trade_spec_from_document(spec_doc)
         for spec_doc in target_deposits_collection.stream()
     ]
 
@@ -131,39 +183,168 @@ def _is_supported_product(product_details: dict) -> bool:
     )
 
 
-def _get_validated_product_buy_minimum(
-    product_id: ProductId, client: PublicClient
-) -> float:
-    all_products = client.get_products()
-    matching_products = list(filter(lambda p: p.get("id") == product_id, all_products))
-    if not matching_products:
-        raise Exception(f"Could not find product '{product_id}'")
-    if len(matching_products) > 1:
-        raise AssertionError(f"Found multiple products with ID '{product_id}'")
+def _get_validated_product_buy_minimum(product_id: ProductId, namespace: str) -> float:
+    product_details = get_product_details(namespace, product_id)
+    if not product_details:
+        raise InvalidAllocationError(f"Could not find product '{product_id}'")
 
-    [product_details] = matching_products
     if not _is_supported_product(product_details):
-        raise f"Unsupported product '{product_id}'"
+        raise InvalidAllocationError(f"Unsupported product '{product_id}'")
 
     return float(product_details["min_market_funds"])
 
 
+def _parse_product_id(product_id) -> ProductId:
+    if not isinstance(product_id, str) or not product_id:
+        raise InvalidAllocationError(f"Invalid product ID {product_id!r}")
+    return product_id
+
+
+def parse_allocation_changes(body: dict) -> List[AllocationChange]:
+    """Allocation changes of a request body like the one below, validating their types.
+
+    {"set": [{"productId": "BTC-USD", "dailyTargetAmount": 50}], "remove": ["ETH-USD"]}
+    """
+    allocations = body.get("set", [])
+    removed_product_ids = body.get("remove", [])
+    if not isinstance(allocations, list) or not isinstance(removed_product_ids, list):
+        raise InvalidAllocationError("Expected 'set' and 'remove' to be lists")
+
+    changes = []
+    for allocation in allocations:
+        if not isinstance(allocation, dict):
+            raise InvalidAllocationError(f"Invalid allocation {allocation!r}")
+        product_id = _parse_product_id(allocation.get("productId"))
+        try:
+            daily_target_amount = float(allocation.get("dailyTargetAmount"))
+        except (TypeError, ValueError) as err:
+            raise InvalidAllocationError(
+                f"Invalid target daily amount for '{product_id}'"
+            ) from err
+        changes.append(AllocationChange(product_id, daily_target_amount))
+    for product_id in removed_product_ids:
+        changes.append(AllocationChange(_parse_product_id(product_id), None))
+    return changes
+
+
+@span("trade_spec.apply_allocation_changes")
+def apply_allocation_changes(
+    profile: ProfileId, changes: List[AllocationChange]
+) -> None:
+    """Set and remove several allocations at once, all or nothing.
+
+    Every change is validated against the same schedules before anything is written,
+    then the deposits and their schedule memberships are committed in one transaction.
+    """
+    product_ids = [change.product_id for change in changes]
+    if len(set(product_ids)) != len(product_ids):
+        raise InvalidAllocationError("A product may only be changed once per request")
+    if len(changes) > MAX_ALLOCATION_CHANGES:
+        raise InvalidAllocationError(
+            f"At most {MAX_ALLOCATION_CHANGES} allocations can be changed at once"
+        )
+    if not changes:
+        return
+
+    schedules = list_schedules_by_daily_frequency()
+    schedule_by_product = {
+        change.product_id: _find_optimal_schedule(
+            change.product_id,
+            change.daily_target_amount,
+            profile.namespace,
+            schedules,
+        )
+        for change in changes
+        if change.daily_target_amount is not None
+    }
+
+    transaction = get_db().transaction()
+    _apply_allocation_changes(transaction, profile, changes, schedule_by_product)
+
+
+@transactional
+def _apply_allocation_changes(
+    transaction,
+    profile: ProfileId,
+    changes: List[AllocationChange],
+    schedule_by_product: Dict[ProductId, ScheduleId],
+) -> None:
+    target_deposits_collection = get_profile_subcollection(profile, "target_deposits")
+    deposit_refs = [
+        target_deposits_collection.document(change.product_id) for change in changes
+    ]
+    # Schedules the products are on now, to move or drop their memberships. Reading them
+    # in the transaction keeps concurrent edits from leaving a stale membership behind.
+    previous_schedules = {
+        deposit.id: deposit.get("schedule")
+        for deposit in get_db().get_all(deposit_refs, transaction=transaction)
+        if deposit.exists
+    }
+
+    for change, deposit_ref in zip(changes, deposit_refs):
+        product_id = change.product_id
+        previous_schedule = previous_schedules.get(product_id)
+        schedule_id = schedule_by_product.get(product_id)
+        if schedule_id:
+            transaction.set(
+                deposit_ref,
+                {
+                    "deposit_amount": change.daily_target_amount,
+                    "schedule": schedule_id,
+                },
+            )
+            add_member(
+                transaction,
+                schedule_id,
+                profile,
+                product_id,
+                change.daily_target_amount,
+            )
+        elif previous_schedule:
+            transaction.delete(deposit_ref)
+        if previous_schedule and previous_schedule != schedule_id:
+            remove_member(transaction, previous_schedule, profile, product_id)
+
+
+@span("trade_spec.set_allocation")
 def set_allocation(
     profile: ProfileId, product_id: ProductId, daily_target_amount: float
 ) -> None:
-    schedule_id = _find_optimal_schedule(
-        product_id, daily_target_amount, get_public_client(profile.namespace)
+    apply_allocation_changes(
+        profile, [AllocationChange(product_id, daily_target_amount)]
     )
-    target_deposits_collection = get_profile_subcollection(profile, "target_deposits")
-    target_deposits_collection.document(product_id).set(
-        {"deposit_amount": daily_target_amount, "schedule": schedule_id}
+
+
+@transactional
+def _remove_all_allocations(transaction, profile: ProfileId) -> None:
+    deposits_collection = get_profile_subcollection(profile, "target_deposits")
+    for deposit in deposits_collection.stream(transaction=transaction):
+        transaction.delete(deposit.reference)
+        remove_member(transaction, deposit.get("schedule"), profile, deposit.id)
+
+
+@span("trade_spec.remove_all_allocations")
+def remove_all_allocations(profile: ProfileId) -> None:
+    """Drop every target deposit of the profile along with its schedule memberships."""
+    transaction = get_db().transaction()
+    _remove_all_allocations(transaction, profile)
+
+
+@transactional
+def _remove_allocation(transaction, profile: ProfileId, product_id: ProductId) -> bool:
+    deposit_ref = get_profile_subcollection(profile, "target_deposits").document(
+        product_id
     )
+    deposit = deposit_ref.get(transaction=transaction)
+    if not deposit.exists:
+        return False
 
+    transaction.delete(deposit_ref)
+    remove_member(transaction, deposit.get("schedule"), profile, product_id)
+    return True
 
+
+@span("trade_spec.remove_allocation")
 def remove_allocation(profile: ProfileId, product_id: ProductId) -> bool:
-    target_deposits_collection = get_profile_subcollection(profile, "target_deposits")
-    for configured_deposit in target_deposits_collection.stream():
-        if configured_deposit.id == product_id:
-            configured_deposit.reference.delete()
-            return True
-    return False
+    transaction = get_db().transaction()
+    return _remove_allocation(transaction, profile, product_id)
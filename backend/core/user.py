@@ -1,9 +1,20 @@
+import os
+from typing import Optional
+
+from .cache_helper import TTLCache
 from .firestore_helper import get_db, lock_on_key, transactional
+from .tracing import span
 
 COINBASE = "coinbase"
 _VALID_PROVIDERS = (COINBASE,)
 
-_USERS_COLLECTION = "users"
+USERS_COLLECTION = "users"
+
+# (provider, identifier) -> user document ID
+_GUID_CACHE = TTLCache(
+    maxsize=int(os.environ.get("USER_GUID_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("USER_GUID_CACHE_TTL_SECONDS", 3600)),
+)
 
 
 class UserNotFoundError(Exception):
@@ -11,33 +22,45 @@ class UserNotFoundError(Exception):
 
 
 class UserId:
-    def __init__(self, provider, identifier):
+    def __init__(self, provider, identifier, guid: Optional[str] = None):
         assert provider in _VALID_PROVIDERS
         self.provider = provider
         self.identifier = identifier
 
-        self._guid = None
+        self._guid = guid
+
+    @span("user.query_guid")
+    def _query_guid(self) -> str:
+        user_query = (
+            get_db()
+            .collection(USERS_COLLECTION)
+            .where("provider", "==", self.provider)
+            .where("identifier", "==", self.identifier)
+        )
+        [user] = user_query.stream()
+        return user.id
 
     def get_guid(self) -> str:
         if not self._guid:
-            user_query = (
-                get_db()
-                .collection(_USERS_COLLECTION)
-                .where("provider", "==", self.provider)
-                .where("identifier", "==", self.identifier)
+            self._guid = _GUID_CACHE.get_or_load(
+                (self.provider, self.identifier), self._query_guid
             )
-            [user] = user_query.stream()
-
-            self._guid = user.id
 
         return self._guid
 
 
+def _intern(user_id: UserId) -> UserId:
+    """Record a UserId whose guid is already known, so later lookups skip the query."""
+    if user_id._guid:
+        _GUID_CACHE.put((user_id.provider, user_id.identifier), user_id._guid)
+    return user_id
+
+
 @transactional
 def _create_user(transaction, provider, identifier):
     matching_user_query = (
         get_db()
-        .collection(_USERS_COLLECTION)
+        .collection(USERS_COLLECTION)
         .where("provider", "==", provider)
         .where("identifier", "==", identifier)
     )
@@ -46,17 +69,17 @@ def _create_user(transaction, provider, identifier):
         raise Exception(
             f"User <'provider':'{provider}', 'identifier':'{identifier}'> already exists!"
         )
-    user_ref = get_db().collection(_USERS_COLLECTION).document()
+    user_ref = get_db().collection(USERS_COLLECTION).document()
     transaction.create(user_ref, {"provider": provider, "identifier": identifier})
 
-    return UserId(provider, identifier)
+    return UserId(provider, identifier, guid=user_ref.id)
 
 
 @transactional
 def _get_or_create_user(transaction, provider, identifier, email):
     matching_user_query = (
         get_db()
-        .collection(_USERS_COLLECTION)
+        .collection(USERS_COLLECTION)
         .where("provider", "==", provider)
         .where("identifier", "==", identifier)
     )
@@ -65,31 +88,37 @@ def _get_or_create_user(transaction, provider, identifier, email):
         [user] = matches
         # Update the user's email with the latest shared by the provider
         transaction.update(user.reference, {"email": email})
-        return UserId(user.get("provider"), user.get("identifier"))
+        return UserId(user.get("provider"), user.get("identifier"), guid=user.id)
     elif matches:
         raise Exception(
             f"Multiple users exist with <'provider':'{provider}', 'identifier':'{identifier}'>!"
         )
-    user_ref = get_db().collection(_USERS_COLLECTION).document()
+    user_ref = get_db().collection(USERS_COLLECTION).document()
     transaction.create(
         user_ref, {"provider": provider, "identifier": identifier, "email": email}
     )
 
-    return UserId(provider, identifier)
+    return UserId(provider, identifier, guid=user_ref.id)
 
 
 def create_user(provider: str, identifier: str) -> UserId:
     transaction = get_db().transaction()
-    return _create_user(transaction, provider, identifier)
+    return _intern(_create_user(transaction, provider, identifier))
 
 
+@span("user.get_or_create")
 def get_or_create_user(provider: str, identifier: str, email: str) -> UserId:
     transaction = get_db().transaction()
-    return _get_or_create_user(transaction, provider, identifier, email)
+    return _intern(_get_or_create_user(transaction, provider, identifier, email))
+
+
+def user_id_from_document(user) -> UserId:
+    return _intern(UserId(user.get("provider"), user.get("identifier"), guid=user.id))
 
 
+@span("user.get")
 def get_by_guid(user_guid: str) -> UserId:
-    user = get_db().collection(_USERS_COLLECTION).document(user_guid).get()
+    user = get_db().collection(USERS_COLLECTION).document(user_guid).get()
     if not user.exists:
         raise UserNotFoundError(f"Did not find UserId@{user_guid}")
-    return UserId(user.get("provider"), user.get("identifier"))
+    return user_id_from_document(user)
@@ -0,0 +1,108 @@
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Tuple
+
+from backend.core.firestore_helper import get_db, transactional
+from backend.core.orders import get_daily_total_ref
+
+_ORDER_RECORDS_COLLECTION = "order_records"
+
+
+def build_argparser():
+    parser = argparse.ArgumentParser(
+        description="Recompute the per-day order totals behind the daily order limit."
+        " Safe to run while trading, an order recorded meanwhile makes the rewrite of"
+        " its total retry rather than be lost from it"
+    )
+    parser.add_argument(
+        "--days",
+        default=1,
+        type=int,
+        help="Number of UTC days to backfill, counting back from (and including) today",
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    return parser
+
+
+def _aggregate(orders, key=lambda order: None) -> Dict[object, dict]:
+    totals = defaultdict(lambda: {"total": 0.0, "count": 0})
+    for order in orders:
+        aggregate = totals[key(order)]
+        aggregate["total"] += order.get("quote_currency_amount")
+        aggregate["count"] += 1
+    return totals
+
+
+def _order_day(order) -> date:
+    return order.get("timestamp").astimezone(timezone.utc).date()
+
+
+def aggregate_order_records(since: datetime) -> Dict[Tuple[str, str, date], dict]:
+    orders_query = (
+        get_db().collection(_ORDER_RECORDS_COLLECTION).where("timestamp", ">=", since)
+    )
+    return _aggregate(
+        orders_query.stream(),
+        lambda order: (order.get("profile"), order.get("product"), _order_day(order)),
+    )
+
+
+# Needs a composite index on order_records (profile, product, timestamp)
+@transactional
+def _write_daily_total(transaction, profile_guid: str, product: str, day: date) -> dict:
+    daily_total_ref = get_daily_total_ref(profile_guid, product, day)
+    # Orders bump the aggregate as they are recorded, reading it here makes this
+    # transaction conflict with any order recorded before it commits
+    daily_total_ref.get(transaction=transaction)
+
+    day_start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    orders_query = (
+        get_db()
+        .collection(_ORDER_RECORDS_COLLECTION)
+        .where("profile", "==", profile_guid)
+        .where("product", "==", product)
+        .where("timestamp", ">=", day_start)
+        .where("timestamp", "<", day_start + timedelta(days=1))
+    )
+    aggregate = _aggregate(orders_query.stream(transaction=transaction))[None]
+    transaction.set(
+        daily_total_ref,
+        {
+            "profile": profile_guid,
+            "product": product,
+            "day": day.isoformat(),
+            "total": aggregate["total"],
+            "count": aggregate["count"],
+        },
+    )
+    return aggregate
+
+
+def write_daily_totals(totals: Dict[Tuple[str, str, date], dict]) -> None:
+    """Rewrite the aggregate of every key in `totals`, recounting it transactionally."""
+    for profile_guid, product, day in totals:
+        transaction = get_db().transaction()
+        _write_daily_total(transaction, profile_guid, product, day)
+
+
+if __name__ == "__main__":
+    argument_parser = build_argparser()
+    args = argument_parser.parse_args()
+
+    today = datetime.now(timezone.utc).date()
+    since = datetime.combine(
+        today - timedelta(days=args.days - 1), time.min, tzinfo=timezone.utc
+    )
+
+    print(f"Aggregating order records since {since.isoformat()}...")
+    totals = aggregate_order_records(since)
+    print(f"Found {len(totals)} (profile, product, day) aggregates")
+
+    if args.dry_run:
+        for (profile_guid, product, day), aggregate in sorted(totals.items()):
+            print(f"{profile_guid} | {product} | {day}: {aggregate}")
+    else:
+        print("Writing daily totals...")
+        write_daily_totals(totals)
+    print("Done!")
@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import time
+from typing import List
+
+import httpx
+
+
+def build_argparser():
+    parser = argparse.ArgumentParser(
+        description="Replay the same GET load against the Flask and ASGI api services"
+    )
+    parser.add_argument("--flask-url", required=True, help="e.g. http://localhost:8080")
+    parser.add_argument("--asgi-url", required=True, help="e.g. http://localhost:8081")
+    parser.add_argument("--user", required=True, help="User guid to query")
+    parser.add_argument(
+        "--portfolio",
+        help="Portfolio guid to query; the portfolio list is queried when omitted",
+    )
+    parser.add_argument("--requests", default=500, type=int)
+    parser.add_argument("--concurrency", default=100, type=int)
+    parser.add_argument("--timeout", default=30.0, type=float)
+    return parser
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    index = min(
+        len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1)))
+    )
+    return sorted_values[index]
+
+
+async def run_load(
+    base_url: str, path: str, total_requests: int, concurrency: int, timeout: float
+) -> dict:
+    latencies = []
+    errors = 0
+    next_request = 0
+
+    async def worker(http: httpx.AsyncClient):
+        nonlocal errors, next_request
+        while next_request < total_requests:
+            next_request += 1
+            started = time.perf_counter()
+            try:
+                response = await http.get(path)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=timeout
+    ) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else float("nan"),
+        "p50_ms": 1000 * _percentile(latencies, 50),
+        "p95_ms": 1000 * _percentile(latencies, 95),
+        "p99_ms": 1000 * _percentile(latencies, 99),
+    }
+
+
+def _print_result(name: str, result: dict) -> None:
+    print(
+        f"{name:>6} | {result['requests']} requests, {result['errors']} errors in "
+        f"{result['seconds']:.2f}s | {result['rps']:.1f} req/s | "
+        f"p50 {result['p50_ms']:.0f}ms p95 {result['p95_ms']:.0f}ms "
+        f"p99 {result['p99_ms']:.0f}ms"
+    )
+
+
+if __name__ == "__main__":
+    argument_parser = build_argparser()
+    args = argument_parser.parse_args()
+
+    if args.portfolio:
+        path = f"/user/{args.user}/portfolio/{args.portfolio}/v1"
+    else:
+        path = f"/user/{args.user}/portfolios/v1"
+
+    print(
+        f"Sending {args.requests} requests to {path} with {args.concurrency} in flight..."
+    )
+    for name, base_url in (("flask", args.flask_url), ("asgi", args.asgi_url)):
+        result = asyncio.run(
+            run_load(base_url, path, args.requests, args.concurrency, args.timeout)
+        )
+        _print_result(name, result)
+    print("Done!")
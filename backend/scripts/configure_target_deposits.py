@@ -1,8 +1,9 @@
 import argparse
 from typing import List, Tuple, Dict
 
-from backend.core.firestore_helper import get_db
+from backend.core.firestore_helper import get_db, transactional
 from backend.core.profile import ProfileId, get_profile_subcollection
+from backend.core.schedule_membership import add_member, remove_member
 
 
 def build_argparser():
@@ -19,24 +20,44 @@ def build_argparser():
 
 
 def postprocess_deposits(
-    deposits: List[Tuple[str, str, str]]
+    deposits: List[Tuple[str, str, str]],
 ) -> Dict[str, Tuple[float, str]]:
     return {dep[0]: (float(dep[1]), dep[2]) for dep in deposits}
 
 
-def set_target_deposits(
-    profile_id: ProfileId, deposit_specs: Dict[str, Tuple[float, str]]
+@transactional
+def _set_target_deposits(
+    transaction, profile_id: ProfileId, deposit_specs: Dict[str, Tuple[float, str]]
 ):
     deposits_collection = get_profile_subcollection(profile_id, "target_deposits")
-    for configured_deposit in deposits_collection.stream():
+
+    # Deposits and their schedule memberships are written together
+    for configured_deposit in deposits_collection.stream(transaction=transaction):
+        configured_schedule = configured_deposit.get("schedule")
         if configured_deposit.id not in deposit_specs:
-            configured_deposit.reference.delete()
+            transaction.delete(configured_deposit.reference)
+            remove_member(
+                transaction, configured_schedule, profile_id, configured_deposit.id
+            )
+        elif deposit_specs[configured_deposit.id][1] != configured_schedule:
+            remove_member(
+                transaction, configured_schedule, profile_id, configured_deposit.id
+            )
 
-    for asset, (amount, schedule_id) in deposit_specs.items():
-        product_id = f"{asset}-USD"
-        deposits_collection.document(product_id).set(
-            {"deposit_amount": amount, "schedule": schedule_id}
+    for product_id, (amount, schedule_id) in deposit_specs.items():
+        transaction.set(
+            deposits_collection.document(product_id),
+            {"deposit_amount": amount, "schedule": schedule_id},
         )
+        add_member(transaction, schedule_id, profile_id, product_id, amount)
+
+
+def set_target_deposits(
+    profile_id: ProfileId, deposit_specs: Dict[str, Tuple[float, str]]
+):
+    deposit_specs = {f"{asset}-USD": spec for asset, spec in deposit_specs.items()}
+    transaction = get_db().transaction()
+    _set_target_deposits(transaction, profile_id, deposit_specs)
 
 
 if __name__ == "__main__":
@@ -49,7 +70,9 @@ if __name__ == "__main__":
         .where("nickname", "==", args.profile_nickname)
         .stream()
     )
-    profile_id = ProfileId(profile.get("namespace"), profile.get("identifier"))
+    profile_id = ProfileId(
+        profile.get("namespace"), profile.get("identifier"), guid=profile.id
+    )
     print(f"Found ProfileId@{profile_id.get_guid()}")
 
     deposit_specs = postprocess_deposits(args.deposit)
@@ -0,0 +1,269 @@
+import argparse
+import csv
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, NamedTuple, Optional, Set, Tuple
+
+from backend.core.cbpro_client_helper import (
+    PROFILE_NAMESPACE_TO_API_URL,
+    get_client_for_credentials,
+)
+from backend.core.profile import ProfileId, get_or_create_profile, set_profile_nickname
+from backend.core.schedule_catalog import get_daily_frequency
+from backend.core.secrets.profile_secrets import (
+    ProfileCredentials,
+    SecretsWritten,
+    ensure_api_credentials,
+)
+from backend.scripts.configure_target_deposits import (
+    postprocess_deposits,
+    set_target_deposits,
+)
+from backend.scripts.create_profile import get_profile_identifier
+
+_CSV_COLUMNS = (
+    "namespace",
+    "api_key",
+    "api_secret",
+    "api_passphrase",
+    "nickname",
+    "asset",
+    "amount",
+    "schedule",
+)
+
+
+class ManifestEntry(NamedTuple):
+    namespace: str
+    api_key: str
+    api_secret: str
+    api_passphrase: str
+    nickname: Optional[str]
+    # (asset, USD amount, schedule ID)
+    deposits: Tuple[Tuple[str, str, str], ...]
+
+    def digest(self) -> str:
+        """Identifies the entry in the state file, editing the entry re-runs it."""
+        return hashlib.sha256(
+            json.dumps(self._asdict(), sort_keys=True).encode()
+        ).hexdigest()
+
+
+class OnboardingResult(NamedTuple):
+    profile_id: ProfileId
+    secrets: SecretsWritten
+    deposits_written: int
+
+
+def build_argparser():
+    parser = argparse.ArgumentParser(
+        description="Create profiles, their secrets and target deposits from a manifest"
+    )
+    parser.add_argument(
+        "manifest",
+        type=str,
+        help="JSONL file with one profile per line, or CSV file with one deposit per row",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Number of profiles onboarded at the same time",
+    )
+    parser.add_argument(
+        "--state-file",
+        type=str,
+        help="Records the entries already onboarded. Defaults to '<manifest>.state.jsonl'",
+    )
+    return parser
+
+
+def _read_jsonl_manifest(path: str) -> List[ManifestEntry]:
+    entries = []
+    with open(path) as manifest:
+        for line in manifest:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            entries.append(
+                ManifestEntry(
+                    entry["namespace"],
+                    entry["api_key"],
+                    entry["api_secret"],
+                    entry["api_passphrase"],
+                    entry.get("nickname") or None,
+                    tuple(
+                        (dep["asset"], str(dep["amount"]), dep["schedule"])
+                        for dep in entry.get("deposits", [])
+                    ),
+                )
+            )
+    return entries
+
+
+def _read_csv_manifest(path: str) -> List[ManifestEntry]:
+    """Rows sharing a namespace and API key make up a single profile."""
+    rows_by_profile = OrderedDict()
+    with open(path, newline="") as manifest:
+        reader = csv.DictReader(manifest)
+        missing = set(_CSV_COLUMNS) - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Manifest is missing columns {sorted(missing)}")
+        for row in reader:
+            rows_by_profile.setdefault((row["namespace"], row["api_key"]), []).append(
+                row
+            )
+
+    entries = []
+    for rows in rows_by_profile.values():
+        first = rows[0]
+        entries.append(
+            ManifestEntry(
+                first["namespace"],
+                first["api_key"],
+                first["api_secret"],
+                first["api_passphrase"],
+                first["nickname"] or None,
+                # A row without an asset lists the profile alone
+                tuple(
+                    (row["asset"], row["amount"], row["schedule"])
+                    for row in rows
+                    if row["asset"]
+                ),
+            )
+        )
+    return entries
+
+
+def read_manifest(path: str) -> List[ManifestEntry]:
+    if path.endswith(".csv"):
+        entries = _read_csv_manifest(path)
+    else:
+        entries = _read_jsonl_manifest(path)
+
+    for entry in entries:
+        if entry.namespace not in PROFILE_NAMESPACE_TO_API_URL:
+            raise ValueError(f"Unsupported namespace '{entry.namespace}'")
+    # Fail before writing anything rather than part way through the run
+    for schedule_id in sorted({dep[2] for entry in entries for dep in entry.deposits}):
+        get_daily_frequency(schedule_id)
+    return entries
+
+
+class _StateFile:
+    """Append-only log of the entries already onboarded, one JSON object per line."""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def read_done(self) -> Set[str]:
+        try:
+            with open(self._path) as state:
+                return {json.loads(line)["entry"] for line in state if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def record(self, entry: ManifestEntry, profile_id: ProfileId) -> None:
+        line = json.dumps({"entry": entry.digest(), "profile": profile_id.get_guid()})
+        with self._lock:
+            with open(self._path, "a") as state:
+                state.write(line + "\n")
+
+
+def onboard_profile(entry: ManifestEntry) -> OnboardingResult:
+    """Every step is idempotent, so an entry interrupted part way can simply run again."""
+    client = get_client_for_credentials(
+        entry.api_key,
+        entry.api_secret,
+        entry.api_passphrase,
+        PROFILE_NAMESPACE_TO_API_URL[entry.namespace],
+    )
+    identifier = get_profile_identifier(client)
+    profile_id = get_or_create_profile(entry.namespace, identifier)
+
+    if entry.nickname:
+        set_profile_nickname(profile_id, entry.nickname)
+
+    secrets = ensure_api_credentials(
+        profile_id,
+        ProfileCredentials(entry.api_key, entry.api_secret, entry.api_passphrase),
+    )
+
+    deposit_specs = postprocess_deposits(list(entry.deposits))
+    # Replaces the configured deposits in one transaction, along with their memberships.
+    # An entry without deposits keeps whatever the profile already has configured.
+    if deposit_specs:
+        set_target_deposits(profile_id, deposit_specs)
+
+    return OnboardingResult(profile_id, secrets, len(deposit_specs))
+
+
+def onboard_profiles(
+    entries: List[ManifestEntry], state_file: _StateFile, concurrency: int
+) -> None:
+    done = state_file.read_done()
+    pending = [
+        (index, entry)
+        for index, entry in enumerate(entries)
+        if entry.digest() not in done
+    ]
+    skipped = len(entries) - len(pending)
+    print(
+        f"Onboarding {len(pending)} profiles, skipping {skipped} already onboarded..."
+    )
+
+    onboarded = failed = secrets_written = secrets_unchanged = deposits_written = 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        index_by_future = {
+            executor.submit(onboard_profile, entry): (index, entry)
+            for index, entry in pending
+        }
+        for future in as_completed(index_by_future):
+            index, entry = index_by_future[future]
+            err = future.exception()
+            if err:
+                failed += 1
+                print(f"Failed to onboard entry #{index}: {err}")
+                continue
+            result = future.result()
+            state_file.record(entry, result.profile_id)
+            onboarded += 1
+            secrets_written += result.secrets.written
+            secrets_unchanged += result.secrets.unchanged
+            deposits_written += result.deposits_written
+            print(
+                f"Onboarded entry #{index} as ProfileId@{result.profile_id.get_guid()}"
+            )
+    elapsed = time.monotonic() - start
+
+    print(
+        f"{onboarded} onboarded, {skipped} skipped, {failed} failed"
+        f" in {elapsed:.1f}s ({onboarded / elapsed if elapsed else 0:.1f} profiles/s)"
+    )
+    print(
+        f"{secrets_written} secrets written, {secrets_unchanged} unchanged"
+        f" | {deposits_written} deposits written"
+    )
+    if failed:
+        print("Run the same command again to retry the failed entries")
+
+
+if __name__ == "__main__":
+    argument_parser = build_argparser()
+    args = argument_parser.parse_args()
+
+    manifest_entries = read_manifest(args.manifest)
+    print(f"Read {len(manifest_entries)} profiles from '{args.manifest}'")
+
+    onboard_profiles(
+        manifest_entries,
+        _StateFile(args.state_file or f"{args.manifest}.state.jsonl"),
+        args.concurrency,
+    )
+    print("Done!")
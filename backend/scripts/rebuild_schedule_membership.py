@@ -0,0 +1,189 @@
+import argparse
+from collections import defaultdict
+from typing import Dict, List, Set
+
+from backend.core.firestore_helper import get_db
+from backend.core.profile import ProfileId
+from backend.core.schedule_membership import (
+    get_membership_chunk_ref,
+    get_membership_collection,
+    membership_chunk_id,
+    membership_entry,
+    membership_key,
+)
+
+# Firestore caps a single batched write at 500 operations
+_MAX_BATCH_SIZE = 500
+# Number of deposits whose parent profiles are fetched together in one batched read
+_DEPOSITS_PAGE_SIZE = 500
+
+# schedule ID -> chunk ID -> membership key -> entry
+Membership = Dict[str, Dict[str, Dict[str, dict]]]
+
+
+def build_argparser():
+    parser = argparse.ArgumentParser(
+        description="Verify the schedule membership index against the target deposits"
+    )
+    parser.add_argument(
+        "--schedule",
+        action="append",
+        help="Schedule ID to check, may be repeated. Defaults to every schedule.",
+    )
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="Rewrite the chunks that drifted instead of only reporting them",
+    )
+    return parser
+
+
+def _add_deposits_page(membership: Membership, deposits: list, orphaned: list) -> None:
+    parent_refs = {
+        deposit.reference.parent.parent.path: deposit.reference.parent.parent
+        for deposit in deposits
+    }
+    profiles_by_path = {
+        profile.reference.path: profile
+        for profile in get_db().get_all(list(parent_refs.values()))
+    }
+    for deposit in deposits:
+        profile = profiles_by_path[deposit.reference.parent.parent.path]
+        if not profile.exists:
+            # Left behind by a deleted profile, its subcollections outlive it
+            orphaned.append(deposit.reference)
+            continue
+        profile_id = ProfileId(
+            profile.get("namespace"), profile.get("identifier"), guid=profile.id
+        )
+        membership[deposit.get("schedule")][membership_chunk_id(profile.id)][
+            membership_key(profile.id, deposit.id)
+        ] = membership_entry(profile_id, deposit.id, deposit.get("deposit_amount"))
+
+
+def expected_membership(schedule_ids: List[str], orphaned: list) -> Membership:
+    """Membership implied by the target deposits, collecting orphaned ones in `orphaned`."""
+    membership = defaultdict(lambda: defaultdict(dict))
+    deposits_query = get_db().collection_group("target_deposits")
+    if len(schedule_ids) == 1:
+        deposits_query = deposits_query.where("schedule", "==", schedule_ids[0])
+
+    page = []
+    for deposit in deposits_query.stream():
+        if deposit.get("schedule") not in schedule_ids:
+            continue
+        page.append(deposit)
+        if len(page) >= _DEPOSITS_PAGE_SIZE:
+            _add_deposits_page(membership, page, orphaned)
+            page = []
+    if page:
+        _add_deposits_page(membership, page, orphaned)
+    return membership
+
+
+def indexed_membership(schedule_id: str) -> Dict[str, Dict[str, dict]]:
+    return {
+        chunk.id: (chunk.to_dict() or {}).get("entries", {})
+        for chunk in get_membership_collection(schedule_id).stream()
+    }
+
+
+def _deleted_profiles(profile_guids: Set[str]) -> Set[str]:
+    profile_refs = [
+        get_db().collection("profiles").document(guid) for guid in profile_guids
+    ]
+    deleted = set()
+    for start in range(0, len(profile_refs), _DEPOSITS_PAGE_SIZE):
+        for profile in get_db().get_all(
+            profile_refs[start : start + _DEPOSITS_PAGE_SIZE]
+        ):
+            if not profile.exists:
+                deleted.add(profile.id)
+    return deleted
+
+
+def verify_schedule(schedule_id: str, expected: Dict[str, Dict[str, dict]]) -> dict:
+    """Chunk ID -> expected entries, for every chunk of the schedule that drifted."""
+    indexed = indexed_membership(schedule_id)
+    drifted = {}
+    missing = stale = extra = 0
+    extra_profiles = set()
+    for chunk_id in sorted(set(expected) | set(indexed)):
+        expected_entries = expected.get(chunk_id, {})
+        indexed_entries = indexed.get(chunk_id, {})
+        if expected_entries == indexed_entries:
+            continue
+        drifted[chunk_id] = expected_entries
+        missing += len(expected_entries.keys() - indexed_entries.keys())
+        extra_keys = indexed_entries.keys() - expected_entries.keys()
+        extra += len(extra_keys)
+        extra_profiles.update(indexed_entries[key]["profile"] for key in extra_keys)
+        stale += sum(
+            1
+            for key in expected_entries.keys() & indexed_entries.keys()
+            if expected_entries[key] != indexed_entries[key]
+        )
+
+    members = sum(len(entries) for entries in expected.values())
+    deleted_profiles = _deleted_profiles(extra_profiles) if extra_profiles else set()
+    print(
+        f"[{schedule_id}] {members} members | {len(drifted)} drifted chunks:"
+        f" {missing} missing, {stale} stale, {extra} extra entries"
+        f" ({len(deleted_profiles)} deleted profiles)"
+    )
+    for profile_guid in sorted(deleted_profiles):
+        print(f"[{schedule_id}] Indexed ProfileId@{profile_guid} no longer exists")
+    return drifted
+
+
+def delete_orphaned_deposits(deposit_refs: list) -> None:
+    for start in range(0, len(deposit_refs), _MAX_BATCH_SIZE):
+        batch = get_db().batch()
+        for deposit_ref in deposit_refs[start : start + _MAX_BATCH_SIZE]:
+            batch.delete(deposit_ref)
+        batch.commit()
+
+
+def repair_schedule(schedule_id: str, drifted: Dict[str, Dict[str, dict]]) -> None:
+    batch = get_db().batch()
+    pending = 0
+    for chunk_id, entries in drifted.items():
+        chunk_ref = get_membership_chunk_ref(schedule_id, chunk_id)
+        if entries:
+            batch.set(chunk_ref, {"entries": entries})
+        else:
+            batch.delete(chunk_ref)
+        pending += 1
+        if pending == _MAX_BATCH_SIZE:
+            batch.commit()
+            batch = get_db().batch()
+            pending = 0
+    if pending:
+        batch.commit()
+
+
+if __name__ == "__main__":
+    argument_parser = build_argparser()
+    args = argument_parser.parse_args()
+
+    schedule_ids = args.schedule or [
+        schedule.id for schedule in get_db().collection("schedules").stream()
+    ]
+    print(f"Collecting target deposits for {len(schedule_ids)} schedules...")
+    orphaned_deposits = []
+    membership = expected_membership(schedule_ids, orphaned_deposits)
+    for deposit_ref in orphaned_deposits:
+        print(f"Orphaned target deposit '{deposit_ref.path}'")
+
+    for schedule_id in schedule_ids:
+        drifted = verify_schedule(schedule_id, membership.get(schedule_id, {}))
+        if drifted and args.repair:
+            # Writes landing between the read above and this one are overwritten, run
+            # the check again to confirm
+            print(f"[{schedule_id}] Rewriting {len(drifted)} chunks...")
+            repair_schedule(schedule_id, drifted)
+    if orphaned_deposits and args.repair:
+        # The index entries were dropped above, the query source trips over these
+        print(f"Deleting {len(orphaned_deposits)} orphaned target deposits...")
+        delete_orphaned_deposits(orphaned_deposits)
+    print("Done!")
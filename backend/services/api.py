@@ -1,12 +1,20 @@
+import os
 import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from flask import Flask, Response, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 
 from backend.core.cbpro_client_helper import (
     PROFILE_NAMESPACE_TO_API_URL,
     CbProAuthenticatedClient,
     get_client as get_cbpro_client,
+    get_client_for_credentials,
+    get_accounts_snapshot,
     InvalidCoinbaseProAPIKey,
 )
 from backend.core.profile import (
@@ -15,7 +23,9 @@ from backend.core.profile import (
     get_or_create_profile,
     get_by_guid as get_profile_by_guid,
     delete_profile,
-    list_user_profiles,
+    list_user_profile_summaries,
+    set_profile_display_name,
+    ProfileSummary,
     ProfileNotFoundError,
     ProfileUserMismatchError,
 )
@@ -26,9 +36,21 @@ from backend.core.secrets.profile_secrets import (
     delete_api_key,
     delete_api_b64_secret,
     delete_api_passphrase,
+    invalidate_api_credentials,
+)
+from backend.core.tracing import (
+    finish_trace,
+    set_attribute,
+    span,
+    start_trace,
+    wrap,
 )
 from backend.core.trade_spec import (
+    InvalidAllocationError,
+    apply_allocation_changes,
     get_all_trade_specs,
+    parse_allocation_changes,
+    remove_all_allocations,
     remove_allocation,
     set_allocation,
 )
@@ -44,6 +66,47 @@ from backend.core.user import (
 
 app = Flask(__name__)
 
+# Independent Firestore and exchange calls made while assembling a response run here
+_BACKEND_CALLS_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("API_BACKEND_CALL_WORKERS", 32)),
+    thread_name_prefix="api-backend",
+)
+_BACKEND_CALL_TIMEOUT_SECONDS = float(
+    os.environ.get("API_BACKEND_CALL_TIMEOUT_SECONDS", 10)
+)
+
+
+def _await_backend_call(future: Future, deadline: float):
+    return future.result(timeout=max(0.0, deadline - time.monotonic()))
+
+
+# Stored display names older than this are refreshed from the exchange in the background
+_DISPLAY_NAME_MAX_AGE = timedelta(
+    seconds=float(os.environ.get("DISPLAY_NAME_MAX_AGE_SECONDS", 24 * 60 * 60))
+)
+_DISPLAY_NAME_REFRESHES_LOCK = threading.Lock()
+_DISPLAY_NAME_REFRESHES_IN_FLIGHT = set()
+
+
+@app.before_request
+def _start_request_trace():
+    g.trace = start_trace(
+        "api",
+        method=request.method,
+        route=request.url_rule.rule if request.url_rule else request.path,
+    )
+
+
+@app.after_request
+def _record_response_status(response: Response) -> Response:
+    set_attribute("status", response.status_code)
+    return response
+
+
+@app.teardown_request
+def _finish_request_trace(exc):
+    finish_trace(g.pop("trace", None))
+
 
 @app.route("/user/get-or-create/v1", methods=["POST"])
 def handle_get_or_create_user():
@@ -84,8 +147,8 @@ def handle_set_basic_oauth_creds():
     return ("", 200)
 
 
-def _get_profile_identifier(client: CbProAuthenticatedClient) -> str:
-    profile_ids = {acc["profile_id"] for acc in client.get_accounts()}
+def _get_profile_identifier(accounts: list) -> str:
+    profile_ids = {acc["profile_id"] for acc in accounts}
     assert len(profile_ids) == 1
     [identifier] = [p_id for p_id in profile_ids]
     return identifier
@@ -106,14 +169,20 @@ def _delete_profile_secrets(profile_id: ProfileId) -> None:
 
 
 def _get_portfolio_name(client: CbProAuthenticatedClient, profile_id: ProfileId) -> str:
-    profile_data = client.get_profile(profile_id.identifier)
+    with span("exchange.get_profile"):
+        profile_data = client.get_profile(profile_id.identifier)
     return profile_data["name"]
 
 
 def _get_portfolio_usd_balance(
-    client: CbProAuthenticatedClient, profile_id: ProfileId
+    client: CbProAuthenticatedClient,
+    profile_id: ProfileId,
+    accounts: Optional[list] = None,
 ) -> float:
-    currency_accounts = client.get_accounts()
+    # Accounts the caller already fetched, else a recent process-wide snapshot
+    currency_accounts = (
+        accounts if accounts is not None else get_accounts_snapshot(client)
+    )
     usd_accounts = [
         acc
         for acc in currency_accounts
@@ -132,22 +201,52 @@ def _portfolio_to_response(
     profile_id: ProfileId,
     client: Optional[CbProAuthenticatedClient] = None,
     include_trade_specs: bool = True,
+    store_display_name: bool = False,
+    accounts: Optional[list] = None,
 ) -> Response:
+    # Every call below is started right away and shares one deadline
+    deadline = time.monotonic() + _BACKEND_CALL_TIMEOUT_SECONDS
+    profile_guid = profile_id.get_guid()
     try:
+        trade_specs_future = (
+            _BACKEND_CALLS_EXECUTOR.submit(wrap(get_all_trade_specs), profile_id)
+            if include_trade_specs
+            else None
+        )
         client = client or get_cbpro_client(profile_id)
-        trade_specs = get_all_trade_specs(profile_id) if include_trade_specs else []
+        name_future = _BACKEND_CALLS_EXECUTOR.submit(
+            wrap(_get_portfolio_name), client, profile_id
+        )
+        usd_balance_future = _BACKEND_CALLS_EXECUTOR.submit(
+            wrap(_get_portfolio_usd_balance), client, profile_id, accounts
+        )
+
+        trade_specs = (
+            _await_backend_call(trade_specs_future, deadline)
+            if trade_specs_future
+            else []
+        )
+        display_name = _await_backend_call(name_future, deadline)
+        if store_display_name:
+            set_profile_display_name(profile_id, display_name)
         return jsonify(
-            id=profile_id.get_guid(),
-            displayName=_get_portfolio_name(client, profile_id),
+            id=profile_guid,
+            displayName=display_name,
             tradeSpecs=[
                 spec.to_dict() for spec in sorted(trade_specs, key=lambda s: s.product)
             ],
-            usdBalance=_get_portfolio_usd_balance(client, profile_id),
+            usdBalance=_await_backend_call(usd_balance_future, deadline),
         )
+    except FutureTimeoutError:
+        print(f"Timed out assembling portfolio for ProfileId@{profile_guid}")
+        return ("Timed out fetching portfolio", 504)
     except InvalidCoinbaseProAPIKey:
         print(
             f"Invalid Coinbase Pro API key for ProfileId@{profile_id.get_guid()} -- deleting portfolio ..."
         )
+        # Stop the fanout from trading on the profile before its secrets are gone
+        remove_all_allocations(profile_id)
+        invalidate_api_credentials(profile_id)
         _delete_profile_secrets(profile_id)
         print(f"Deleted secrets for ProfileId@{profile_id.get_guid()}")
         delete_profile(profile_id)
@@ -156,11 +255,44 @@ def _portfolio_to_response(
         return ("", 404)
 
 
-def _profile_id_to_light_dict(profile_id: ProfileId) -> dict:
-    return {
-        "id": profile_id.get_guid(),
-        "displayName": _get_portfolio_name(get_cbpro_client(profile_id), profile_id),
-    }
+def _refresh_display_name(profile_id: ProfileId) -> str:
+    display_name = _get_portfolio_name(get_cbpro_client(profile_id), profile_id)
+    set_profile_display_name(profile_id, display_name)
+    return display_name
+
+
+def _refresh_display_name_in_background(profile_id: ProfileId) -> None:
+    profile_guid = profile_id.get_guid()
+    with _DISPLAY_NAME_REFRESHES_LOCK:
+        if profile_guid in _DISPLAY_NAME_REFRESHES_IN_FLIGHT:
+            return
+        _DISPLAY_NAME_REFRESHES_IN_FLIGHT.add(profile_guid)
+
+    def refresh():
+        try:
+            _refresh_display_name(profile_id)
+        except Exception as err:
+            print(f"Failed to refresh display name for ProfileId@{profile_guid}: {err}")
+        finally:
+            with _DISPLAY_NAME_REFRESHES_LOCK:
+                _DISPLAY_NAME_REFRESHES_IN_FLIGHT.discard(profile_guid)
+
+    _BACKEND_CALLS_EXECUTOR.submit(refresh)
+
+
+def _profile_summary_to_light_dict(summary: ProfileSummary) -> dict:
+    display_name = summary.display_name
+    if display_name is None:
+        # Profiles created before names were stored get theirs filled in once
+        display_name = _refresh_display_name(summary.profile_id)
+    elif (
+        summary.display_name_updated_at is None
+        or datetime.now(timezone.utc) - summary.display_name_updated_at
+        > _DISPLAY_NAME_MAX_AGE
+    ):
+        _refresh_display_name_in_background(summary.profile_id)
+
+    return {"id": summary.profile_id.get_guid(), "displayName": display_name}
 
 
 @app.route("/user/portfolio-profile/create/v1", methods=["POST"])
@@ -183,10 +315,9 @@ def handle_create_cbpro_profile():
 
     # fetch CBPro profile id
     api_url = PROFILE_NAMESPACE_TO_API_URL[namespace]
-    client = CbProAuthenticatedClient(
-        api_key, api_secret, api_passphrase, api_url=api_url
-    )
-    identifier = _get_profile_identifier(client)
+    client = get_client_for_credentials(api_key, api_secret, api_passphrase, api_url)
+    accounts = get_accounts_snapshot(client)
+    identifier = _get_profile_identifier(accounts)
 
     # create profile
     profile_id = get_or_create_profile(namespace, identifier, user_id)
@@ -195,7 +326,13 @@ def handle_create_cbpro_profile():
     # Flush the stdout to avoid log buffering.
     sys.stdout.flush()
 
-    return _portfolio_to_response(profile_id, client, include_trade_specs=False)
+    return _portfolio_to_response(
+        profile_id,
+        client,
+        include_trade_specs=False,
+        store_display_name=True,
+        accounts=accounts,
+    )
 
 
 @app.route("/user/<user_guid>/portfolios/v1", methods=["GET"])
@@ -206,8 +343,8 @@ def handle_list_cbpro_portfolios(user_guid: str):
         return (str(err), 404)
     return jsonify(
         portfolios=[
-            _profile_id_to_light_dict(profile_id)
-            for profile_id in list_user_profiles(user)
+            _profile_summary_to_light_dict(summary)
+            for summary in list_user_profile_summaries(user)
         ]
     )
 
@@ -246,7 +383,10 @@ def handle_set_allocation(profile_guid: str, product_id: str):
     except (ProfileNotFoundError, ProfileUserMismatchError) as err:
         print(err)
         return ("Portfolio not found", 404)
-    set_allocation(profile_id, product_id, target_amount)
+    try:
+        set_allocation(profile_id, product_id, target_amount)
+    except InvalidAllocationError as err:
+        return (str(err), 400)
 
     return _portfolio_to_response(profile_id)
 
@@ -273,3 +413,37 @@ def handle_remove_allocation(profile_guid: str, product_id: str):
     remove_allocation(profile_id, product_id)
 
     return _portfolio_to_response(profile_id)
+
+
+@app.route(
+    "/user/portfolio-profile/<profile_guid>/allocations/v1",
+    methods=["POST"],
+)
+def handle_change_allocations(profile_guid: str):
+    """Apply several allocation changes at once, e.g.
+
+    {"userId": ..., "set": [{"productId": "BTC-USD", "dailyTargetAmount": 50}],
+     "remove": ["ETH-USD"]}
+    """
+    envelope = request.get_json()
+
+    try:
+        user_id = get_user_by_guid(envelope["userId"])
+        changes = parse_allocation_changes(envelope)
+    except (KeyError, TypeError, InvalidAllocationError) as err:
+        return (str(err), 400)
+    except UserNotFoundError as err:
+        return (str(err), 404)
+
+    try:
+        profile_id = get_profile_by_guid(profile_guid, user=user_id)
+    except (ProfileNotFoundError, ProfileUserMismatchError) as err:
+        print(err)
+        return ("Portfolio not found", 404)
+
+    try:
+        apply_allocation_changes(profile_id, changes)
+    except InvalidAllocationError as err:
+        return (str(err), 400)
+
+    return _portfolio_to_response(profile_id)
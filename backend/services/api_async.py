@@ -0,0 +1,434 @@
+"""ASGI variant of `api.py`.
+
+Serves the same routes and JSON shapes, but reads go through the async Firestore, Secret
+Manager and exchange clients so one process can keep hundreds of requests in flight.
+Writes reuse the sync core in a thread pool.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from quart import Quart, Response, g, jsonify, request
+from quart.utils import run_sync
+
+from backend.core.aio.cbpro_client import (
+    AsyncCbProClient,
+    get_client as get_cbpro_client,
+    get_client_for_credentials,
+)
+from backend.core.aio.profile import (
+    get_by_guid as get_profile_by_guid,
+    delete_profile,
+    list_user_profile_summaries,
+    set_profile_display_name,
+)
+from backend.core.aio.profile_secrets import delete_api_credentials
+from backend.core.aio.trade_spec import get_all_trade_specs
+from backend.core.aio.user import get_by_guid as get_user_by_guid
+from backend.core.cbpro_client_helper import (
+    PROFILE_NAMESPACE_TO_API_URL,
+    InvalidCoinbaseProAPIKey,
+)
+from backend.core.profile import (
+    DEFAULT_NS,
+    ProfileId,
+    get_or_create_profile,
+    ProfileSummary,
+    ProfileNotFoundError,
+    ProfileUserMismatchError,
+)
+from backend.core.schedule_catalog import refresh_schedule_catalog
+from backend.core.secrets.profile_secrets import (
+    set_api_b64_secret,
+    set_api_key,
+    set_api_passphrase,
+)
+from backend.core.tracing import finish_trace, set_attribute, start_trace
+from backend.core.trade_spec import (
+    InvalidAllocationError,
+    apply_allocation_changes,
+    parse_allocation_changes,
+    remove_all_allocations,
+    remove_allocation,
+    set_allocation,
+)
+from backend.core.secrets.user_secrets import (
+    set_basic_access_token,
+    set_basic_refresh_token,
+)
+from backend.core.user import get_or_create_user, UserNotFoundError
+
+app = Quart(__name__)
+
+_BACKEND_CALL_TIMEOUT_SECONDS = float(
+    os.environ.get("API_BACKEND_CALL_TIMEOUT_SECONDS", 10)
+)
+
+# Stored display names older than this are refreshed from the exchange in the background
+_DISPLAY_NAME_MAX_AGE = timedelta(
+    seconds=float(os.environ.get("DISPLAY_NAME_MAX_AGE_SECONDS", 24 * 60 * 60))
+)
+_DISPLAY_NAME_REFRESHES_IN_FLIGHT = set()
+
+
+@app.before_serving
+async def _warm_schedule_catalog():
+    # Trade specs resolve their frequency from the catalog, keep its first load off the loop
+    await run_sync(refresh_schedule_catalog)()
+
+
+@app.before_request
+async def _start_request_trace():
+    g.trace = start_trace(
+        "api_async",
+        method=request.method,
+        route=request.url_rule.rule if request.url_rule else request.path,
+    )
+
+
+@app.after_request
+async def _record_response_status(response: Response) -> Response:
+    set_attribute("status", response.status_code)
+    return response
+
+
+@app.teardown_request
+async def _finish_request_trace(exc):
+    finish_trace(g.pop("trace", None))
+
+
+@app.route("/user/get-or-create/v1", methods=["POST"])
+async def handle_get_or_create_user():
+    envelope = await request.get_json()
+
+    try:
+        user_params = envelope["user"]
+        user_id = await run_sync(get_or_create_user)(
+            user_params["provider"], user_params["id"], user_params["email"]
+        )
+    except KeyError as e:
+        return (str(e), 400)
+
+    # Flush the stdout to avoid log buffering.
+    sys.stdout.flush()
+
+    return jsonify(id=user_id.get_guid())
+
+
+@app.route("/user/oauth/basic/set/v1", methods=["POST"])
+async def handle_set_basic_oauth_creds():
+    envelope = await request.get_json()
+
+    try:
+        user_id = await get_user_by_guid(envelope["userId"])
+
+        creds_params = envelope["oauthCredentials"]
+        await asyncio.gather(
+            run_sync(set_basic_access_token)(user_id, creds_params["accessToken"]),
+            run_sync(set_basic_refresh_token)(user_id, creds_params["refreshToken"]),
+        )
+    except KeyError as err:
+        return (str(err), 400)
+    except UserNotFoundError as err:
+        return (str(err), 404)
+
+    # Flush the stdout to avoid log buffering.
+    sys.stdout.flush()
+
+    return ("", 200)
+
+
+async def _get_accounts(client: AsyncCbProClient) -> list:
+    # Concurrent callers within a request share a single exchange call
+    accounts_by_client = g.setdefault("accounts_by_client", {})
+    if id(client) not in accounts_by_client:
+        accounts_by_client[id(client)] = asyncio.ensure_future(client.get_accounts())
+    return await asyncio.shield(accounts_by_client[id(client)])
+
+
+async def _get_profile_identifier(client: AsyncCbProClient) -> str:
+    profile_ids = {acc["profile_id"] for acc in await _get_accounts(client)}
+    assert len(profile_ids) == 1
+    [identifier] = [p_id for p_id in profile_ids]
+    return identifier
+
+
+def _set_profile_secrets(
+    profile_id: ProfileId, api_key: str, api_secret: str, api_passphrase: str
+) -> None:
+    set_api_key(profile_id, api_key)
+    set_api_b64_secret(profile_id, api_secret)
+    set_api_passphrase(profile_id, api_passphrase)
+
+
+async def _get_portfolio_name(client: AsyncCbProClient, profile_id: ProfileId) -> str:
+    profile_data = await client.get_profile(profile_id.identifier)
+    return profile_data["name"]
+
+
+async def _get_portfolio_usd_balance(
+    client: AsyncCbProClient, profile_id: ProfileId
+) -> float:
+    currency_accounts = await _get_accounts(client)
+    usd_accounts = [
+        acc
+        for acc in currency_accounts
+        if acc["currency"] == "USD" and acc["trading_enabled"]
+    ]
+    assert (
+        len(usd_accounts) == 1
+    ), f"Found more than one USD account for profile {profile_id.get_guid()}"
+
+    [usd_account] = usd_accounts
+    assert usd_account["profile_id"] == profile_id.identifier
+    return round(float(usd_account["available"]), ndigits=2)
+
+
+async def _no_trade_specs() -> list:
+    return []
+
+
+async def _fetch_portfolio(
+    profile_id: ProfileId,
+    client: Optional[AsyncCbProClient],
+    include_trade_specs: bool,
+):
+    trade_specs_call = (
+        get_all_trade_specs(profile_id) if include_trade_specs else _no_trade_specs()
+    )
+    client = client or await get_cbpro_client(profile_id)
+    return await asyncio.gather(
+        trade_specs_call,
+        _get_portfolio_name(client, profile_id),
+        _get_portfolio_usd_balance(client, profile_id),
+    )
+
+
+async def _portfolio_to_response(
+    profile_id: ProfileId,
+    client: Optional[AsyncCbProClient] = None,
+    include_trade_specs: bool = True,
+    store_display_name: bool = False,
+) -> Response:
+    profile_guid = profile_id.get_guid()
+    try:
+        trade_specs, display_name, usd_balance = await asyncio.wait_for(
+            _fetch_portfolio(profile_id, client, include_trade_specs),
+            timeout=_BACKEND_CALL_TIMEOUT_SECONDS,
+        )
+        if store_display_name:
+            await set_profile_display_name(profile_id, display_name)
+        return jsonify(
+            id=profile_guid,
+            displayName=display_name,
+            tradeSpecs=[
+                spec.to_dict() for spec in sorted(trade_specs, key=lambda s: s.product)
+            ],
+            usdBalance=usd_balance,
+        )
+    except asyncio.TimeoutError:
+        print(f"Timed out assembling portfolio for ProfileId@{profile_guid}")
+        return ("Timed out fetching portfolio", 504)
+    except InvalidCoinbaseProAPIKey:
+        print(
+            f"Invalid Coinbase Pro API key for ProfileId@{profile_guid} -- deleting portfolio ..."
+        )
+        # Stop the fanout from trading on the profile before its secrets are gone
+        await run_sync(remove_all_allocations)(profile_id)
+        await delete_api_credentials(profile_id)
+        print(f"Deleted secrets for ProfileId@{profile_guid}")
+        await delete_profile(profile_id)
+        print(f"Deleted ProfileId@{profile_guid}")
+
+        return ("", 404)
+
+
+async def _refresh_display_name(profile_id: ProfileId) -> str:
+    client = await get_cbpro_client(profile_id)
+    display_name = await _get_portfolio_name(client, profile_id)
+    await set_profile_display_name(profile_id, display_name)
+    return display_name
+
+
+async def _refresh_display_name_in_background(profile_id: ProfileId) -> None:
+    profile_guid = profile_id.get_guid()
+    try:
+        await _refresh_display_name(profile_id)
+    except Exception as err:
+        print(f"Failed to refresh display name for ProfileId@{profile_guid}: {err}")
+    finally:
+        _DISPLAY_NAME_REFRESHES_IN_FLIGHT.discard(profile_guid)
+
+
+async def _profile_summary_to_light_dict(summary: ProfileSummary) -> dict:
+    display_name = summary.display_name
+    if display_name is None:
+        # Profiles created before names were stored get theirs filled in once
+        display_name = await _refresh_display_name(summary.profile_id)
+    elif (
+        summary.display_name_updated_at is None
+        or datetime.now(timezone.utc) - summary.display_name_updated_at
+        > _DISPLAY_NAME_MAX_AGE
+    ):
+        profile_guid = summary.profile_id.get_guid()
+        if profile_guid not in _DISPLAY_NAME_REFRESHES_IN_FLIGHT:
+            _DISPLAY_NAME_REFRESHES_IN_FLIGHT.add(profile_guid)
+            app.add_background_task(
+                _refresh_display_name_in_background, summary.profile_id
+            )
+
+    return {"id": summary.profile_id.get_guid(), "displayName": display_name}
+
+
+@app.route("/user/portfolio-profile/create/v1", methods=["POST"])
+async def handle_create_cbpro_profile():
+    envelope = await request.get_json()
+
+    try:
+        user_id = await get_user_by_guid(envelope["userId"])
+
+        namespace = envelope.get("profileNamespace", DEFAULT_NS)
+
+        creds = envelope["profileCredentials"]
+        api_key = creds["apiKey"]
+        api_secret = creds["b64Secret"]
+        api_passphrase = creds["passphrase"]
+    except KeyError as err:
+        return (str(err), 400)
+    except UserNotFoundError as err:
+        return (str(err), 404)
+
+    # fetch CBPro profile id
+    api_url = PROFILE_NAMESPACE_TO_API_URL[namespace]
+    client = get_client_for_credentials(api_key, api_secret, api_passphrase, api_url)
+    identifier = await _get_profile_identifier(client)
+
+    # create profile
+    profile_id = await run_sync(get_or_create_profile)(namespace, identifier, user_id)
+    await run_sync(_set_profile_secrets)(
+        profile_id, api_key, api_secret, api_passphrase
+    )
+
+    # Flush the stdout to avoid log buffering.
+    sys.stdout.flush()
+
+    return await _portfolio_to_response(
+        profile_id, client, include_trade_specs=False, store_display_name=True
+    )
+
+
+@app.route("/user/<user_guid>/portfolios/v1", methods=["GET"])
+async def handle_list_cbpro_portfolios(user_guid: str):
+    try:
+        user = await get_user_by_guid(user_guid)
+    except UserNotFoundError as err:
+        return (str(err), 404)
+    summaries = await list_user_profile_summaries(user)
+    return jsonify(
+        portfolios=await asyncio.gather(
+            *(_profile_summary_to_light_dict(summary) for summary in summaries)
+        )
+    )
+
+
+@app.route("/user/<user_guid>/portfolio/<portfolio_guid>/v1", methods=["GET"])
+async def handle_get_cbpro_portfolio(user_guid: str, portfolio_guid: str):
+    try:
+        user = await get_user_by_guid(user_guid)
+        profile_id = await get_profile_by_guid(portfolio_guid, user)
+    except UserNotFoundError as err:
+        return (str(err), 404)
+    except (ProfileNotFoundError, ProfileUserMismatchError) as err:
+        print(err)
+        return ("Portfolio not found", 404)
+    else:
+        return await _portfolio_to_response(profile_id)
+
+
+@app.route(
+    "/user/portfolio-profile/<profile_guid>/allocation/<product_id>/set/v1",
+    methods=["POST"],
+)
+async def handle_set_allocation(profile_guid: str, product_id: str):
+    envelope = await request.get_json()
+
+    try:
+        user_id = await get_user_by_guid(envelope["userId"])
+        target_amount = envelope["dailyTargetAmount"]
+    except KeyError as err:
+        return (str(err), 400)
+    except UserNotFoundError as err:
+        return (str(err), 404)
+
+    try:
+        profile_id = await get_profile_by_guid(profile_guid, user=user_id)
+    except (ProfileNotFoundError, ProfileUserMismatchError) as err:
+        print(err)
+        return ("Portfolio not found", 404)
+    try:
+        await run_sync(set_allocation)(profile_id, product_id, target_amount)
+    except InvalidAllocationError as err:
+        return (str(err), 400)
+
+    return await _portfolio_to_response(profile_id)
+
+
+@app.route(
+    "/user/portfolio-profile/<profile_guid>/allocation/<product_id>/remove/v1",
+    methods=["POST"],
+)
+async def handle_remove_allocation(profile_guid: str, product_id: str):
+    envelope = await request.get_json()
+
+    try:
+        user_id = await get_user_by_guid(envelope["userId"])
+    except KeyError as err:
+        return (str(err), 400)
+    except UserNotFoundError as err:
+        return (str(err), 404)
+
+    try:
+        profile_id = await get_profile_by_guid(profile_guid, user=user_id)
+    except (ProfileNotFoundError, ProfileUserMismatchError) as err:
+        print(err)
+        return ("Portfolio not found", 404)
+    await run_sync(remove_allocation)(profile_id, product_id)
+
+    return await _portfolio_to_response(profile_id)
+
+
+@app.route(
+    "/user/portfolio-profile/<profile_guid>/allocations/v1",
+    methods=["POST"],
+)
+async def handle_change_allocations(profile_guid: str):
+    """Apply several allocation changes at once, e.g.
+
+    {"userId": ..., "set": [{"productId": "BTC-USD", "dailyTargetAmount": 50}],
+     "remove": ["ETH-USD"]}
+    """
+    envelope = await request.get_json()
+
+    try:
+        user_id = await get_user_by_guid(envelope["userId"])
+        changes = parse_allocation_changes(envelope)
+    except (KeyError, TypeError, InvalidAllocationError) as err:
+        return (str(err), 400)
+    except UserNotFoundError as err:
+        return (str(err), 404)
+
+    try:
+        profile_id = await get_profile_by_guid(profile_guid, user=user_id)
+    except (ProfileNotFoundError, ProfileUserMismatchError) as err:
+        print(err)
+        return ("Portfolio not found", 404)
+
+    try:
+        await run_sync(apply_allocation_changes)(profile_id, changes)
+    except InvalidAllocationError as err:
+        return (str(err), 400)
+
+    return await _portfolio_to_response(profile_id)
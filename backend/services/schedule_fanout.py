@@ -1,58 +1,332 @@
+import functools
 import os
 import sys
-from typing import Generator, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait as futures_wait
+from datetime import datetime, timezone
+from typing import Generator, List, Optional, Tuple
 
 from flask import Flask, request
 
-from backend.core.firestore_helper import get_db
-from backend.core.pubsub_helper import get_event_field, publisher
+from backend.core.fanout_run import (
+    FanoutRun,
+    FanoutRunInProgress,
+    FanoutRunLeaseLost,
+    PartitionBounds,
+    PartitionCheckpoint,
+    start_fanout_run,
+)
+from backend.core.firestore_helper import DocumentSnapshot, get_db
+from backend.core.profile import ProfileId
+from backend.core.pubsub_helper import (
+    get_event_field,
+    get_event_publish_time,
+    PublishStats,
+    publisher,
+)
+from backend.core.schedule_membership import (
+    get_membership_chunk_ref,
+    get_membership_collection,
+    members_from_chunk,
+    membership_chunk_ids,
+)
+from backend.core.tracing import request_trace, set_attribute, span, wrap
+from backend.core.trade_spec import (
+    TRADE_EVENT_VERSION,
+    ScheduleId,
+    TradeSpec,
+    get_schedule_daily_frequency,
+)
 
 app = Flask(__name__)
 
+# Number of deposits whose parent profiles are fetched together in one batched read
+_DEPOSITS_PAGE_SIZE = int(os.environ.get("FANOUT_PAGE_SIZE", 500))
+# Maximum number of cursor ranges the deposits are split into and streamed in parallel,
+# Firestore may return fewer for small collections. 1 streams them in a single query.
+_PARTITIONS = int(os.environ.get("FANOUT_PARTITIONS", 8))
+# How often a partition waits for its events to be acknowledged and records its cursor.
+# A redelivered tick re-publishes at most this much work per partition.
+_CHECKPOINT_INTERVAL_SECONDS = float(
+    os.environ.get("FANOUT_CHECKPOINT_INTERVAL_SECONDS", 5)
+)
+_QUERY_SOURCE = "query"
+_INDEX_SOURCE = "index"
+# "query" streams target deposits with a collection group query and looks up their
+# parent profiles, "index" reads the schedule's membership index chunks instead
+_SOURCE = os.environ.get("FANOUT_SOURCE", _QUERY_SOURCE)
+assert _SOURCE in (_QUERY_SOURCE, _INDEX_SOURCE)
+_PARTITIONS_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("FANOUT_PARTITION_WORKERS", _PARTITIONS)),
+    thread_name_prefix="fanout-partition",
+)
 
-def _get_target_deposits_on_schedule(
-    schedule_id: str,
-) -> Generator[None, Tuple[str, str, str], None]:
-    target_deposits_query = (
-        get_db()
-        .collection_group("target_deposits")
-        .where("schedule", "==", schedule_id)
-    )
 
-    for deposit in target_deposits_query.stream():
-        product_id = deposit.id
+def _resolve_deposits_page(
+    deposits: List[DocumentSnapshot], schedule_id: ScheduleId, daily_frequency: int
+) -> Generator[Tuple[ProfileId, TradeSpec], None, None]:
+    parent_refs_by_path = {}
+    for deposit in deposits:
         parent_profile_ref = deposit.reference.parent.parent
         assert parent_profile_ref and parent_profile_ref.parent.id == "profiles"
-        parent_profile = parent_profile_ref.get()
+        parent_refs_by_path[parent_profile_ref.path] = parent_profile_ref
+
+    with span("fanout.get_parent_profiles"):
+        profiles_by_path = {
+            profile.reference.path: profile
+            for profile in get_db().get_all(list(parent_refs_by_path.values()))
+        }
+
+    for deposit in deposits:
+        parent_profile = profiles_by_path[deposit.reference.parent.parent.path]
         assert parent_profile.exists
 
-        yield (
+        profile_id = ProfileId(
             parent_profile.get("namespace"),
             parent_profile.get("identifier"),
-            product_id,
+            guid=parent_profile.id,
+        )
+        spec = TradeSpec(
+            deposit.id,
+            daily_frequency,
+            float(deposit.get("deposit_amount")),
+            schedule_id,
         )
+        yield profile_id, spec
+
+
+def _compute_deposit_partitions() -> List[PartitionBounds]:
+    """Split target deposits into name ranges that can be streamed in parallel."""
+    if _PARTITIONS <= 1:
+        return [PartitionBounds(None, None)]
+
+    # Partition queries can't have filters, so the split points are computed over every
+    # target deposit and each partition is narrowed down to the schedule when streamed
+    with span("fanout.get_partitions"):
+        return [
+            PartitionBounds(
+                partition.start_at.path if partition.start_at else None,
+                partition.end_at.path if partition.end_at else None,
+            )
+            for partition in get_db()
+            .collection_group("target_deposits")
+            .get_partitions(_PARTITIONS)
+        ]
+
+
+def _compute_index_partitions(schedule_id: ScheduleId) -> List[PartitionBounds]:
+    """Split the schedule's membership chunks into contiguous ranges."""
+    chunk_paths = [
+        get_membership_chunk_ref(schedule_id, chunk_id).path
+        for chunk_id in membership_chunk_ids()
+    ]
+    partitions = max(1, min(_PARTITIONS, len(chunk_paths)))
+    starts = [len(chunk_paths) * i // partitions for i in range(partitions)]
+    return [
+        PartitionBounds(
+            chunk_paths[start] if i > 0 else None,
+            chunk_paths[starts[i + 1]] if i + 1 < partitions else None,
+        )
+        for i, start in enumerate(starts)
+    ]
+
+
+def _bounded_by_name(query, bounds: PartitionBounds, after: Optional[str]):
+    query = query.order_by("__name__")
+    if after:
+        query = query.start_after({"__name__": get_db().document(after)})
+    elif bounds.start:
+        query = query.start_at({"__name__": get_db().document(bounds.start)})
+    if bounds.end:
+        query = query.end_before({"__name__": get_db().document(bounds.end)})
+    return query
+
+
+def _get_deposit_pages(deposits_query) -> Generator[List[DocumentSnapshot], None, None]:
+    page = []
+    for deposit in deposits_query.stream():
+        page.append(deposit)
+        if len(page) >= _DEPOSITS_PAGE_SIZE:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+# A page of trade events to publish, and the path of the last document it was read from
+_EventsPage = Tuple[str, List[Tuple[ProfileId, TradeSpec]]]
+
+
+def _get_deposit_event_pages(
+    schedule_id: ScheduleId,
+    daily_frequency: int,
+    bounds: PartitionBounds,
+    after: Optional[str],
+) -> Generator[_EventsPage, None, None]:
+    deposits_query = _bounded_by_name(
+        get_db()
+        .collection_group("target_deposits")
+        .where("schedule", "==", schedule_id),
+        bounds,
+        after,
+    )
+    for page in _get_deposit_pages(deposits_query):
+        yield page[-1].reference.path, list(
+            _resolve_deposits_page(page, schedule_id, daily_frequency)
+        )
+
+
+def _get_index_event_pages(
+    schedule_id: ScheduleId,
+    daily_frequency: int,
+    bounds: PartitionBounds,
+    after: Optional[str],
+) -> Generator[_EventsPage, None, None]:
+    chunks_query = _bounded_by_name(
+        get_membership_collection(schedule_id), bounds, after
+    )
+    for chunk in chunks_query.stream():
+        yield chunk.reference.path, [
+            (
+                member.profile_id,
+                TradeSpec(
+                    member.product_id, daily_frequency, member.amount, schedule_id
+                ),
+            )
+            for member in members_from_chunk(chunk)
+        ]
+
+
+def _trade_event(
+    profile_id: ProfileId, spec: TradeSpec, scheduled_time: datetime
+) -> dict:
+    return {
+        "version": TRADE_EVENT_VERSION,
+        "profile": {
+            "namespace": profile_id.namespace,
+            "identifier": profile_id.identifier,
+            "guid": profile_id.get_guid(),
+        },
+        "product": spec.get_product_id(),
+        "deposit": spec.to_event_dict(),
+        "scheduled_time": scheduled_time.timestamp(),
+    }
+
+
+def _fanout_partition(
+    run: FanoutRun,
+    partition: int,
+    schedule_id: ScheduleId,
+    daily_frequency: int,
+    scheduled_time: datetime,
+    stats: PublishStats,
+) -> int:
+    checkpoint = run.get_checkpoint(partition)
+    if checkpoint.done:
+        return checkpoint.events
+
+    get_event_pages = (
+        _get_index_event_pages
+        if run.source == _INDEX_SOURCE
+        else _get_deposit_event_pages
+    )
+    events_count = checkpoint.events
+    last_path = checkpoint.after
+    last_checkpoint_at = time.monotonic()
+    with publisher(os.environ["TARGET_TOPIC"], stats=stats) as pub:
+        for last_path, events in get_event_pages(
+            schedule_id, daily_frequency, run.partitions[partition], checkpoint.after
+        ):
+            if run.lease_lost:
+                # Another delivery owns the run now and publishes the rest itself
+                raise FanoutRunLeaseLost(run.run_id)
+            for profile_id, spec in events:
+                pub.publish_event(_trade_event(profile_id, spec, scheduled_time))
+                events_count += 1
+
+            if time.monotonic() - last_checkpoint_at >= _CHECKPOINT_INTERVAL_SECONDS:
+                # Only move the checkpoint past events that are acknowledged
+                pub.wait()
+                with span("fanout.checkpoint"):
+                    run.checkpoint(
+                        partition, PartitionCheckpoint(last_path, events_count)
+                    )
+                last_checkpoint_at = time.monotonic()
+
+    run.checkpoint(partition, PartitionCheckpoint(last_path, events_count, True))
+    return events_count
+
+
+def _run_held_elsewhere(err: FanoutRunInProgress) -> Tuple[str, int]:
+    print(err)
+    sys.stdout.flush()
+    # Not acknowledged, Pub/Sub retries once the other delivery is done or gone
+    return str(err), 409
 
 
 @app.route("/", methods=["POST"])
 def handle_event():
     envelope = request.get_json()
     schedule_id = get_event_field(envelope)
+    # Trade events carry the tick time so tradebot can key orders by schedule slot
+    scheduled_time = get_event_publish_time(envelope) or datetime.now(timezone.utc)
     print(f"Starting fanout for schedule '{schedule_id}'...")
 
-    events_count = 0
-    with publisher(os.environ["TARGET_TOPIC"]) as pub:
-        for namespace, identifier, product_id in _get_target_deposits_on_schedule(
-            schedule_id
-        ):
-            pub.publish_event(
-                {
-                    "profile": {"namespace": namespace, "identifier": identifier},
-                    "product": product_id,
-                }
+    with request_trace("schedule_fanout", schedule=schedule_id):
+        try:
+            run = start_fanout_run(
+                schedule_id,
+                scheduled_time,
+                _SOURCE,
+                (
+                    functools.partial(_compute_index_partitions, schedule_id)
+                    if _SOURCE == _INDEX_SOURCE
+                    else _compute_deposit_partitions
+                ),
             )
-            events_count += 1
+        except FanoutRunInProgress as err:
+            return _run_held_elsewhere(err)
+        set_attribute("run", run.run_id)
+        if run.done:
+            print(f"Fanout run '{run.run_id}' already finished, nothing to do")
+            sys.stdout.flush()
+            return "", 204
 
-    print(f"Published {events_count} fanout events")
+        daily_frequency = get_schedule_daily_frequency(schedule_id)
+        # Throughput of this delivery alone, not of everything the process published
+        stats = PublishStats()
+        partition_futures = [
+            _PARTITIONS_EXECUTOR.submit(
+                wrap(_fanout_partition),
+                run,
+                partition,
+                schedule_id,
+                daily_frequency,
+                scheduled_time,
+                stats,
+            )
+            for partition in range(len(run.partitions))
+        ]
+        # No partition may still be checkpointing (and renewing the lease) once released
+        futures_wait(partition_futures)
+        try:
+            events_by_partition = [future.result() for future in partition_futures]
+            run.mark_done(events_by_partition)
+        except FanoutRunLeaseLost as err:
+            return _run_held_elsewhere(err)
+        except Exception:
+            run.release()
+            raise
+        events_count = sum(events_by_partition)
+        set_attribute("events", events_count)
+        set_attribute("events_by_partition", events_by_partition)
+
+    print(
+        f"Published {events_count} fanout events for run '{run.run_id}' from"
+        f" {len(events_by_partition)} partitions {events_by_partition}"
+        f" | {stats.to_dict()}"
+    )
 
     # Flush the stdout to avoid log buffering.
     sys.stdout.flush()
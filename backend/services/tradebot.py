@@ -1,7 +1,9 @@
 import json
 import os
 import sys
-from typing import AnyStr, Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import AnyStr, Dict, List, Optional, Tuple
 
 from flask import Flask, request
 
@@ -9,28 +11,74 @@ from backend.core.cbpro_client_helper import (
     get_client as get_cbpro_client,
     CbProAuthenticatedClient,
 )
-from backend.core.orders import DailyTargetDepositReached, place_market_buy
+from backend.core.orders import (
+    DailyTargetDepositReached,
+    DuplicateOrderSlot,
+    place_market_buy,
+)
 from backend.core.profile import ProfileId
 from backend.core.pubsub_helper import get_event_data_dict
 from backend.core.rest_helper import format_error
+from backend.core.tracing import request_trace, set_attribute, wrap
 from backend.core.trade_spec import (
+    TRADE_EVENT_VERSION,
     ProductId,
     TradeSpec,
     get_trade_spec,
     legacy_get_trade_specs,
+    trade_spec_from_event_dict,
 )
 
 app = Flask(__name__)
 
+_MAX_CONCURRENT_TRADES = int(os.environ.get("TRADEBOT_MAX_CONCURRENT_TRADES", 8))
+
+
+class TradeExecutionErrors(Exception):
+    def __init__(self, profile: ProfileId, errors: List[Tuple[ProductId, Exception]]):
+        summary = "; ".join(f"{product_id}: {err}" for product_id, err in errors)
+        super(TradeExecutionErrors, self).__init__(
+            f"{len(errors)} trade(s) failed for ProfileId@{profile.get_guid()} | {summary}"
+        )
+        self.errors = errors
+
+
+def _execute_trade(
+    client: CbProAuthenticatedClient, profile: ProfileId, spec: TradeSpec
+) -> None:
+    try:
+        place_market_buy(client, profile, spec)
+    except DailyTargetDepositReached as e:
+        print(f"Already hit daily limit for '{e.product_id}'")
+
 
 def execute_trades(
     client: CbProAuthenticatedClient, profile: ProfileId, specs: List[TradeSpec]
 ):
-    for spec in specs:
-        try:
-            place_market_buy(client, profile, spec)
-        except DailyTargetDepositReached as e:
-            print(f"Already hit daily limit for '{e.product_id}'")
+    if not specs:
+        return
+
+    # Resolve the guid once up front rather than racing to do it on every worker
+    profile.get_guid()
+
+    errors = []
+    with ThreadPoolExecutor(
+        max_workers=min(_MAX_CONCURRENT_TRADES, len(specs))
+    ) as executor:
+        product_by_future = {}
+        for spec in specs:
+            future = executor.submit(wrap(_execute_trade), client, profile, spec)
+            product_by_future[future] = spec.get_product_id()
+
+        for future in as_completed(product_by_future):
+            err = future.exception()
+            if err:
+                product_id = product_by_future[future]
+                print(f"Failed to place order for '{product_id}': {err}")
+                errors.append((product_id, err))
+
+    if errors:
+        raise TradeExecutionErrors(profile, errors)
 
 
 def process_profile_request(profile: ProfileId) -> Tuple[str, int]:
@@ -44,15 +92,20 @@ def process_profile_request(profile: ProfileId) -> Tuple[str, int]:
         )
     )
 
-    client = get_cbpro_client(profile)
+    set_attribute("profile", profile.identifier)
+    # Loads the profile once, which also resolves its guid for the client lookup
     specs = legacy_get_trade_specs(profile)
+    client = get_cbpro_client(profile)
     execute_trades(client, profile, specs)
 
     return ("", 204)
 
 
 def process_product_request(
-    profile: ProfileId, product_id: ProductId
+    profile: ProfileId,
+    product_id: ProductId,
+    spec: Optional[TradeSpec] = None,
+    slot_time: Optional[datetime] = None,
 ) -> Tuple[str, int]:
     print("Running tradebot ...")
     print(
@@ -64,22 +117,24 @@ def process_product_request(
             }
         )
     )
+    set_attribute("profile", profile.identifier)
+    set_attribute("product", product_id)
     client = get_cbpro_client(profile)
-    spec = get_trade_spec(profile, product_id)
+    # Self-contained events already carry the spec, older ones need it looked up
+    spec = spec or get_trade_spec(profile, product_id)
 
     try:
-        place_market_buy(client, profile, spec)
+        place_market_buy(client, profile, spec, slot_time)
     except DailyTargetDepositReached as e:
         print(f"Already hit daily limit for '{e.product_id}'")
+    except DuplicateOrderSlot as e:
+        print(f"Already placed order for '{e.product_id}' in slot '{e.slot}'")
 
     return ("", 204)
 
 
-@app.route("/", methods=["POST"])
-def handle_event():
-    envelope = request.get_json()
-    data = get_event_data_dict(envelope)
-
+def process_event_data(data: dict) -> Tuple[str, int]:
+    """Validate a decoded trade event and run the request it describes."""
     if not isinstance(data, dict) or "profile" not in data:
         return format_error("no 'profile' in message data")
     profile_params = data["profile"]
@@ -90,12 +145,47 @@ def handle_event():
     if "identifier" not in profile_params:
         return format_error("no 'identifier'")
 
-    profile = ProfileId(profile_params["namespace"], profile_params["identifier"])
+    version = data.get("version", 1)
+    if not isinstance(version, int) or isinstance(version, bool):
+        return format_error("expected 'version' to be an int")
+    is_self_contained = version >= TRADE_EVENT_VERSION
+    if is_self_contained and ("product" not in data or "deposit" not in data):
+        return format_error("expected 'product' and 'deposit' in versioned event")
+    scheduled_time = data.get("scheduled_time")
+    if scheduled_time is not None and (
+        not isinstance(scheduled_time, (int, float)) or isinstance(scheduled_time, bool)
+    ):
+        return format_error("expected 'scheduled_time' to be a timestamp")
+
+    # Versioned events carry the profile guid and trade spec, saving their reads
+    profile = ProfileId(
+        profile_params["namespace"],
+        profile_params["identifier"],
+        guid=profile_params.get("guid"),
+    )
 
-    if "product" in data:
-        response = process_product_request(profile, data["product"])
+    if is_self_contained:
+        spec = trade_spec_from_event_dict(data["product"], data["deposit"])
+        slot_time = (
+            datetime.fromtimestamp(scheduled_time, tz=timezone.utc)
+            if scheduled_time is not None
+            else None
+        )
+        return process_product_request(profile, data["product"], spec, slot_time)
+    elif "product" in data:
+        return process_product_request(profile, data["product"])
     else:
-        response = process_profile_request(profile)
+        return process_profile_request(profile)
+
+
+@app.route("/", methods=["POST"])
+def handle_event():
+    envelope = request.get_json()
+    data = get_event_data_dict(envelope)
+
+    with request_trace("tradebot"):
+        response = process_event_data(data)
+        set_attribute("status", response[1])
 
     # Flush the stdout to avoid log buffering.
     sys.stdout.flush()
@@ -111,7 +201,9 @@ def handle_direct_invocation():
     profile = ProfileId(profile_params["namespace"], profile_params["identifier"])
     product = envelope["product"]
 
-    response = process_product_request(profile, product)
+    with request_trace("tradebot.direct"):
+        response = process_product_request(profile, product)
+        set_attribute("status", response[1])
 
     # Flush the stdout to avoid log buffering.
     sys.stdout.flush()
@@ -0,0 +1,90 @@
+"""Tradebot as a streaming-pull subscriber.
+
+Alternative to the push endpoint in `tradebot.py`: one process holds a streaming pull on
+the trade subscription and runs many trade events concurrently, bounded by flow control.
+"""
+
+import os
+import signal
+import sys
+from concurrent import futures
+
+from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.subscriber.message import Message
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+
+from backend.core.pubsub_helper import decode_message_data
+from backend.core.tracing import request_trace, set_attribute
+from backend.services.tradebot import process_event_data
+
+_MAX_WORKERS = int(os.environ.get("SUBSCRIBER_MAX_WORKERS", 32))
+_MAX_OUTSTANDING_MESSAGES = int(
+    os.environ.get("SUBSCRIBER_MAX_OUTSTANDING_MESSAGES", 2 * _MAX_WORKERS)
+)
+_MAX_OUTSTANDING_BYTES = int(
+    os.environ.get("SUBSCRIBER_MAX_OUTSTANDING_BYTES", 10 * 1024 * 1024)
+)
+
+
+def _handle_message(message: Message) -> None:
+    try:
+        with request_trace("tradebot_subscriber", message_id=message.message_id):
+            data = decode_message_data(message.data)
+            body, status = process_event_data(data)
+            set_attribute("status", status)
+    except Exception as err:
+        print(f"Failed to process message {message.message_id}: {err}")
+        message.nack()
+    else:
+        if status >= 500:
+            print(f"Failed to process message {message.message_id}: {body}")
+            message.nack()
+        else:
+            # Malformed events (4xx) are acked as well, redelivering them cannot help
+            if status >= 400:
+                print(f"Dropping message {message.message_id}: {body}")
+            message.ack()
+    finally:
+        # Flush the stdout to avoid log buffering.
+        sys.stdout.flush()
+
+
+def main():
+    subscriber = pubsub_v1.SubscriberClient()
+    subscription_path = subscriber.subscription_path(
+        os.environ["GCLOUD_PROJECT"], os.environ["TRADEBOT_SUBSCRIPTION"]
+    )
+    flow_control = pubsub_v1.types.FlowControl(
+        max_messages=_MAX_OUTSTANDING_MESSAGES, max_bytes=_MAX_OUTSTANDING_BYTES
+    )
+    scheduler = ThreadScheduler(
+        executor=futures.ThreadPoolExecutor(
+            max_workers=_MAX_WORKERS, thread_name_prefix="tradebot"
+        )
+    )
+
+    streaming_pull = subscriber.subscribe(
+        subscription_path,
+        callback=_handle_message,
+        flow_control=flow_control,
+        scheduler=scheduler,
+    )
+    print(
+        f"Listening on '{subscription_path}' with {_MAX_WORKERS} workers, "
+        f"{_MAX_OUTSTANDING_MESSAGES} outstanding messages max"
+    )
+    sys.stdout.flush()
+
+    # Stop pulling on SIGTERM, letting in-flight messages finish before exiting
+    signal.signal(signal.SIGTERM, lambda signum, frame: streaming_pull.cancel())
+
+    with subscriber:
+        try:
+            streaming_pull.result()
+        except KeyboardInterrupt:
+            streaming_pull.cancel()
+            streaming_pull.result()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import os
+
+# Read at import time, the fakes stand in for the services themselves
+os.environ.setdefault("GCLOUD_PROJECT", "test-project")
+os.environ.setdefault("INSUFFICIENT_FUNDS_TOPIC", "insufficient-funds")
+os.environ.setdefault("TARGET_TOPIC", "target")
+
+import pytest
+
+from backend.benchmarks.harness import FakeBackend
+from backend.benchmarks.seed import seed_profiles, seed_schedules
+
+
+@pytest.fixture
+def backend():
+    with FakeBackend() as fake_backend:
+        yield fake_backend
+
+
+@pytest.fixture
+def seeded(backend):
+    """One profile with a single hourly target deposit."""
+    with backend.seeding():
+        seed_schedules(backend)
+        profiles = seed_profiles(backend, deposits=1, schedule_id="every-hour")
+    return profiles[0]
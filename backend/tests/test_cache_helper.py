@@ -0,0 +1,111 @@
+import threading
+
+from backend.core import cache_helper
+from backend.core.cache_helper import TTLCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _cache(monkeypatch, **kwargs):
+    clock = _Clock()
+    monkeypatch.setattr(cache_helper.time, "monotonic", clock)
+    return TTLCache(**kwargs), clock
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    cache, clock = _cache(monkeypatch, maxsize=4, ttl=10)
+    cache.put("key", "value")
+
+    clock.now = 9.9
+    assert cache.get("key") == "value"
+    clock.now = 10
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_sliding_hits_push_the_expiry_out(monkeypatch):
+    cache, clock = _cache(monkeypatch, maxsize=4, ttl=10, sliding=True)
+    cache.put("key", "value")
+
+    for clock.now in (8, 16, 24):
+        assert cache.get("key") == "value"
+    clock.now = 34
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    cache, _ = _cache(monkeypatch, maxsize=2, ttl=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_get_or_load_only_loads_on_a_miss(monkeypatch):
+    cache, _ = _cache(monkeypatch, maxsize=4, ttl=10)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return "value"
+
+    assert cache.get_or_load("key", loader) == "value"
+    assert cache.get_or_load("key", loader) == "value"
+    assert len(loads) == 1
+
+
+def test_invalidate_returns_and_drops_the_entry(monkeypatch):
+    cache, _ = _cache(monkeypatch, maxsize=4, ttl=10)
+    cache.put("key", "value")
+
+    assert cache.invalidate("key") == "value"
+    assert cache.invalidate("key") is None
+    assert cache.get("key") is None
+
+
+def _load_racing(cache, invalidate):
+    """Invalidate while a load is in flight, returning what the load produced."""
+    started, resume = threading.Event(), threading.Event()
+
+    def slow_loader():
+        started.set()
+        resume.wait()
+        return "stale"
+
+    result = []
+    loading = threading.Thread(
+        target=lambda: result.append(cache.get_or_load("key", slow_loader))
+    )
+    loading.start()
+    started.wait()
+    invalidate()
+    resume.set()
+    loading.join()
+    return result[0]
+
+
+def test_invalidation_during_a_load_is_not_undone(monkeypatch):
+    cache, _ = _cache(monkeypatch, maxsize=4, ttl=10)
+
+    # The caller still gets its value, it just is not cached past the invalidation
+    assert _load_racing(cache, lambda: cache.invalidate("key")) == "stale"
+    assert cache.get("key") is None
+
+
+def test_clear_during_a_load_is_not_undone(monkeypatch):
+    cache, _ = _cache(monkeypatch, maxsize=4, ttl=10)
+    cache.put("other", "value")
+
+    _load_racing(cache, cache.clear)
+
+    assert cache.get("key") is None
+    assert len(cache) == 0
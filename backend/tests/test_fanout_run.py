@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from backend.core.fanout_run import (
+    FanoutRunInProgress,
+    FanoutRunLeaseLost,
+    PartitionBounds,
+    PartitionCheckpoint,
+    get_fanout_run_ref,
+    start_fanout_run,
+)
+
+_TICK = datetime(2021, 6, 1, 7, 0, tzinfo=timezone.utc)
+_PARTITIONS = [PartitionBounds(None, "m"), PartitionBounds("m", None)]
+
+
+def _start():
+    return start_fanout_run("every-hour", _TICK, "index", lambda: list(_PARTITIONS))
+
+
+def _run_ref(run):
+    return get_fanout_run_ref(run.run_id)
+
+
+def _expire_lease(run):
+    _run_ref(run).update({"lease_until": datetime.now(timezone.utc)})
+
+
+def test_new_run_holds_the_lease(backend):
+    run = _start()
+    run.checkpoint(0, PartitionCheckpoint("a", 3))
+
+    assert run.partitions == _PARTITIONS
+    with pytest.raises(FanoutRunInProgress):
+        _start()
+
+
+def test_takeover_after_expiry_resumes_from_checkpoints(backend):
+    first = _start()
+    first.checkpoint(0, PartitionCheckpoint("a", 3, done=True))
+    _expire_lease(first)
+
+    second = _start()
+
+    assert second.get_checkpoint(0) == PartitionCheckpoint("a", 3, done=True)
+    assert second.get_checkpoint(1) == PartitionCheckpoint()
+
+
+def test_only_the_lease_owner_writes(backend):
+    first = _start()
+    _expire_lease(first)
+    second = _start()
+    lease_until = _run_ref(second).get().get("lease_until")
+
+    with pytest.raises(FanoutRunLeaseLost):
+        first.checkpoint(1, PartitionCheckpoint("z", 5))
+    first.release()
+    with pytest.raises(FanoutRunLeaseLost):
+        first.mark_done([0, 5])
+
+    assert first.lease_lost
+    snapshot = _run_ref(second).get()
+    assert snapshot.get("checkpoints") == {}
+    assert snapshot.get("lease_until") == lease_until
+    assert snapshot.get("status") == "RUNNING"
+
+    second.checkpoint(1, PartitionCheckpoint("z", 5, done=True))
+    second.mark_done([0, 5])
+    assert _run_ref(second).get().get("status") == "DONE"
+
+
+def test_released_run_is_picked_up_right_away(backend):
+    _start().release()
+
+    assert not _start().done
+
+
+def test_finished_run_is_a_no_op(backend):
+    run = _start()
+    run.mark_done([1, 2])
+    backend.round_trips.reset()
+
+    redelivered = _start()
+
+    assert redelivered.done
+    assert backend.round_trips.to_dict() == {"firestore": {"get": 1}}
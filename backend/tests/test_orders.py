@@ -0,0 +1,175 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from backend.core import orders
+from backend.core.cbpro_client_helper import get_client
+from backend.core.orders import DuplicateOrderSlot, place_market_buy
+from backend.core.profile import SANDBOX_NS, ProfileId
+from backend.core.trade_spec import TradeSpec
+
+_TICK = datetime(2021, 6, 1, 7, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def slot_mode(monkeypatch):
+    monkeypatch.setattr(orders, "_ORDER_RECORD_MODE", orders._SLOT_MODE)
+
+
+@pytest.fixture
+def profile(seeded):
+    return ProfileId(SANDBOX_NS, seeded.identifier, guid=seeded.guid)
+
+
+@pytest.fixture
+def spec(seeded):
+    return TradeSpec(seeded.products[0], 24, 240.0)
+
+
+def _order_records(backend):
+    return [
+        doc.to_dict() for doc in backend.firestore.collection("order_records").stream()
+    ]
+
+
+def _daily_count(backend, profile, spec):
+    ref = orders.get_daily_total_ref(
+        profile.get_guid(), spec.get_product_id(), _TICK.date()
+    )
+    return ref.get().get("count")
+
+
+def test_every_tick_gets_its_own_slot(backend, profile, spec):
+    client = get_client(profile)
+    place_market_buy(client, profile, spec, _TICK)
+    place_market_buy(client, profile, spec, _TICK + timedelta(hours=7))
+
+    assert len(backend.exchange.orders) == 2
+    assert {record["status"] for record in _order_records(backend)} == {"ACCEPTED"}
+
+
+def test_redelivered_slot_is_a_no_op(backend, profile, spec):
+    client = get_client(profile)
+    place_market_buy(client, profile, spec, _TICK)
+    with pytest.raises(DuplicateOrderSlot):
+        place_market_buy(client, profile, spec, _TICK)
+
+    assert len(backend.exchange.orders) == 1
+    assert _daily_count(backend, profile, spec) == 1
+
+
+def test_concurrent_deliveries_place_one_order(backend, profile, spec):
+    client = get_client(profile)
+    barrier = threading.Barrier(8)
+    duplicates = []
+
+    def deliver():
+        barrier.wait()
+        try:
+            place_market_buy(client, profile, spec, _TICK)
+        except DuplicateOrderSlot:
+            duplicates.append(1)
+
+    threads = [threading.Thread(target=deliver) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(backend.exchange.orders) == 1
+    assert len(duplicates) == 7
+    assert _daily_count(backend, profile, spec) == 1
+
+
+def test_failed_order_is_retried_with_its_client_oid(
+    backend, profile, spec, monkeypatch
+):
+    client = get_client(profile)
+    with monkeypatch.context() as patch:
+        patch.setattr(client, "place_market_order", lambda *args, **kwargs: 1 / 0)
+        with pytest.raises(orders.UnhandledMarketOrderException):
+            place_market_buy(client, profile, spec, _TICK)
+    (record,) = _order_records(backend)
+    assert record["status"] == "STAGED"
+
+    place_market_buy(client, profile, spec, _TICK)
+
+    (order,) = backend.exchange.orders
+    assert order["client_oid"] == record["client_oid"]
+    assert _order_records(backend)[0]["status"] == "ACCEPTED"
+    assert _daily_count(backend, profile, spec) == 1
+
+
+def _abandon_claim(backend, monkeypatch):
+    """Leave the slot claimed as if its delivery died, then let the claim expire."""
+    (ref,) = backend.firestore.collection("order_records").list_documents()
+    ref.update({"status": "PLACING", "owner": "dead", "server_oid": None})
+    monkeypatch.setattr(orders, "_ORDER_CLAIM_TIMEOUT", timedelta(seconds=-1))
+    return ref
+
+
+def test_fresh_claim_is_left_alone(backend, profile, spec):
+    client = get_client(profile)
+    place_market_buy(client, profile, spec, _TICK)
+    (ref,) = backend.firestore.collection("order_records").list_documents()
+    ref.update({"status": "PLACING"})
+    backend.round_trips.reset()
+
+    with pytest.raises(DuplicateOrderSlot):
+        place_market_buy(client, profile, spec, _TICK)
+
+    assert backend.round_trips.total("exchange") == 0
+
+
+def test_stale_claim_is_taken_over_when_never_placed(
+    backend, profile, spec, monkeypatch
+):
+    client = get_client(profile)
+    place_market_buy(client, profile, spec, _TICK)
+    ref = _abandon_claim(backend, monkeypatch)
+    client_oid = ref.get().get("client_oid")
+    backend.exchange.orders.clear()
+
+    place_market_buy(client, profile, spec, _TICK)
+
+    (order,) = backend.exchange.orders
+    assert order["client_oid"] == client_oid
+    assert ref.get().get("status") == "ACCEPTED"
+    assert _daily_count(backend, profile, spec) == 1
+
+
+def test_stale_claim_already_placed_is_recorded_not_replaced(
+    backend, profile, spec, monkeypatch
+):
+    client = get_client(profile)
+    place_market_buy(client, profile, spec, _TICK)
+    ref = _abandon_claim(backend, monkeypatch)
+
+    with pytest.raises(DuplicateOrderSlot):
+        place_market_buy(client, profile, spec, _TICK)
+
+    (order,) = backend.exchange.orders
+    assert ref.get().get("status") == "ACCEPTED"
+    assert ref.get().get("server_oid") == order["id"]
+
+
+def test_events_without_a_slot_time_take_the_locked_path(backend, profile, spec):
+    client = get_client(profile)
+    place_market_buy(client, profile, spec)
+    place_market_buy(client, profile, spec)
+
+    assert len(backend.exchange.orders) == 2
+    assert all("slot" not in record for record in _order_records(backend))
+
+
+def test_insufficient_funds_event_is_delivered_before_returning(backend, profile, spec):
+    client = get_client(profile)
+    spec = TradeSpec(spec.get_product_id(), 1, 1_000_000.0)
+
+    place_market_buy(client, profile, spec, _TICK)
+
+    assert backend.pubsub.decoded_messages("insufficient-funds") == [
+        {"profileId": profile.get_guid()}
+    ]
+    assert _order_records(backend)[0]["status"] == "REJECTED"
@@ -0,0 +1,10 @@
+from backend.benchmarks.seed import PRODUCTS
+from backend.core.product_catalog import get_product_details
+from backend.core.profile import SANDBOX_NS
+
+
+def test_duplicated_product_is_left_out_of_the_catalog(backend):
+    backend.exchange.products = PRODUCTS + [dict(PRODUCTS[0], min_market_funds="5")]
+
+    assert get_product_details(SANDBOX_NS, PRODUCTS[0]["id"]) is None
+    assert get_product_details(SANDBOX_NS, PRODUCTS[1]["id"])["min_market_funds"] == "1"
@@ -0,0 +1,22 @@
+from backend.core.profile import (
+    SANDBOX_NS,
+    ProfileId,
+    get_or_create_profile,
+    load_profile_snapshot,
+)
+
+
+def test_recreated_profile_replaces_a_stale_cached_guid(backend):
+    old_guid = get_or_create_profile(SANDBOX_NS, "portfolio").get_guid()
+    # Deleted and recreated by another process, whose cache this one never sees
+    backend.firestore.collection("profiles").document(old_guid).delete()
+    backend.firestore.collection("profiles").document("recreated").set(
+        {"namespace": SANDBOX_NS, "identifier": "portfolio"}
+    )
+
+    profile_id = ProfileId(SANDBOX_NS, "portfolio")
+    snapshot = load_profile_snapshot(profile_id)
+
+    assert snapshot.get("identifier") == "portfolio"
+    assert profile_id.get_guid() == "recreated"
+    assert ProfileId(SANDBOX_NS, "portfolio").get_guid() == "recreated"
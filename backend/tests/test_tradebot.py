@@ -0,0 +1,27 @@
+import pytest
+
+from backend.services.tradebot import process_event_data
+
+_PROFILE = {"namespace": "SANDBOX", "identifier": "portfolio"}
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"profile": _PROFILE, "version": "2"},
+        {"profile": _PROFILE, "version": None},
+        {"profile": _PROFILE, "version": [2]},
+        {
+            "profile": _PROFILE,
+            "version": 2,
+            "product": "BTC-USD",
+            "deposit": {},
+            "scheduled_time": "2021-06-01T07:00:00Z",
+        },
+    ],
+)
+def test_malformed_events_are_rejected(data):
+    body, status = process_event_data(data)
+
+    assert status == 400
+    assert body.startswith("Bad Request")